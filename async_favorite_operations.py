@@ -0,0 +1,76 @@
+import asyncio
+
+from favorite_operations import (
+    ADD_FAVORITE_QUERY,
+    ALL_PRODUCTS_QUERY,
+    REMOVE_FAVORITE_QUERY,
+    USER_FAVORITES_QUERY,
+    add_favorite_outcome,
+    queue_favorite_change,
+    remove_favorite_outcome
+)
+from models import product_from_record
+from product_cache import cached_stream_async, invalidate_rankings
+
+async def add_favorite(driver, user_cpf, product_id):
+    """Async version of favorite_operations.add_favorite"""
+    if queue_favorite_change(driver, user_cpf, product_id, True):
+        return True
+
+    result = await driver.write_query(ADD_FAVORITE_QUERY, {
+        'cpf': user_cpf,
+        'productId': product_id
+    }, operation='add_favorite')
+
+    added = add_favorite_outcome(result, user_cpf)
+    if added:
+        invalidate_rankings(driver)
+    return added
+
+async def add_favorites(driver, user_cpf, product_ids):
+    """Add several favorites for one user concurrently; returns one bool per product"""
+    return await asyncio.gather(*(add_favorite(driver, user_cpf, product_id) for product_id in product_ids))
+
+async def iter_user_favorites(driver, user_cpf, fetch_size=None):
+    """Async version of favorite_operations.iter_user_favorites"""
+    queue = getattr(driver, 'favorite_queue', None)
+    if queue is not None:
+        # The flush waits on this event loop, so it has to run on another thread
+        await asyncio.to_thread(queue.sync, user_cpf)
+
+    async for record in driver.stream_query(USER_FAVORITES_QUERY, {'cpf': user_cpf}, fetch_size,
+                                           operation='user_favorites'):
+        yield product_from_record(record)
+
+async def get_user_favorites(driver, user_cpf):
+    """Async version of favorite_operations.get_user_favorites"""
+    return [favorite async for favorite in iter_user_favorites(driver, user_cpf)]
+
+async def iter_all_products(driver, fetch_size=None):
+    """Async version of favorite_operations.iter_all_products"""
+    async def products():
+        async for record in driver.stream_query(ALL_PRODUCTS_QUERY, fetch_size=fetch_size,
+                                               operation='all_products'):
+            yield product_from_record(record)
+
+    async for product in cached_stream_async(driver, ('all_products',), products()):
+        yield product
+
+async def get_all_products(driver):
+    """Async version of favorite_operations.get_all_products"""
+    return [product async for product in iter_all_products(driver)]
+
+async def remove_favorite(driver, user_cpf, product_id):
+    """Async version of favorite_operations.remove_favorite"""
+    if queue_favorite_change(driver, user_cpf, product_id, False):
+        return True
+
+    result = await driver.write_query(REMOVE_FAVORITE_QUERY, {
+        'cpf': user_cpf,
+        'productId': product_id
+    }, operation='remove_favorite')
+
+    removed = remove_favorite_outcome(result)
+    if removed:
+        invalidate_rankings(driver)
+    return removed
@@ -0,0 +1,10 @@
+from inventory_operations import PRODUCT_STOCK_QUERY
+
+async def get_product_stock(driver, product_id):
+    """Async version of inventory_operations.get_product_stock"""
+    result = await driver.read_query(PRODUCT_STOCK_QUERY, {'productId': product_id}, operation='product_stock')
+
+    if not result:
+        return None
+
+    return {'stock': result[0][0], 'shards': result[0][1], 'shard_stock': result[0][2]}
@@ -0,0 +1,247 @@
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from neo4j import AsyncGraphDatabase, READ_ACCESS, WRITE_ACCESS
+
+from batching import LoopWriter
+from favorite_queue import FavoriteQueue
+from identity_cache import IdentityCache
+from neo4j_connection import load_config, require_credentials
+from product_cache import ProductCache
+from query_metrics import QueryMetrics, server_time_ms
+from schema import (
+    SCHEMA_VERSION,
+    SCHEMA_VERSION_QUERY,
+    SET_SCHEMA_VERSION_QUERY,
+    schema_parameters,
+    schema_statements_after,
+    schema_version_from_result
+)
+from slow_query_log import SlowQueryLog
+
+
+async def _collect_records(tx, query, parameters):
+    """Transaction function returning every record of one statement and its summary"""
+    result = await tx.run(query, parameters)
+    records = [record async for record in result]
+    return records, await result.consume()
+
+
+class AsyncSlowQueryLog(SlowQueryLog):
+    """SlowQueryLog of an AsyncNeo4jConnection: its capture thread gets the plan on the connection's event loop"""
+
+    @staticmethod
+    def capture_plan(connection, mode, query, parameters, read_only):
+        future = asyncio.run_coroutine_threadsafe(connection.capture_plan(mode, query, parameters, read_only),
+                                                  connection.loop)
+        return future.result()
+
+
+class AsyncNeo4jConnection:
+    """
+    Neo4j connection for asyncio code, mirroring Neo4jConnection
+
+    It has the same product cache, identity cache, metrics, slow-query log
+    and favorite write-behind queue, configured the same way; only the
+    catalog snapshot is left to the sync connection. The slow-query log and
+    the queue work from threads of their own that wait on this event loop,
+    so the connection has to be created on the loop it is used from.
+    """
+
+    def __init__(self, uri, user, password, config=None):
+        require_credentials(uri, user, password)
+        self.loop = asyncio.get_running_loop()
+        self.config = load_config(config)
+        self.database = self.config['database']
+        self.fetch_size = self.config['fetch_size']
+        self.driver = AsyncGraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=self.config['max_connection_pool_size'],
+            connection_acquisition_timeout=self.config['connection_acquisition_timeout'],
+            keep_alive=self.config['keep_alive'],
+            max_transaction_retry_time=self.config['max_transaction_retry_time'],
+        )
+        # Shared by every session, so reads see this connection's committed writes
+        self.bookmarks = AsyncGraphDatabase.bookmark_manager()
+        self.product_cache = None
+        if self.config['product_cache_size'] > 0:
+            self.product_cache = ProductCache(self.config['product_cache_size'],
+                                              self.config['product_cache_ttl'],
+                                              self.config['product_cache_max_rows'])
+        self.identity_cache = None
+        if self.config['identity_cache_size'] > 0:
+            self.identity_cache = IdentityCache(self.config['identity_cache_size'],
+                                                self.config['identity_cache_not_found_ttl'])
+        self.metrics = QueryMetrics() if self.config['query_metrics'] else None
+        self.slow_queries = None
+        if self.config['slow_query_ms'] > 0 and self.config['slow_query_log']:
+            self.slow_queries = AsyncSlowQueryLog(self.config['slow_query_ms'],
+                                                  self.config['slow_query_log'],
+                                                  self.config['slow_query_log_bytes'],
+                                                  self.config['slow_query_log_backups'],
+                                                  self.config['slow_query_profile'],
+                                                  self.config['slow_query_dedupe_seconds'])
+        self.favorite_queue = None
+        if self.config['favorite_write_behind']:
+            self.favorite_queue = FavoriteQueue(LoopWriter(self, self.loop),
+                                                self.config['favorite_flush_ms'] / 1000,
+                                                self.config['favorite_flush_events'],
+                                                self.config['favorite_spool'],
+                                                self.config['favorite_max_attempts'],
+                                                self.config['favorite_max_backoff'])
+
+    async def close(self):
+        """Close the Neo4j connection (flushing the favorite queue first, writing the metrics to query_metrics_file)"""
+        try:
+            # Their last flush or plan capture waits on this event loop, so
+            # they are closed from another thread
+            if self.favorite_queue is not None:
+                await asyncio.to_thread(self.favorite_queue.close)
+        finally:
+            if self.slow_queries is not None:
+                await asyncio.to_thread(self.slow_queries.close)
+            if self.metrics is not None and self.config['query_metrics_file']:
+                self.metrics.dump(self.config['query_metrics_file'])
+            await self.driver.close()
+
+    @asynccontextmanager
+    async def session(self, access=WRITE_ACCESS, fetch_size=None):
+        """Open a session to run several statements or transactions in a row"""
+        async with self.driver.session(database=self.database,
+                                       default_access_mode=access,
+                                       fetch_size=fetch_size or self.fetch_size,
+                                       bookmark_manager=self.bookmarks) as session:
+            yield session
+
+    def _observe(self, operation, query, parameters, started, records=0, summary=None, failed=False,
+                 read_only=False, slow_ms=None):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self.metrics is not None:
+            self.metrics.record(operation, elapsed_ms, records, summary, failed)
+        if self.slow_queries is not None and not failed:
+            self.slow_queries.observe(self, operation, query, parameters,
+                                      elapsed_ms if slow_ms is None else slow_ms, read_only)
+
+    async def _measured(self, execute, query, parameters, operation, read_only=False):
+        """Await execute(query, parameters) -> (records, summary) and record it under operation"""
+        parameters = parameters or {}
+        started = time.perf_counter()
+
+        try:
+            records, summary = await execute(query, parameters)
+        except Exception:
+            self._observe(operation, query, parameters, started, failed=True)
+            raise
+
+        self._observe(operation, query, parameters, started, len(records), summary, read_only=read_only)
+        return records
+
+    async def _auto_commit(self, query, parameters):
+        async with self.session() as session:
+            return await _collect_records(session, query, parameters)
+
+    async def _read_transaction(self, query, parameters):
+        return await self.execute_read(_collect_records, query, parameters)
+
+    async def _write_transaction(self, query, parameters):
+        return await self.execute_write(_collect_records, query, parameters)
+
+    async def run_query(self, query, parameters=None, operation=None):
+        """Execute a Cypher query in an auto-commit transaction (schema and admin statements)"""
+        return await self._measured(self._auto_commit, query, parameters, operation)
+
+    async def stream_query(self, query, parameters=None, fetch_size=None, operation=None):
+        """
+        Execute a read-only Cypher query and yield its records as they arrive
+
+        Like the sync stream_query, the statement is recorded with the time
+        from the call to the end of the stream as its client time, and the
+        slow-query log judges it by the server's time.
+        """
+        parameters = parameters or {}
+        started = time.perf_counter()
+        count = 0
+        summary = None
+        failed = False
+
+        try:
+            async with self.session(READ_ACCESS, fetch_size) as session:
+                result = await session.run(query, parameters)
+                async for record in result:
+                    count += 1
+                    yield record
+                summary = await result.consume()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._observe(operation, query, parameters, started, count, summary, failed, read_only=True,
+                          slow_ms=server_time_ms(summary))
+
+    async def execute_read(self, work, *args, **kwargs):
+        """Run the coroutine function work(tx, *args, **kwargs) as one managed read transaction"""
+        async with self.session(READ_ACCESS) as session:
+            return await session.execute_read(work, *args, **kwargs)
+
+    async def execute_write(self, work, *args, **kwargs):
+        """Run the coroutine function work(tx, *args, **kwargs) as one managed write transaction"""
+        async with self.session(WRITE_ACCESS) as session:
+            return await session.execute_write(work, *args, **kwargs)
+
+    async def read_query(self, query, parameters=None, operation=None):
+        """Execute a read-only Cypher query (routable to followers)"""
+        return await self._measured(self._read_transaction, query, parameters, operation, read_only=True)
+
+    async def write_query(self, query, parameters=None, operation=None):
+        """Execute a Cypher query that writes (always sent to the leader)"""
+        return await self._measured(self._write_transaction, query, parameters, operation)
+
+    async def capture_plan(self, mode, query, parameters, read_only):
+        """Async SlowQueryLog.capture_plan: run the statement again under EXPLAIN or PROFILE and return its plan"""
+        async with self.session(READ_ACCESS if read_only else WRITE_ACCESS) as session:
+            result = await session.run(f"{mode} {query}", parameters)
+            summary = await result.consume()
+        return summary.profile if mode == 'PROFILE' else summary.plan
+
+    async def ensure_schema(self):
+        """Async equivalent of schema.ensure_schema"""
+        current_version = schema_version_from_result(
+            await self.run_query(SCHEMA_VERSION_QUERY, operation='schema.version'))
+
+        if current_version >= SCHEMA_VERSION:
+            return current_version
+
+        params = schema_parameters(self.config['legacy_order_timezone'])
+        for statement in schema_statements_after(current_version):
+            await self.run_query(statement, params, operation='schema.apply')
+
+        await self.run_query(SET_SCHEMA_VERSION_QUERY, {'version': SCHEMA_VERSION}, operation='schema.version')
+
+        print(f"Schema upgraded from version {current_version} to {SCHEMA_VERSION}")
+        return SCHEMA_VERSION
+
+async def connect_neo4j_async(config=None):
+    """Connect to Neo4j with the async driver"""
+
+    settings = load_config(config)
+    conn = None
+
+    try:
+        conn = AsyncNeo4jConnection(settings['uri'], settings['user'], settings['password'], config)
+        await conn.driver.verify_connectivity()
+        print("Connected to Neo4j successfully")
+        await conn.ensure_schema()
+        return conn
+    except Exception as e:
+        print(f"Failed to connect to Neo4j: {e}")
+        if conn is not None:
+            await conn.close()
+        return None
+
+async def close_connection_async(driver):
+    """Close an async Neo4j connection"""
+    if driver:
+        await driver.close()
@@ -0,0 +1,120 @@
+from order_operations import (
+    AVAILABLE_PRODUCTS_QUERY,
+    CREATE_ORDER_QUERY,
+    ORDER_PRODUCTS_QUERY,
+    ORDERS_PRODUCTS_QUERY,
+    USER_ORDERS_PAGE_QUERY,
+    USER_ORDERS_QUERY,
+    USER_ORDERS_WITH_ITEMS_QUERY,
+    build_create_order_params,
+    build_user_orders_page_params,
+    build_user_orders_params,
+    create_order_outcome,
+    order_page_from_rows
+)
+from models import order_from_record, order_line_from_record, order_with_lines_from_record, product_from_record
+from product_cache import apply_stock_changes, cached_stream_async
+
+async def create_order(driver, buyer_cpf, products):
+    """
+    Async version of order_operations.create_order
+
+    The buyer and every cart product are already resolved inside the single
+    order statement, so there is nothing left to fan out on the client.
+    """
+    try:
+        order_id, quantities, params = build_create_order_params(buyer_cpf, products)
+    except ValueError as e:
+        print(f"Order rejected: {e}")
+        return None
+
+    if not quantities:
+        print("No valid products for the order")
+        return None
+
+    result = await driver.write_query(CREATE_ORDER_QUERY, params, operation='create_order')
+
+    created_id = create_order_outcome(result, buyer_cpf, order_id, quantities)
+
+    if created_id:
+        apply_stock_changes(driver, quantities)
+
+    return created_id
+
+async def iter_all_products(driver, fetch_size=None):
+    """Async version of order_operations.iter_all_products"""
+    async def products():
+        async for record in driver.stream_query(AVAILABLE_PRODUCTS_QUERY, fetch_size=fetch_size,
+                                               operation='available_products'):
+            yield product_from_record(record)
+
+    async for product in cached_stream_async(driver, ('available_products',), products()):
+        yield product
+
+async def get_all_products(driver):
+    """Async version of order_operations.get_all_products"""
+    return [product async for product in iter_all_products(driver)]
+
+async def iter_user_orders(driver, buyer_cpf, fetch_size=None, since=None, until=None):
+    """Async version of order_operations.iter_user_orders"""
+    params = build_user_orders_params(buyer_cpf, since, until)
+
+    async for record in driver.stream_query(USER_ORDERS_QUERY, params, fetch_size, operation='user_orders'):
+        yield order_from_record(record)
+
+async def get_user_orders(driver, buyer_cpf, since=None, until=None):
+    """Async version of order_operations.get_user_orders"""
+    return [order async for order in iter_user_orders(driver, buyer_cpf, since=since, until=until)]
+
+async def get_user_orders_page(driver, buyer_cpf, limit=20, cursor=None, since=None, until=None):
+    """Async version of order_operations.get_user_orders_page"""
+    params = build_user_orders_page_params(buyer_cpf, limit, cursor, since, until)
+
+    result = await driver.read_query(USER_ORDERS_PAGE_QUERY, params, operation='user_orders_page')
+
+    return order_page_from_rows([order_from_record(record) for record in result], limit)
+
+async def get_order_products(driver, order_id):
+    """Async version of order_operations.get_order_products"""
+    result = await driver.read_query(ORDER_PRODUCTS_QUERY, {'orderId': order_id}, operation='order_products')
+
+    return [order_line_from_record(record) for record in result]
+
+async def get_orders_products(driver, order_ids):
+    """Async version of order_operations.get_orders_products"""
+    order_ids = list(dict.fromkeys(order_ids))
+    lines = {order_id: [] for order_id in order_ids}
+
+    if not order_ids:
+        return lines
+
+    result = await driver.read_query(ORDERS_PRODUCTS_QUERY, {'orderIds': order_ids}, operation='orders_products')
+
+    for record in result:
+        lines[record[0]].append(order_line_from_record(record[1:]))
+
+    return lines
+
+async def iter_user_orders_with_items(driver, buyer_cpf, fetch_size=None, since=None, until=None):
+    """Async version of order_operations.iter_user_orders_with_items"""
+    params = build_user_orders_params(buyer_cpf, since, until)
+
+    async for record in driver.stream_query(USER_ORDERS_WITH_ITEMS_QUERY, params, fetch_size,
+                                           operation='user_orders_with_items'):
+        yield order_with_lines_from_record(record)
+
+async def get_user_orders_with_items(driver, buyer_cpf, since=None, until=None):
+    """Async version of order_operations.get_user_orders_with_items"""
+    return [order async for order in iter_user_orders_with_items(driver, buyer_cpf, since=since, until=until)]
+
+async def get_user_orders_with_products(driver, buyer_cpf):
+    """
+    Get all orders for a user together with their products
+
+    Kept for existing callers; the orders and their line items now come
+    from the single query of get_user_orders_with_items.
+
+    Returns:
+        list: Order dictionaries with a 'products' list
+    """
+    return await get_user_orders_with_items(driver, buyer_cpf)
@@ -0,0 +1,24 @@
+from models import search_result_from_record
+from popularity_operations import TOP_PRODUCTS_BY_BRAND_QUERIES, TOP_PRODUCTS_QUERIES, _check_counter
+from product_cache import cached_list_async
+
+async def top_products(driver, by='favorites', k=10):
+    """Async version of popularity_operations.top_products"""
+    _check_counter(by)
+
+    async def load():
+        result = await driver.read_query(TOP_PRODUCTS_QUERIES[by], {'k': k}, operation='top_products')
+        return [search_result_from_record(record) for record in result]
+
+    return await cached_list_async(driver, ('top_products', by, k), load)
+
+async def top_products_by_brand(driver, brand, by='favorites', k=10):
+    """Async version of popularity_operations.top_products_by_brand"""
+    _check_counter(by)
+
+    async def load():
+        result = await driver.read_query(TOP_PRODUCTS_BY_BRAND_QUERIES[by], {'brand': brand, 'k': k},
+                                         operation='top_products_by_brand')
+        return [search_result_from_record(record) for record in result]
+
+    return await cached_list_async(driver, ('top_products_by_brand', brand, by, k), load)
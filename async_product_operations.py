@@ -0,0 +1,122 @@
+from batching import DEFAULT_BATCH_SIZE, run_batches_async
+from models import product_from_record, search_result_from_record
+from product_cache import cached_list_async, cached_stream_async, invalidate_catalog
+from product_search import search_statement
+from product_operations import (
+    INSERT_PRODUCT_QUERY,
+    INSERT_PRODUCTS_BULK_QUERY,
+    PRODUCTS_BY_PRICE_RANGE_QUERY,
+    PRODUCTS_BY_SELLER_CPF_QUERY,
+    PRODUCTS_BY_SELLER_QUERY,
+    _product_bulk_params,
+    build_price_page_query,
+    new_product_props,
+    price_page_filters,
+    price_page_from_rows,
+    report_seller_link
+)
+
+async def insert_product(driver, name, description, brand, price, stock, rating, seller_cpf=None):
+    """Async version of product_operations.insert_product"""
+
+    product_props = new_product_props(name, description, brand, price, stock, rating)
+    product_id = product_props['id']
+
+    result = await driver.write_query(INSERT_PRODUCT_QUERY, {'props': product_props, 'sellerCpf': seller_cpf or None},
+                                      operation='insert_product')
+
+    if not result:
+        return None
+
+    report_seller_link(seller_cpf, result[0][1])
+
+    invalidate_catalog(driver)
+
+    print(f"Product created with ID: {product_id}")
+    return product_id
+
+async def insert_products_bulk(driver, products, batch_size=DEFAULT_BATCH_SIZE):
+    """Async version of product_operations.insert_products_bulk"""
+    report = await run_batches_async(driver, INSERT_PRODUCTS_BULK_QUERY, products, _product_bulk_params,
+                                     batch_size, label='products', operation='insert_products_bulk')
+    report['unknown_sellers'] = sorted({record[0] for record in report.pop('records')})
+
+    if report['written']:
+        invalidate_catalog(driver)
+
+    for seller_cpf in report['unknown_sellers']:
+        print(f"Warning: Seller with CPF {seller_cpf} not found. Products created without seller.")
+
+    print(f"Products loaded: {report['written']} ({report['rows_per_sec']:.0f} rows/s), failed: {len(report['failed'])}")
+    return report
+
+async def search_products(driver, text=None, name=None, description=None, brand=None, limit=20, offset=0,
+                          infix=False):
+    """Async version of product_search.search_products"""
+    query, params = search_statement(text, name, description, brand, limit, offset, infix)
+
+    async def load():
+        result = await driver.read_query(query, params, operation='search_products')
+        return [search_result_from_record(record) for record in result]
+
+    return await cached_list_async(driver, ('search', params.get('search'), params['skip'], params['limit']), load)
+
+async def search_products_by_name(driver, name, limit=20, offset=0, infix=False):
+    """Async version of product_operations.search_products_by_name"""
+    return await search_products(driver, name=name, limit=limit, offset=offset, infix=infix)
+
+async def search_products_by_brand(driver, brand, limit=20, offset=0, infix=False):
+    """Async version of product_operations.search_products_by_brand"""
+    return await search_products(driver, brand=brand, limit=limit, offset=offset, infix=infix)
+
+async def iter_products_by_price_range(driver, min_price, max_price, fetch_size=None):
+    """Async version of product_operations.iter_products_by_price_range"""
+    params = {
+        'minPrice': float(min_price),
+        'maxPrice': float(max_price)
+    }
+
+    async def products():
+        async for record in driver.stream_query(PRODUCTS_BY_PRICE_RANGE_QUERY, params, fetch_size,
+                                               operation='products_by_price_range'):
+            yield product_from_record(record)
+
+    async for product in cached_stream_async(driver, ('price_range', params['minPrice'], params['maxPrice']),
+                                             products()):
+        yield product
+
+async def search_products_by_price_range(driver, min_price, max_price):
+    """Async version of product_operations.search_products_by_price_range"""
+    return [product async for product in iter_products_by_price_range(driver, min_price, max_price)]
+
+async def search_products_by_price_range_page(driver, min_price, max_price, limit=20, cursor=None,
+                                              brand=None, min_rating=None):
+    """Async version of product_operations.search_products_by_price_range_page"""
+    query, params = build_price_page_query(min_price, max_price, limit, cursor, brand, min_rating)
+
+    async def load():
+        result = await driver.read_query(query, params, operation='products_by_price_page')
+        return [product_from_record(record) for record in result]
+
+    key = ('price_page', float(min_price), float(max_price), limit, cursor, brand, min_rating)
+    rows = await cached_list_async(driver, key, load)
+
+    return price_page_from_rows(rows, limit, price_page_filters(min_price, max_price, brand, min_rating))
+
+async def search_products_by_seller(driver, seller_id):
+    """Async version of product_operations.search_products_by_seller"""
+    async def load():
+        result = await driver.read_query(PRODUCTS_BY_SELLER_QUERY, {'sellerId': seller_id},
+                                         operation='products_by_seller')
+        return [product_from_record(record) for record in result]
+
+    return await cached_list_async(driver, ('seller', seller_id), load)
+
+async def search_products_by_seller_cpf(driver, seller_cpf):
+    """Async version of product_operations.search_products_by_seller_cpf"""
+    async def load():
+        result = await driver.read_query(PRODUCTS_BY_SELLER_CPF_QUERY, {'sellerCpf': seller_cpf},
+                                         operation='products_by_seller_cpf')
+        return [product_from_record(record) for record in result]
+
+    return await cached_list_async(driver, ('seller_cpf', seller_cpf), load)
@@ -0,0 +1,12 @@
+from models import search_result_from_record
+from product_cache import cached_list_async
+from recommendation_operations import RECOMMEND_FOR_PRODUCT_QUERY
+
+async def recommend_for_product(driver, product_id, k=5):
+    """Async version of recommendation_operations.recommend_for_product"""
+    async def load():
+        result = await driver.read_query(RECOMMEND_FOR_PRODUCT_QUERY, {'productId': product_id, 'k': k},
+                                         operation='recommend_for_product')
+        return [search_result_from_record(record) for record in result]
+
+    return await cached_list_async(driver, ('recommend_for_product', product_id, k), load)
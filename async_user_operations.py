@@ -0,0 +1,97 @@
+import asyncio
+
+from batching import DEFAULT_BATCH_SIZE, run_batches_async
+from identity_cache import NOT_FOUND
+from models import user_from_record
+from user_operations import (
+    ADD_ADDRESS_QUERY,
+    FIND_USER_BY_CPF_QUERY,
+    INSERT_USER_QUERY,
+    INSERT_USERS_BULK_QUERY,
+    _user_bulk_params,
+    address_props,
+    forget_cpfs,
+    new_user_props
+)
+
+async def find_user_by_cpf(driver, cpf):
+    """Async version of user_operations.find_user_by_cpf"""
+    cache = getattr(driver, 'identity_cache', None)
+
+    if cache is not None:
+        identity = cache.get(cpf)
+        if identity is NOT_FOUND:
+            return None
+        if identity is not None:
+            return identity
+
+    result = await driver.read_query(FIND_USER_BY_CPF_QUERY, {'cpf': cpf}, operation='find_user_by_cpf')
+
+    identity = None
+    if result and result[0]:
+        identity = user_from_record(result[0])
+
+    if cache is not None:
+        cache.put(cpf, identity if identity is not None else NOT_FOUND)
+
+    return identity
+
+async def insert_user(driver, name, last_name, email, cpf, password, addresses=None, is_seller=False,
+                      company_name=None, cnpj=None):
+    """
+    Async version of user_operations.insert_user
+
+    The addresses are written concurrently once the user exists.
+    """
+    user_props = new_user_props(name, last_name, email, cpf, password, is_seller, company_name, cnpj)
+    user_id = user_props['id']
+
+    result = await driver.write_query(INSERT_USER_QUERY, {'props': user_props}, operation='insert_user')
+
+    if not result:
+        return None
+
+    forget_cpfs(driver, [cpf])
+
+    if addresses:
+        await asyncio.gather(*(
+            add_user_address(driver, user_id,
+                             address['street'],
+                             address['number'],
+                             address['neighborhood'],
+                             address['state'],
+                             address['zipCode'])
+            for address in addresses
+        ))
+
+    print(f"User created with ID: {user_id}")
+    return user_id
+
+async def add_user_address(driver, user_id, street, number, neighborhood, state, zip_code):
+    """Async version of user_operations.add_user_address"""
+    params = {
+        'userId': user_id,
+        'addressProps': address_props(street, number, neighborhood, state, zip_code)
+    }
+
+    result = await driver.write_query(ADD_ADDRESS_QUERY, params, operation='add_user_address')
+
+    if not result:
+        return False
+
+    print(f"Address added to user {user_id}")
+    return True
+
+async def insert_users_bulk(driver, users, batch_size=DEFAULT_BATCH_SIZE):
+    """Async version of user_operations.insert_users_bulk"""
+    report = await run_batches_async(driver, INSERT_USERS_BULK_QUERY, users, _user_bulk_params,
+                                     batch_size, label='users', operation='insert_users_bulk')
+    report.pop('records')
+
+    # A CPF may have been cached as missing before this load
+    cache = getattr(driver, 'identity_cache', None)
+    if cache is not None and report['written']:
+        cache.clear()
+
+    print(f"Users loaded: {report['written']} ({report['rows_per_sec']:.0f} rows/s), failed: {len(report['failed'])}")
+    return report
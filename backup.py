@@ -0,0 +1,65 @@
+"""
+Export the graph into compressed chunks, or restore it from them
+
+Usage:
+    python backup.py export backup/ --uri neo4j://localhost:7687 --chunk-rows 100000
+    python backup.py restore backup/ --uri neo4j://localhost:7687 --writers 8 --batch-size 5000
+
+The database is always named with --uri (credentials come from
+NEO4J_USERNAME / NEO4J_PASSWORD), never taken from the defaults.
+
+The export streams every node label and relationship type into gzipped
+JSONL chunks next to a manifest.json (see graph_export). A restore
+expects an empty database and loads the chunks of each section in
+parallel.
+"""
+import argparse
+import sys
+
+from batching import DEFAULT_BATCH_SIZE
+from graph_export import DEFAULT_CHUNK_ROWS, DEFAULT_RESTORE_WRITERS, export_graph, restore_graph
+from neo4j_connection import connect_neo4j, close_connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('export', 'restore'))
+    parser.add_argument('directory')
+    parser.add_argument('--uri', required=True, help="URI of the database to export from or restore into")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help="rows per chunk (export)")
+    parser.add_argument('--writers', type=int, default=DEFAULT_RESTORE_WRITERS,
+                        help="chunks restored in parallel (restore)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="rows per transaction (restore)")
+    parser.add_argument('--failed-out', help="write the rows that failed to restore and their errors to this file")
+    args = parser.parse_args()
+
+    driver = connect_neo4j({'uri': args.uri})
+    if not driver:
+        sys.exit(1)
+
+    try:
+        if args.command == 'export':
+            export_graph(driver, args.directory, args.chunk_rows)
+            return
+        try:
+            report = restore_graph(driver, args.directory, args.writers, args.batch_size)
+        except ValueError as e:
+            print(f"Restore refused: {e}")
+            sys.exit(1)
+    finally:
+        close_connection(driver)
+
+    if report['failed']:
+        print(f"{len(report['failed'])} rows failed")
+        if args.failed_out:
+            with open(args.failed_out, 'w', encoding='utf-8') as f:
+                for row, error in report['failed']:
+                    f.write(f"{row}\t{error}\n")
+        else:
+            for row, error in report['failed'][:20]:
+                print(f"  {row}: {error}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
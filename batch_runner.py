@@ -0,0 +1,302 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from favorite_operations import add_favorite, get_user_favorites, remove_favorite
+from inventory_operations import get_product_stock
+from models import Model
+from order_operations import create_order, get_order_products, get_user_orders
+from popularity_operations import top_products, top_products_by_brand
+from product_cache import invalidate_catalog, invalidate_rankings
+from product_operations import insert_product, search_products_by_brand, search_products_by_name
+from product_search import search_products
+from recommendation_operations import recommend_for_product
+from user_operations import find_user_by_cpf, forget_cpfs, insert_user
+
+# Operations a batch file can name. Every other field of an operation line
+# (except 'id', echoed back in its result) is passed as a keyword argument,
+# so they take the function's argument names, e.g.
+#   {"op": "create_order", "buyer_cpf": "123", "products": [{"product_id": "p1", "quantity": 2}]}
+WRITE_OPERATIONS = {
+    'create_user': insert_user,
+    'create_product': insert_product,
+    'create_order': create_order,
+    'add_favorite': add_favorite,
+    'remove_favorite': remove_favorite,
+}
+
+READ_OPERATIONS = {
+    'search': search_products,
+    'search_by_name': search_products_by_name,
+    'search_by_brand': search_products_by_brand,
+    'find_user': find_user_by_cpf,
+    'user_orders': get_user_orders,
+    'order_products': get_order_products,
+    'user_favorites': get_user_favorites,
+    'recommend': recommend_for_product,
+    'top_products': top_products,
+    'top_products_by_brand': top_products_by_brand,
+    'product_stock': get_product_stock,
+}
+
+DEFAULT_GROUP_SIZE = 100
+DEFAULT_READ_WORKERS = 8
+
+
+class TransactionDriver:
+    """
+    Stand-in for the connection that runs every statement of the operation
+    functions in one open transaction
+
+    The caches are hidden (None) so nothing is cached or invalidated before
+    the transaction commits; run_batch invalidates them afterwards.
+    """
+
+    product_cache = None
+    identity_cache = None
+    catalog_snapshot = None
+    favorite_queue = None
+
+    def __init__(self, tx):
+        self.tx = tx
+
+    def write_query(self, query, parameters=None, operation=None):
+        return list(self.tx.run(query, parameters or {}))
+
+    read_query = write_query
+
+    def stream_query(self, query, parameters=None, fetch_size=None, operation=None):
+        yield from self.tx.run(query, parameters or {})
+
+
+class OperationOutput:
+    """
+    What stdout is while a batch runs: the functions' messages go on to
+    stream, and those printed on a thread inside capture() are also kept, so
+    a rejected write can report the reason it printed
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        printed = getattr(self.local, 'printed', None)
+        if printed is not None:
+            printed.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Collect what this thread prints in the yielded list"""
+        self.local.printed = []
+        try:
+            yield self.local.printed
+        finally:
+            self.local.printed = None
+
+
+def read_operations(lines):
+    """
+    Parse operation lines into (index, op, id, arguments, error)
+
+    Malformed lines and unknown operations are kept with an error, so they
+    get a failed result in their place instead of stopping the batch.
+    """
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        index += 1
+        try:
+            entry = json.loads(line)
+            op = entry.pop('op')
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            yield index, None, None, {}, f"invalid operation: {e}"
+            continue
+        op_id = entry.pop('id', None)
+        if op not in WRITE_OPERATIONS and op not in READ_OPERATIONS:
+            yield index, op, op_id, entry, f"unknown operation: {op}"
+            continue
+        yield index, op, op_id, entry, None
+
+
+def _rejection(op, printed):
+    """The error of a write that returned None or False: the messages it printed"""
+    messages = [line.strip() for line in ''.join(printed).splitlines() if line.strip()]
+    return '; '.join(messages) or f"{op} was not applied"
+
+
+def _result(index, op, op_id, value=None, error=None, ms=0.0, transaction=None):
+    result = {'index': index, 'op': op, 'ok': error is None, 'result': value, 'ms': round(ms, 3)}
+    if op_id is not None:
+        result['id'] = op_id
+    if transaction is not None:
+        result['transaction'] = transaction
+    if error is not None:
+        result['error'] = error
+    return result
+
+
+def _write_group(driver, output, group):
+    """
+    Run write operations in one transaction; return [(value, error, ms)],
+    with the error of a write the function rejected (returned None or False)
+    """
+    def work(tx):
+        bound = TransactionDriver(tx)
+        outcomes = []
+        for _, op, _, arguments, _ in group:
+            started = time.perf_counter()
+            with output.capture() as printed:
+                value = WRITE_OPERATIONS[op](bound, **arguments)
+            error = _rejection(op, printed) if value is None or value is False else None
+            outcomes.append((value, error, (time.perf_counter() - started) * 1000))
+        return outcomes
+
+    return driver.execute_write(work)
+
+
+def _run_writes(driver, output, group, transactions):
+    """Run a group of writes, falling back to one transaction each if the shared one fails"""
+    try:
+        outcomes = _write_group(driver, output, group)
+        numbers = [transactions + 1] * len(group)
+        transactions += 1
+    except Exception:
+        outcomes = []
+        numbers = []
+        for operation in group:
+            transactions += 1
+            numbers.append(transactions)
+            started = time.perf_counter()
+            try:
+                outcomes.extend(_write_group(driver, output, [operation]))
+            except Exception as e:
+                outcomes.append((None, str(e), (time.perf_counter() - started) * 1000))
+
+    created_cpfs = [arguments.get('cpf') for (_, op, _, arguments, _), (value, error, _) in zip(group, outcomes)
+                    if op == 'create_user' and error is None]
+    if created_cpfs:
+        forget_cpfs(driver, created_cpfs)
+    if any(op in ('create_product', 'create_order') for _, op, _, _, _ in group):
+        invalidate_catalog(driver)
+    elif any(op in ('add_favorite', 'remove_favorite') and error is None
+             for (_, op, _, _, _), (_, error, _) in zip(group, outcomes)):
+        invalidate_rankings(driver)
+
+    results = [_result(index, op, op_id, value, error, ms, number)
+               for (index, op, op_id, _, _), (value, error, ms), number in zip(group, outcomes, numbers)]
+    return results, transactions
+
+
+def _read(driver, operation):
+    index, op, op_id, arguments, _ = operation
+    started = time.perf_counter()
+    try:
+        value = READ_OPERATIONS[op](driver, **arguments)
+    except Exception as e:
+        return _result(index, op, op_id, error=str(e), ms=(time.perf_counter() - started) * 1000)
+    return _result(index, op, op_id, value, ms=(time.perf_counter() - started) * 1000)
+
+
+def _json_value(value):
+    """Encode the row types (as their dictionaries) and datetimes (ISO 8601) json can't"""
+    if isinstance(value, Model):
+        return dict(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def run_batch(driver, lines, out, group_size=DEFAULT_GROUP_SIZE, workers=DEFAULT_READ_WORKERS):
+    """
+    Run a stream of operations and write one JSON result line per operation
+
+    Consecutive writes share a transaction, up to group_size of them; if the
+    shared transaction fails, its writes are retried one transaction each so
+    only the failing one reports an error. Consecutive reads run
+    concurrently on a pool of workers. A run of reads waits for the writes
+    before it and the other way round, so every operation sees the ones
+    before it. Results keep the input order; their 'ms' is the time of the
+    operation itself (for writes, inside the shared transaction) and
+    'transaction' numbers the write transactions. The functions' own
+    messages go to stderr.
+
+    A result is 'ok' unless the operation raised or was rejected: a write
+    returning None or False (an order short of stock, a favorite of an
+    unknown user) fails with the messages it printed as its 'error', while
+    a read finding nothing (find_user of an unknown CPF) is ok with a null
+    'result'.
+
+    Args:
+        driver: Neo4j connection driver
+        lines: Iterable of JSON operation lines ({"op": ..., arguments})
+        out: Text stream the results are written to
+        group_size: Most writes per transaction
+        workers: Reads run at the same time
+
+    Returns:
+        dict: 'operations', 'failed', 'transactions', 'seconds' and 'ops_per_sec'
+    """
+    start = time.perf_counter()
+    counts = {'operations': 0, 'failed': 0}
+    transactions = 0
+
+    def emit(results):
+        for result in results:
+            counts['operations'] += 1
+            counts['failed'] += not result['ok']
+            out.write(json.dumps(result, default=_json_value, ensure_ascii=False) + '\n')
+        out.flush()
+
+    output = OperationOutput(sys.stderr)
+    with ThreadPoolExecutor(workers) as pool, contextlib.redirect_stdout(output):
+        writes = []
+        reads = []
+
+        def flush_writes():
+            nonlocal transactions
+            if writes:
+                results, transactions = _run_writes(driver, output, writes, transactions)
+                emit(results)
+                writes.clear()
+
+        def flush_reads():
+            if reads:
+                emit(list(pool.map(lambda operation: _read(driver, operation), reads)))
+                reads.clear()
+
+        for operation in read_operations(lines):
+            index, op, op_id, _, error = operation
+            if error is not None:
+                flush_writes()
+                flush_reads()
+                emit([_result(index, op, op_id, error=error)])
+            elif op in WRITE_OPERATIONS:
+                flush_reads()
+                writes.append(operation)
+                if len(writes) >= group_size:
+                    flush_writes()
+            else:
+                flush_writes()
+                reads.append(operation)
+                if len(reads) >= workers * group_size:
+                    flush_reads()
+
+        flush_writes()
+        flush_reads()
+
+    seconds = time.perf_counter() - start
+    report = dict(counts, transactions=transactions, seconds=seconds,
+                  ops_per_sec=counts['operations'] / seconds if seconds > 0 else 0.0)
+    print(f"{report['operations']} operations ({report['failed']} failed, {transactions} write transactions) "
+          f"in {seconds:.2f}s ({report['ops_per_sec']:.0f} ops/s)", file=sys.stderr)
+    return report
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from itertools import islice
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class LoopWriter:
+    """
+    Synchronous write_query of an AsyncNeo4jConnection, for code running on
+    another thread: runs the connection's write_query on the event loop the
+    connection belongs to and waits for it
+    """
+
+    def __init__(self, connection, loop):
+        self.connection = connection
+        self.loop = loop
+
+    def write_query(self, query, parameters=None, operation=None):
+        future = asyncio.run_coroutine_threadsafe(self.connection.write_query(query, parameters, operation),
+                                                  self.loop)
+        return future.result()
+
+
+def iter_batches(rows, batch_size):
+    """Yield lists of at most batch_size rows from any iterable, lazily"""
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def prepare_batch(batch, prepare_row, first_row_number, failed):
+    """
+    Prepare the parameters of every row in a batch
+
+    Rows that cannot be prepared, and the None a reader yields for a row it
+    could not parse, are appended to failed as (row number, error).
+
+    Returns:
+        list: (row number, parameters) for the rows that were prepared
+    """
+    prepared = []
+    for row_number, row in enumerate(batch, first_row_number):
+        if row is None:
+            failed.append((row_number, "invalid row: malformed line"))
+            continue
+        try:
+            prepared.append((row_number, prepare_row(row)))
+        except (ValueError, KeyError, TypeError) as e:
+            failed.append((row_number, f"invalid row: {e}"))
+    return prepared
+
+
+def load_report(written, failed, records, start):
+    """Build the report returned by run_batches and run_batches_async"""
+    seconds = time.perf_counter() - start
+
+    return {
+        'written': written,
+        'failed': failed,
+        'records': records,
+        'seconds': seconds,
+        'rows_per_sec': written / seconds if seconds > 0 else 0.0
+    }
+
+
+def run_batches(driver, query, rows, prepare_row, batch_size=DEFAULT_BATCH_SIZE, label='rows', operation=None):
+    """
+    Write rows with an UNWIND $rows statement, one transaction per batch
+
+    A batch that fails is retried row by row (see write_batch) instead of
+    aborting the whole load.
+
+    Args:
+        driver: Neo4j connection driver
+        query: Cypher statement starting with UNWIND $rows AS row
+        rows: Iterable of input rows (consumed lazily)
+        prepare_row: Function converting an input row into query parameters;
+            raising ValueError/KeyError/TypeError marks the row as failed
+        batch_size: Rows per transaction
+        label: Name used in the progress output
+        operation: Operation name the batches are recorded under in the
+            connection metrics (label if None)
+
+    Returns:
+        dict: 'written', 'failed' (list of (row number, error)), 'records'
+            returned by the statement, 'seconds' and 'rows_per_sec'
+    """
+    operation = operation or label
+    start = time.perf_counter()
+    written = 0
+    failed = []
+    records = []
+    row_number = 1
+
+    for batch in iter_batches(rows, batch_size):
+        prepared = prepare_batch(batch, prepare_row, row_number, failed)
+        row_number += len(batch)
+
+        if not prepared:
+            continue
+
+        written += write_batch(driver, query, prepared, operation, failed, records)
+
+        print(f"{written} {label} written, {len(failed)} failed")
+
+    return load_report(written, failed, records, start)
+
+
+def write_batch(driver, query, prepared, operation, failed, records):
+    """
+    Write one batch of prepared rows in a single transaction
+
+    A batch that fails is retried row by row so that one bad row only loses
+    itself; those rows are appended to failed as (row number, error) and the
+    returned records are appended to records.
+
+    Returns:
+        int: Number of rows written
+    """
+    try:
+        batch_params = {'rows': [params for _, params in prepared]}
+        records.extend(driver.write_query(query, batch_params, operation=operation))
+        return len(prepared)
+    except Exception:
+        written = 0
+        for number, params in prepared:
+            try:
+                records.extend(driver.write_query(query, {'rows': [params]}, operation=operation))
+                written += 1
+            except Exception as e:
+                failed.append((number, str(e)))
+        return written
+
+
+async def run_batches_async(driver, query, rows, prepare_row, batch_size=DEFAULT_BATCH_SIZE, label='rows',
+                            operation=None):
+    """
+    Same as run_batches for an AsyncNeo4jConnection (rows is a regular iterable)
+
+    run_batches itself runs on a worker thread, writing through a
+    LoopWriter, so both share the batching and the row-by-row retry.
+    """
+    return await asyncio.to_thread(run_batches, LoopWriter(driver, asyncio.get_running_loop()), query, rows,
+                                   prepare_row, batch_size, label, operation)
@@ -0,0 +1,137 @@
+"""
+Aggregate throughput of many concurrent simulated clients on one event loop
+
+Every client repeatedly runs a mix of read operations (search by name,
+order history, favorites, order details) against the async operation
+modules. The same mix is also run sequentially with the sync modules as
+a baseline.
+
+Usage:
+    python -m benchmarks.bench_async_clients --uri neo4j://localhost:7687 --clients 200 --seconds 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import time
+
+from neo4j_connection import connect_neo4j, close_connection
+from async_neo4j_connection import connect_neo4j_async, close_connection_async
+import async_favorite_operations
+import async_order_operations
+import async_product_operations
+import favorite_operations
+import order_operations
+import product_operations
+
+
+def load_keys(driver, sample_size):
+    """Pick existing CPFs, product names and order ids to query"""
+    cpfs = [r[0] for r in driver.read_query("MATCH (u:User) RETURN u.cpf LIMIT $n", {'n': sample_size})]
+    names = [r[0] for r in driver.read_query("MATCH (p:Product) RETURN p.name LIMIT $n", {'n': sample_size})]
+    order_ids = [r[0] for r in driver.read_query("MATCH (o:Order) RETURN o.id LIMIT $n", {'n': sample_size})]
+    return cpfs, names, order_ids
+
+
+def pick_operation(rng, cpfs, names, order_ids):
+    """Choose the next operation of the mix as (kind, argument)"""
+    choices = [('search', rng.choice(names).split()[0])] if names else []
+    if cpfs:
+        choices += [('orders', rng.choice(cpfs)), ('favorites', rng.choice(cpfs))]
+    if order_ids:
+        choices.append(('order_products', rng.choice(order_ids)))
+    return rng.choice(choices)
+
+
+def run_sync(driver, operation):
+    kind, argument = operation
+    if kind == 'search':
+        product_operations.search_products_by_name(driver, argument, limit=20)
+    elif kind == 'orders':
+        order_operations.get_user_orders(driver, argument)
+    elif kind == 'favorites':
+        favorite_operations.get_user_favorites(driver, argument)
+    else:
+        order_operations.get_order_products(driver, argument)
+
+
+async def run_async(driver, operation):
+    kind, argument = operation
+    if kind == 'search':
+        await async_product_operations.search_products_by_name(driver, argument, limit=20)
+    elif kind == 'orders':
+        await async_order_operations.get_user_orders(driver, argument)
+    elif kind == 'favorites':
+        await async_favorite_operations.get_user_favorites(driver, argument)
+    else:
+        await async_order_operations.get_order_products(driver, argument)
+
+
+def sync_baseline(driver, keys, seconds):
+    """Operations per second for one sequential sync client"""
+    rng = random.Random(0)
+    done = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        run_sync(driver, pick_operation(rng, *keys))
+        done += 1
+    return done / (time.perf_counter() - start)
+
+
+async def async_clients(config, keys, clients, seconds):
+    """Operations per second across all async clients"""
+    driver = await connect_neo4j_async(config)
+    if not driver:
+        return 0.0
+
+    done = 0
+
+    async def client(seed):
+        nonlocal done
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            await run_async(driver, pick_operation(rng, *keys))
+            done += 1
+
+    try:
+        start = time.perf_counter()
+        deadline = start + seconds
+        await asyncio.gather(*(client(seed) for seed in range(clients)))
+        return done / (time.perf_counter() - start)
+    finally:
+        await close_connection_async(driver)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', required=True, help="URI of the database to query")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--pool-size', type=int, default=100)
+    args = parser.parse_args()
+
+    config = {'uri': args.uri, 'max_connection_pool_size': args.pool_size}
+
+    driver = connect_neo4j(config)
+    if not driver:
+        return
+
+    try:
+        keys = load_keys(driver, 1000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            sync_rate = sync_baseline(driver, keys, args.seconds)
+    finally:
+        close_connection(driver)
+
+    async_rate = asyncio.run(async_clients(config, keys, args.clients, args.seconds))
+
+    print(f"Sync, 1 client:               {sync_rate:10.1f} ops/s")
+    print(f"Async, {args.clients:<4} clients, 1 loop: {async_rate:10.1f} ops/s")
+    if sync_rate:
+        print(f"Speedup: {async_rate / sync_rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+create_order throughput: legacy per-item round trips vs single transaction
+
+The legacy path is the original implementation (3 + 3N auto-commit
+round trips); the new path is order_operations.create_order (one statement
+in one managed write transaction).
+
+Usage:
+    python -m benchmarks.bench_create_order --uri neo4j://localhost:7687 --orders 50
+"""
+import argparse
+import contextlib
+import io
+import time
+import uuid
+from datetime import datetime
+
+from neo4j_connection import connect_neo4j, close_connection
+from order_operations import create_order
+
+LINE_ITEM_COUNTS = (1, 10, 100)
+
+
+def legacy_create_order(driver, buyer_cpf, products):
+    """The original create_order, kept here only as a baseline"""
+    buyer_result = driver.run_query("MATCH (u:User {cpf: $cpf}) RETURN u.id", {'cpf': buyer_cpf})
+    if not buyer_result or not buyer_result[0]:
+        return None
+    buyer_id = buyer_result[0][0]
+
+    order_id = str(uuid.uuid4())
+    total_value = 0
+    order_products = []
+
+    for product_entry in products:
+        product_result = driver.run_query("MATCH (p:Product {id: $productId}) RETURN p.name, p.price",
+                                          {'productId': product_entry['product_id']})
+        if not product_result or not product_result[0]:
+            continue
+        total_value += product_result[0][1] * product_entry['quantity']
+        order_products.append({'id': product_entry['product_id'], 'quantity': product_entry['quantity']})
+
+    if not order_products:
+        return None
+
+    order_props = {
+        'id': order_id,
+        'value': total_value,
+        'status': "Pending",
+        'date': datetime.now().isoformat(),
+        'buyerId': buyer_id
+    }
+    driver.run_query("CREATE (o:Order $props) RETURN o.id", {'props': order_props})
+    driver.run_query("MATCH (u:User {id: $buyerId}), (o:Order {id: $orderId}) CREATE (u)-[:ORDERED]->(o)",
+                     {'buyerId': buyer_id, 'orderId': order_id})
+
+    for product in order_products:
+        driver.run_query("""
+        MATCH (o:Order {id: $orderId}), (p:Product {id: $productId})
+        CREATE (o)-[:CONTAINS {quantity: $quantity}]->(p)
+        """, {'orderId': order_id, 'productId': product['id'], 'quantity': product['quantity']})
+        driver.run_query("MATCH (p:Product {id: $productId}) SET p.stock = p.stock - $quantity",
+                         {'productId': product['id'], 'quantity': product['quantity']})
+
+    return order_id
+
+
+def seed(driver, product_count):
+    """Create one buyer and product_count products with plenty of stock"""
+    driver.run_query("""
+    MERGE (u:User {id: 'bench-order-buyer'})
+    SET u.cpf = 'bench-order-cpf', u.name = 'Bench', u.lastName = 'Buyer'
+    """)
+    driver.run_query("""
+    UNWIND range(0, $count - 1) AS i
+    MERGE (p:Product {id: 'bench-order-product-' + toString(i)})
+    SET p.name = 'Product ' + toString(i), p.brand = 'Bench', p.description = 'bench',
+        p.price = 10.0, p.stock = 100000000, p.rating = 3.0
+    """, {'count': product_count})
+
+
+def cleanup(driver):
+    """Remove the buyer, products and orders created by the benchmark"""
+    driver.run_query("MATCH (o:Order {buyerId: 'bench-order-buyer'}) DETACH DELETE o")
+    driver.run_query("MATCH (n) WHERE n.id STARTS WITH 'bench-order-' DETACH DELETE n")
+
+
+def measure(func, driver, cart, orders):
+    """Return orders/sec for creating `orders` orders with the given cart"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(orders):
+            func(driver, 'bench-order-cpf', cart)
+    return orders / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', required=True, help="URI of the database the benchmark seeds and writes to")
+    parser.add_argument('--orders', type=int, default=50, help="orders per measurement")
+    args = parser.parse_args()
+
+    driver = connect_neo4j({'uri': args.uri})
+    if not driver:
+        return
+
+    try:
+        seed(driver, max(LINE_ITEM_COUNTS))
+
+        print(f"{'Items':<8} {'Legacy (orders/s)':<20} {'Single tx (orders/s)':<22} {'Speedup':<8}")
+        for count in LINE_ITEM_COUNTS:
+            cart = [{'product_id': f'bench-order-product-{i}', 'quantity': 1} for i in range(count)]
+            legacy = measure(legacy_create_order, driver, cart, args.orders)
+            single = measure(create_order, driver, cart, args.orders)
+            print(f"{count:<8} {legacy:<20.1f} {single:<22.1f} {single / legacy:<8.1f}x")
+
+        cleanup(driver)
+    finally:
+        close_connection(driver)
+
+
+if __name__ == '__main__':
+    main()
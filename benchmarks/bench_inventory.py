@@ -0,0 +1,176 @@
+"""
+Flash-sale contention: concurrent create_order calls on one hot product
+
+Every thread orders one unit of the same product until the stock runs out,
+first with the stock on the product node and then with it split across
+stock shards. Reports accepted orders/sec and checks that nothing was
+oversold: units sold plus the stock left must equal the initial stock, and
+the stock left must never be negative.
+
+Sharding moves the stock updates off the product node, but every order
+still locks the product when it creates its CONTAINS relationship (and
+when it updates BOUGHT_WITH weights for multi-product carts), so on Neo4j
+the sharded case keeps queueing on the product until commit; the
+difference between the two cases is the part of the transaction that
+sharding takes off that lock. The memory backend runs every statement
+under one graph lock, so there it only measures the client side.
+
+Usage:
+    python -m benchmarks.bench_inventory --threads 32 --stock 2000 --shards 16
+    python -m benchmarks.bench_inventory --backend neo4j --uri neo4j://localhost:7687
+"""
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+from inventory_operations import get_product_stock, shard_product_stock
+from neo4j_connection import connect_neo4j, close_connection
+from order_operations import create_order
+
+PRODUCT_ID = 'bench-inventory-product'
+BUYER_CPF = 'bench-inventory-cpf'
+
+SEED_QUERY = """
+MERGE (u:User {id: 'bench-inventory-buyer'})
+SET u.cpf = $cpf, u.name = 'Bench', u.lastName = 'Buyer'
+MERGE (p:Product {id: $productId})
+SET p.name = 'Flash sale', p.brand = 'Bench', p.description = 'bench', p.price = 10.0,
+    p.stock = $stock, p.rating = 3.0, p.favoriteCount = 0, p.unitsSold = 0, p.orderCount = 0
+"""
+
+SOLD_QUERY = """
+MATCH (:Order)-[c:CONTAINS]->(:Product {id: $productId})
+RETURN coalesce(sum(c.quantity), 0)
+"""
+
+CLEANUP_QUERY = """
+MATCH (n)
+WHERE n.id IN [$productId, 'bench-inventory-buyer'] OR n.productId = $productId
+   OR n.buyerId = 'bench-inventory-buyer'
+DETACH DELETE n
+"""
+
+
+# The memory backend only answers statements it has a handler for, so the
+# connection gets these (see MEMORY_HANDLERS)
+
+def _seed_in_memory(graph, params):
+    if graph.user_by_cpf(params['cpf']) is None:
+        graph.add_user({'id': 'bench-inventory-buyer', 'cpf': params['cpf'], 'name': 'Bench', 'lastName': 'Buyer'})
+    graph.add_product({'id': params['productId'], 'name': 'Flash sale', 'brand': 'Bench', 'description': 'bench',
+                       'price': 10.0, 'stock': params['stock'], 'rating': 3.0})
+    return []
+
+
+def _sold_in_memory(graph, params):
+    return [(sum(quantity for order_id in graph.orders_by_product.get(params['productId'], ())
+                 for product_id, quantity in graph.order_lines[order_id] if product_id == params['productId']),)]
+
+
+def _cleanup_in_memory(graph, params):
+    # The graph only holds this benchmark's data, so starting over is
+    # simpler than undoing every index entry
+    graph.reset()
+    return []
+
+
+MEMORY_HANDLERS = {
+    SEED_QUERY: _seed_in_memory,
+    SOLD_QUERY: _sold_in_memory,
+    CLEANUP_QUERY: _cleanup_in_memory,
+}
+
+
+def seed(driver, stock):
+    driver.run_query(CLEANUP_QUERY, {'productId': PRODUCT_ID})
+    driver.run_query(SEED_QUERY, {'cpf': BUYER_CPF, 'productId': PRODUCT_ID, 'stock': stock})
+
+
+def flash_sale(driver, threads):
+    """Order one unit per call from every thread until the stock is gone; return (accepted, seconds)"""
+    accepted = [0] * threads
+    errors = []
+
+    def buyer(slot):
+        while True:
+            try:
+                order_id = create_order(driver, BUYER_CPF, [{'product_id': PRODUCT_ID, 'quantity': 1}])
+            except Exception as e:
+                errors.append(e)
+                return
+            if order_id is not None:
+                accepted[slot] += 1
+            elif get_product_stock(driver, PRODUCT_ID)['stock'] <= 0:
+                return
+            # else the shard picked was emptied by another buyer meanwhile; retry
+
+    workers = [threading.Thread(target=buyer, args=(slot,)) for slot in range(threads)]
+    # sys.stdout is process-wide, so it is redirected once around all threads
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = time.perf_counter() - start
+
+    if errors:
+        print(f"  {len(errors)} threads stopped on errors, first: {errors[0]}")
+
+    return sum(accepted), seconds
+
+
+def run_case(driver, label, stock, threads, shards):
+    seed(driver, stock)
+    if shards:
+        with contextlib.redirect_stdout(io.StringIO()):
+            shard_product_stock(driver, PRODUCT_ID, shards)
+
+    accepted, seconds = flash_sale(driver, threads)
+
+    sold = driver.read_query(SOLD_QUERY, {'productId': PRODUCT_ID})[0][0]
+    left = get_product_stock(driver, PRODUCT_ID)['stock']
+    consistent = sold == accepted and sold + left == stock and left >= 0
+
+    print(f"{label:<12} {accepted / seconds:>12.1f} {accepted:>9} {left:>6} {'ok' if consistent else 'OVERSOLD':>10}")
+    return consistent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=('neo4j', 'memory'), default='memory')
+    parser.add_argument('--uri', help="URI of the database the benchmark seeds and writes to")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=2000)
+    parser.add_argument('--shards', type=int, default=16)
+    args = parser.parse_args()
+    if args.backend == 'neo4j' and not args.uri:
+        parser.error("--backend neo4j needs --uri")
+
+    config = {'backend': args.backend, 'product_cache_size': 0}
+    if args.uri:
+        config['uri'] = args.uri
+
+    driver = connect_neo4j(config)
+    if not driver:
+        return
+    if driver.backend.name == 'memory':
+        driver.backend.add_handlers(MEMORY_HANDLERS)
+
+    try:
+        print(f"{args.threads} threads, {args.stock} units")
+        print(f"{'Stock':<12} {'orders/s':>12} {'accepted':>9} {'left':>6} {'check':>10}")
+        consistent = run_case(driver, 'product', args.stock, args.threads, 0)
+        consistent &= run_case(driver, f'{args.shards} shards', args.stock, args.threads, args.shards)
+        driver.run_query(CLEANUP_QUERY, {'productId': PRODUCT_ID})
+    finally:
+        close_connection(driver)
+
+    if not consistent:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Lookup latency benchmark for the id/CPF keyed operations
+
+Seeds the database with synthetic users and products (1M nodes by default),
+then times add_favorite, create_order and get_order_products, which all start
+by matching a User, Product or Order by key.
+
+Usage:
+    python -m benchmarks.bench_lookups --uri neo4j://localhost:7687 --nodes 1000000 --samples 200
+"""
+import argparse
+import random
+import statistics
+import time
+
+from neo4j_connection import connect_neo4j, close_connection
+from schema import print_index_report
+from favorite_operations import add_favorite
+from order_operations import create_order, get_order_products
+
+BATCH_SIZE = 10000
+
+
+def seed(driver, nodes):
+    """Create nodes/2 users and nodes/2 products using batched UNWIND"""
+    half = nodes // 2
+
+    user_query = """
+    UNWIND $rows AS row
+    CREATE (u:User {id: row.id, cpf: row.cpf, name: row.name, lastName: 'Bench',
+                    email: row.email, password: 'bench', isSeller: false})
+    """
+
+    product_query = """
+    UNWIND $rows AS row
+    CREATE (p:Product {id: row.id, name: row.name, description: 'bench', brand: 'Bench',
+                       price: row.price, stock: 1000000, rating: 3.0})
+    """
+
+    for start in range(0, half, BATCH_SIZE):
+        end = min(start + BATCH_SIZE, half)
+        users = [{
+            'id': f'bench-user-{i}',
+            'cpf': f'bench-cpf-{i}',
+            'name': f'User {i}',
+            'email': f'user{i}@bench.local'
+        } for i in range(start, end)]
+        products = [{
+            'id': f'bench-product-{i}',
+            'name': f'Product {i}',
+            'price': float(i % 1000)
+        } for i in range(start, end)]
+
+        driver.run_query(user_query, {'rows': users})
+        driver.run_query(product_query, {'rows': products})
+        print(f"Seeded {end * 2}/{half * 2} nodes")
+
+    return half
+
+
+def cleanup(driver):
+    """Remove every node created by the benchmark"""
+    query = """
+    MATCH (n)
+    WHERE n.id STARTS WITH 'bench-' OR n.cpf STARTS WITH 'bench-' OR n.buyerId STARTS WITH 'bench-'
+    CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+    """
+    driver.run_query(query)
+
+
+def time_calls(label, func, samples):
+    """Call func samples times and print latency percentiles in ms"""
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<20} p50 {p50:8.2f} ms   p95 {p95:8.2f} ms   max {latencies[-1]:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', required=True, help="URI of the database the benchmark seeds and writes to")
+    parser.add_argument('--nodes', type=int, default=1000000)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--skip-seed', action='store_true', help="reuse nodes from a previous run")
+    parser.add_argument('--cleanup', action='store_true', help="delete benchmark nodes afterwards")
+    args = parser.parse_args()
+
+    driver = connect_neo4j({'uri': args.uri})
+    if not driver:
+        return
+
+    try:
+        half = args.nodes // 2
+        if not args.skip_seed:
+            seed(driver, args.nodes)
+
+        print_index_report(driver)
+
+        rng = random.Random(42)
+        order_ids = []
+
+        def favorite():
+            i = rng.randrange(half)
+            add_favorite(driver, f'bench-cpf-{i}', f'bench-product-{rng.randrange(half)}')
+
+        def order():
+            i = rng.randrange(half)
+            cart = [{'product_id': f'bench-product-{rng.randrange(half)}', 'quantity': 1}]
+            order_ids.append(create_order(driver, f'bench-cpf-{i}', cart))
+
+        def order_products():
+            get_order_products(driver, rng.choice(order_ids))
+
+        time_calls('add_favorite', favorite, args.samples)
+        time_calls('create_order', order, args.samples)
+        time_calls('get_order_products', order_products, args.samples)
+
+        if args.cleanup:
+            cleanup(driver)
+    finally:
+        close_connection(driver)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Row mapping cost: per-row dicts vs slotted models.Product
+
+Maps synthetic product rows (tuples shaped like the listing projection)
+with the old dictionary mapper and with models.product_from_record, and
+reports time and peak traced memory for each. No database is needed.
+
+Usage:
+    python -m benchmarks.bench_models --rows 1000000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from models import product_from_record
+
+
+def dict_from_record(record):
+    """The original per-row dictionary mapper, kept here only as a baseline"""
+    return {
+        'id': record[0],
+        'name': record[1],
+        'description': record[2],
+        'brand': record[3],
+        'price': record[4],
+        'stock': record[5],
+        'rating': record[6]
+    }
+
+
+def synthetic_rows(count):
+    return [(f"product-{i}", f"Product {i}", "Synthetic product", f"Brand {i % 100}",
+             float(i % 5000) + 0.99, i % 250, float(i % 5)) for i in range(count)]
+
+
+def measure(mapper, rows):
+    """Return (seconds, peak bytes) for mapping every row"""
+    gc.collect()
+    start = time.perf_counter()
+    mapped = [mapper(row) for row in rows]
+    seconds = time.perf_counter() - start
+    del mapped
+
+    gc.collect()
+    tracemalloc.start()
+    mapped = [mapper(row) for row in rows]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del mapped
+
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare dict and slotted row mapping")
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows)
+
+    print(f"{'Mapper':<10} {'Seconds':>10} {'Peak MiB':>10} {'Bytes/row':>10}")
+    for label, mapper in (('dict', dict_from_record), ('Product', product_from_record)):
+        seconds, peak = measure(mapper, rows)
+        print(f"{label:<10} {seconds:>10.3f} {peak / 2**20:>10.1f} {peak / args.rows:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Seeded synthetic dataset for the benchmarks
+
+DatasetSpec splits a node budget between users, addresses, products and
+orders; favorites are edges and come on top. Every generator is driven by
+its own random.Random(seed, kind), so the same seed and scale always
+produce the same rows, and rows are yielded lazily so 10M nodes never
+have to fit in memory at once.
+
+Ids, CPFs and brands are deterministic ('bench-user-42', 'bench-cpf-42',
+'bench-product-7', 'bench-order-3', 'Bench Brand 5'), which is how the
+runner picks existing keys without querying for them and how cleanup()
+finds everything the benchmarks created.
+
+Usage:
+    python -m benchmarks.datagen --uri neo4j://localhost:7687 --nodes 100000 --seed 42
+    python -m benchmarks.datagen --uri neo4j://localhost:7687 --cleanup
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import pytz
+
+from batching import run_batches
+from neo4j_connection import connect_neo4j, close_connection
+from popularity_operations import reconcile_popularity
+from product_operations import INSERT_PRODUCTS_BULK_QUERY
+from recommendation_operations import rebuild_co_purchases
+from user_operations import INSERT_USERS_BULK_QUERY
+
+MIN_NODES = 10000
+MAX_NODES = 10000000
+DEFAULT_SEED = 42
+SEED_BATCH_SIZE = 5000
+
+NOUNS = ['Camiseta', 'Notebook', 'Cadeira', 'Livro', 'Fone', 'Mesa', 'Tênis', 'Caneca',
+         'Mochila', 'Relógio', 'Monitor', 'Teclado', 'Garrafa', 'Luminária', 'Câmera']
+ADJECTIVES = ['Azul', 'Preto', 'Pro', 'Plus', 'Mini', 'Max', 'Clássico', 'Esportivo',
+              'Compacto', 'Premium']
+STATES = ['SP', 'RJ', 'MG', 'RS', 'PR', 'BA', 'SC', 'PE', 'CE', 'GO']
+BRAND_COUNT = 200
+SELLER_RATIO = 0.05
+FAVORITES_PER_USER = 3
+MAX_ORDER_ITEMS = 4
+FIRST_ORDER_DATE = datetime(2024, 1, 1, tzinfo=pytz.utc)
+
+SEED_ORDERS_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {cpf: row.cpf})
+CREATE (u)-[:ORDERED]->(o:Order {id: row.id, status: row.status, date: row.date, buyerId: u.id})
+WITH o, row
+UNWIND row.items AS item
+MATCH (p:Product {id: item.productId})
+CREATE (o)-[:CONTAINS {quantity: item.quantity}]->(p)
+WITH o, sum(p.price * item.quantity) AS value
+SET o.value = value
+"""
+
+SEED_FAVORITES_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {cpf: row.cpf}), (p:Product {id: row.productId})
+MERGE (u)-[:FAVORITE]->(p)
+"""
+
+CLEANUP_QUERY = """
+MATCH (n)
+WHERE n.id STARTS WITH 'bench-' OR n.cpf STARTS WITH 'bench-' OR n.buyerId STARTS WITH 'bench-'
+   OR n.productId STARTS WITH 'bench-'
+   OR n.brand STARTS WITH 'Bench ' OR n.street STARTS WITH 'Bench '
+CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+"""
+
+
+# The memory backend only answers statements it has a handler for, so
+# load_dataset gives it these (see MEMORY_HANDLERS)
+
+def _seed_orders_in_memory(graph, params):
+    for row in params['rows']:
+        user = graph.user_by_cpf(row['cpf'])
+        if user is None:
+            continue
+        lines = [(graph.products[item['productId']], item['quantity'])
+                 for item in row['items'] if item['productId'] in graph.products]
+        value = sum(product['price'] * quantity for product, quantity in lines)
+        graph.add_order({'id': row['id'], 'value': value, 'status': row['status'], 'date': row['date'],
+                         'buyerId': user['id']}, user, lines)
+    return []
+
+
+def _seed_favorites_in_memory(graph, params):
+    for row in params['rows']:
+        user = graph.user_by_cpf(row['cpf'])
+        if user is not None and row['productId'] in graph.products:
+            graph.favorites.setdefault(user['id'], {})[row['productId']] = True
+    return []
+
+
+MEMORY_HANDLERS = {
+    SEED_ORDERS_QUERY: _seed_orders_in_memory,
+    SEED_FAVORITES_QUERY: _seed_favorites_in_memory,
+}
+
+
+class DatasetSpec:
+    """Node counts of a synthetic dataset of a given total size"""
+
+    def __init__(self, nodes=MIN_NODES, seed=DEFAULT_SEED):
+        if not MIN_NODES <= nodes <= MAX_NODES:
+            raise ValueError(f"nodes must be between {MIN_NODES} and {MAX_NODES}")
+
+        self.nodes = nodes
+        self.seed = seed
+        self.users = nodes // 4
+        self.addresses = nodes // 4
+        self.products = nodes // 4
+        self.orders = nodes - self.users - self.addresses - self.products
+        self.sellers = max(1, int(self.users * SELLER_RATIO))
+        self.favorites = self.users * FAVORITES_PER_USER
+
+    def rng(self, kind):
+        return random.Random(f"{self.seed}:{kind}")
+
+    def to_dict(self):
+        return {
+            'nodes': self.nodes,
+            'seed': self.seed,
+            'users': self.users,
+            'sellers': self.sellers,
+            'addresses': self.addresses,
+            'products': self.products,
+            'orders': self.orders,
+            'favorites': self.favorites
+        }
+
+
+# Deterministic keys shared by the generators and the benchmark runner
+
+def user_id(i):
+    return f'bench-user-{i}'
+
+
+def user_cpf(i):
+    return f'bench-cpf-{i}'
+
+
+def product_id(i):
+    return f'bench-product-{i}'
+
+
+def order_id(i):
+    return f'bench-order-{i}'
+
+
+def brand(i):
+    return f'Bench Brand {i}'
+
+
+def product_name(rng, i):
+    return f"{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {i}"
+
+
+def iter_users(spec):
+    """
+    Yield INSERT_USERS_BULK_QUERY rows: {'props': ..., 'addresses': [...]}
+
+    The first spec.sellers users are sellers. Each user gets 0, 1 or 2
+    addresses, about spec.addresses in total.
+    """
+    rng = spec.rng('users')
+
+    for i in range(spec.users):
+        props = {
+            'id': user_id(i),
+            'name': f"User{i}",
+            'lastName': rng.choice(['Silva', 'Souza', 'Costa', 'Santos', 'Oliveira', 'Pereira']),
+            'email': f"user{i}@bench.local",
+            'cpf': user_cpf(i),
+            'password': 'bench',
+            'isSeller': i < spec.sellers
+        }
+        if i < spec.sellers:
+            props['companyName'] = f"Bench Company {i}"
+            props['cnpj'] = f"bench-cnpj-{i}"
+
+        count = rng.randrange(3)
+        addresses = [{
+            'street': f"Bench Street {rng.randrange(1000)}",
+            'number': str(rng.randrange(1, 2000)),
+            'neighborhood': f"Bairro {rng.randrange(100)}",
+            'state': rng.choice(STATES),
+            'zipCode': f"{rng.randrange(100000000):08d}"
+        } for _ in range(count)]
+
+        yield {'props': props, 'addresses': addresses}
+
+
+def iter_products(spec):
+    """Yield INSERT_PRODUCTS_BULK_QUERY rows: {'props': ..., 'sellerCpf': ...}"""
+    rng = spec.rng('products')
+
+    for i in range(spec.products):
+        props = {
+            'id': product_id(i),
+            'name': product_name(rng, i),
+            'description': f"Produto sintético {i}",
+            'brand': brand(rng.randrange(BRAND_COUNT)),
+            'price': round(rng.lognormvariate(4.0, 1.0), 2),
+            'stock': rng.randrange(0, 500),
+            'rating': round(rng.uniform(1.0, 5.0), 1)
+        }
+        yield {'props': props, 'sellerCpf': user_cpf(rng.randrange(spec.sellers))}
+
+
+def iter_orders(spec):
+    """Yield SEED_ORDERS_QUERY rows: {'id', 'cpf', 'status', 'date', 'items'}"""
+    rng = spec.rng('orders')
+
+    for i in range(spec.orders):
+        items = {}
+        for _ in range(rng.randint(1, MAX_ORDER_ITEMS)):
+            items[product_id(rng.randrange(spec.products))] = rng.randint(1, 3)
+
+        yield {
+            'id': order_id(i),
+            'cpf': user_cpf(rng.randrange(spec.users)),
+            'status': rng.choice(['Pending', 'Pending', 'Paid', 'Shipped', 'Delivered']),
+            'date': FIRST_ORDER_DATE + timedelta(minutes=rng.randrange(525600)),
+            'items': [{'productId': pid, 'quantity': quantity} for pid, quantity in items.items()]
+        }
+
+
+def iter_favorites(spec):
+    """Yield SEED_FAVORITES_QUERY rows: {'cpf', 'productId'}"""
+    rng = spec.rng('favorites')
+
+    for _ in range(spec.favorites):
+        yield {'cpf': user_cpf(rng.randrange(spec.users)), 'productId': product_id(rng.randrange(spec.products))}
+
+
+def load_dataset(driver, spec, batch_size=SEED_BATCH_SIZE):
+    """
+    Write the whole dataset with batched UNWIND statements
+
+    Users and products go through the same bulk statements as
+    insert_users_bulk and insert_products_bulk, with the deterministic ids.
+    The seeded orders and favorites bypass create_order and add_favorite,
+    so the co-purchase weights and popularity counters are rebuilt from
+    them at the end.
+
+    Returns:
+        dict: Load report per kind ('users', 'products', 'orders', 'favorites',
+            'co_purchases', 'popularity')
+    """
+    # The runner's null connection has no backend
+    backend = getattr(driver, 'backend', None)
+    if backend is not None and backend.name == 'memory':
+        backend.add_handlers(MEMORY_HANDLERS)
+
+    reports = {}
+    for kind, query, rows in (('users', INSERT_USERS_BULK_QUERY, iter_users(spec)),
+                              ('products', INSERT_PRODUCTS_BULK_QUERY, iter_products(spec)),
+                              ('orders', SEED_ORDERS_QUERY, iter_orders(spec)),
+                              ('favorites', SEED_FAVORITES_QUERY, iter_favorites(spec))):
+        report = run_batches(driver, query, rows, lambda row: row, batch_size, label=kind)
+        report.pop('records')
+        reports[kind] = report
+
+    reports['co_purchases'] = rebuild_co_purchases(driver, batch_size)
+    reports['popularity'] = reconcile_popularity(driver, batch_size)
+
+    return reports
+
+
+def cleanup(driver):
+    """Remove every node created by the benchmarks"""
+    driver.run_query(CLEANUP_QUERY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', required=True, help="URI of the database to seed or clean up")
+    parser.add_argument('--nodes', type=int, default=MIN_NODES)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE)
+    parser.add_argument('--cleanup', action='store_true', help="delete benchmark nodes instead of seeding")
+    args = parser.parse_args()
+
+    driver = connect_neo4j({'uri': args.uri})
+    if not driver:
+        return
+
+    try:
+        if args.cleanup:
+            cleanup(driver)
+            print("Benchmark nodes removed")
+        else:
+            spec = DatasetSpec(args.nodes, args.seed)
+            print(f"Seeding {spec.to_dict()}")
+            load_dataset(driver, spec, args.batch_size)
+    finally:
+        close_connection(driver)
+
+
+if __name__ == '__main__':
+    main()
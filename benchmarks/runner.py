@@ -0,0 +1,461 @@
+"""
+Benchmark runner for every public function of the *_operations modules
+
+run: times each function against a seeded dataset and writes a JSON report
+with p50/p95/p99 latency, throughput and round trips per call.
+compare: diffs two reports and flags regressions (exit status 1 if any).
+
+Offline, use the memory backend (the in-process graph store, always seeded
+with the dataset) or the null backend, which answers every statement with
+no records, optionally after a simulated round trip (--rtt-ms), and only
+measures the client-side cost of each function and its round trips.
+
+Usage:
+    python -m benchmarks.runner run --backend neo4j --uri neo4j://localhost:7687 --nodes 100000 --seed-data --out base.json
+    python -m benchmarks.runner run --nodes 100000 --out head.json
+    python -m benchmarks.runner run --backend null --rtt-ms 1 --out head.json
+    python -m benchmarks.runner compare base.json head.json --threshold 0.10
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import math
+import platform
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+import favorite_operations
+import inventory_operations
+import order_operations
+import popularity_operations
+import product_operations
+import recommendation_operations
+import user_operations
+from benchmarks import datagen
+from benchmarks.standin import CountingConnection, NullConnection
+from neo4j_connection import connect_neo4j, close_connection
+
+OPERATION_MODULES = (user_operations, product_operations, order_operations, favorite_operations,
+                     recommendation_operations, popularity_operations, inventory_operations)
+
+# Listings of the whole catalog get this fraction of the samples
+HEAVY_SAMPLE_RATIO = 0.05
+BULK_ROWS = 100
+
+
+class Context:
+    """Random but reproducible arguments drawn from the dataset spec"""
+
+    def __init__(self, spec, rng):
+        self.spec = spec
+        self.rng = rng
+        self.serial = 0
+        self.favorites = []
+        self.sharded = []
+
+    def next_key(self):
+        self.serial += 1
+        return f"run-{self.serial}"
+
+    def user(self):
+        return self.rng.randrange(self.spec.users)
+
+    def cpf(self):
+        return datagen.user_cpf(self.user())
+
+    def seller(self):
+        return self.rng.randrange(self.spec.sellers)
+
+    def product(self):
+        return datagen.product_id(self.rng.randrange(self.spec.products))
+
+    def order(self):
+        return datagen.order_id(self.rng.randrange(self.spec.orders))
+
+    def price_range(self):
+        low = round(self.rng.uniform(10, 200), 2)
+        return low, low + 5
+
+    def new_user(self):
+        key = self.next_key()
+        return {
+            'name': 'Bench', 'last_name': 'Run', 'email': f"{key}@bench.local",
+            'cpf': f"bench-{key}", 'password': 'bench',
+            'addresses': [{'street': 'Bench Street 1', 'number': '1', 'neighborhood': 'Centro',
+                           'state': 'SP', 'zipCode': '01000000'}]
+        }
+
+    def new_product(self):
+        return {
+            'name': datagen.product_name(self.rng, self.next_key()), 'description': 'bench',
+            'brand': datagen.brand(self.rng.randrange(datagen.BRAND_COUNT)),
+            'price': 10.0, 'stock': 100, 'rating': 3.0,
+            'seller_cpf': datagen.user_cpf(self.seller())
+        }
+
+    def cart(self):
+        return [{'product_id': self.product(), 'quantity': 1} for _ in range(self.rng.randint(1, 3))]
+
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+
+def _add_favorite(driver, ctx):
+    cpf, product_id = ctx.cpf(), ctx.product()
+    favorite_operations.add_favorite(driver, cpf, product_id)
+    ctx.favorites.append((cpf, product_id))
+
+
+def _remove_favorite(driver, ctx):
+    cpf, product_id = ctx.favorites.pop() if ctx.favorites else (ctx.cpf(), ctx.product())
+    favorite_operations.remove_favorite(driver, cpf, product_id)
+
+
+def _shard_stock(driver, ctx):
+    product_id = ctx.product()
+    if inventory_operations.shard_product_stock(driver, product_id, 4):
+        ctx.sharded.append(product_id)
+
+
+def _unshard_stock(driver, ctx):
+    inventory_operations.unshard_product_stock(driver, ctx.sharded.pop() if ctx.sharded else ctx.product())
+
+
+def _search_by_name(driver, ctx):
+    product_operations.search_products_by_name(driver, ctx.rng.choice(datagen.NOUNS), limit=20)
+
+
+def _price_page(driver, ctx):
+    low, high = ctx.price_range()
+    products, cursor = product_operations.search_products_by_price_range_page(driver, low, high, limit=20)
+    if cursor:
+        product_operations.search_products_by_price_range_page(driver, low, high, limit=20, cursor=cursor)
+
+
+def _orders_page(driver, ctx):
+    cpf = ctx.cpf()
+    orders, cursor = order_operations.get_user_orders_page(driver, cpf, limit=5)
+    if cursor:
+        order_operations.get_user_orders_page(driver, cpf, limit=5, cursor=cursor)
+
+
+def _page_rows():
+    return [{'id': f"p{i}", 'price': float(i)} for i in range(21)]
+
+
+# 'module.function' -> (callable(driver, ctx), heavy). Writes come after the
+# reads of the same module so reads see the seeded data.
+SCENARIOS = {
+    'user_operations.find_user_by_cpf': (lambda d, c: user_operations.find_user_by_cpf(d, c.cpf()), False),
+    'user_operations.forget_cpfs': (lambda d, c: user_operations.forget_cpfs(d, [c.cpf()]), False),
+    'user_operations.new_user_props': (lambda d, c: user_operations.new_user_props(
+        'Bench', 'Run', 'bench@bench.local', 'bench-cpf', 'bench'), False),
+    'user_operations.address_props': (lambda d, c: user_operations.address_props(
+        'Bench Street 1', '1', 'Centro', 'SP', '01000000'), False),
+    'user_operations.insert_user': (lambda d, c: user_operations.insert_user(d, **c.new_user()), False),
+    'user_operations.add_user_address': (lambda d, c: user_operations.add_user_address(
+        d, datagen.user_id(c.user()), 'Bench Street 2', '2', 'Centro', 'SP', '01000000'), False),
+    'user_operations.insert_users_bulk': (lambda d, c: user_operations.insert_users_bulk(
+        d, [c.new_user() for _ in range(BULK_ROWS)]), False),
+
+    'product_operations.search_products_by_name': (_search_by_name, False),
+    'product_operations.search_products_by_brand': (lambda d, c: product_operations.search_products_by_brand(
+        d, datagen.brand(c.rng.randrange(datagen.BRAND_COUNT)), limit=20), False),
+    'product_operations.search_products_by_price_range': (
+        lambda d, c: product_operations.search_products_by_price_range(d, *c.price_range()), False),
+    'product_operations.iter_products_by_price_range': (
+        lambda d, c: _consume(product_operations.iter_products_by_price_range(d, *c.price_range())), False),
+    'product_operations.search_products_by_price_range_page': (_price_page, False),
+    'product_operations.search_products_by_seller': (lambda d, c: product_operations.search_products_by_seller(
+        d, datagen.user_id(c.seller())), False),
+    'product_operations.search_products_by_seller_cpf': (
+        lambda d, c: product_operations.search_products_by_seller_cpf(d, datagen.user_cpf(c.seller())), False),
+    'product_operations.new_product_props': (lambda d, c: product_operations.new_product_props(
+        'Bench', 'bench', 'Bench Brand 0', 10.0, 1, 3.0), False),
+    'product_operations.report_seller_link': (lambda d, c: product_operations.report_seller_link(
+        'bench-cpf-0', 'bench-user-0'), False),
+    'product_operations.price_page_filters': (lambda d, c: product_operations.price_page_filters(
+        10, 20, 'Bench Brand 0', 3), False),
+    'product_operations.encode_price_cursor': (lambda d, c: product_operations.encode_price_cursor(
+        12.5, 'bench-product-0', [10.0, 20.0, None, None]), False),
+    'product_operations.decode_price_cursor': (lambda d, c: product_operations.decode_price_cursor(
+        product_operations.encode_price_cursor(12.5, 'bench-product-0', [10.0, 20.0, None, None])), False),
+    'product_operations.build_price_page_query': (lambda d, c: product_operations.build_price_page_query(
+        10, 20, 20, brand='Bench Brand 0', min_rating=3), False),
+    'product_operations.price_page_from_rows': (lambda d, c: product_operations.price_page_from_rows(
+        _page_rows(), 20, [10.0, 20.0, None, None]), False),
+    'product_operations.insert_product': (lambda d, c: product_operations.insert_product(d, **c.new_product()), False),
+    'product_operations.insert_products_bulk': (lambda d, c: product_operations.insert_products_bulk(
+        d, [c.new_product() for _ in range(BULK_ROWS)]), False),
+
+    'order_operations.iter_user_orders': (lambda d, c: _consume(order_operations.iter_user_orders(d, c.cpf())), False),
+    'order_operations.get_user_orders': (lambda d, c: order_operations.get_user_orders(d, c.cpf()), False),
+    'order_operations.get_user_orders_page': (_orders_page, False),
+    'order_operations.order_time': (lambda d, c: order_operations.order_time('2024-06-01T12:00:00'), False),
+    'order_operations.build_user_orders_params': (lambda d, c: order_operations.build_user_orders_params(
+        c.cpf(), since='2024-01-01', until='2024-07-01'), False),
+    'order_operations.encode_order_cursor': (lambda d, c: order_operations.encode_order_cursor(
+        datagen.FIRST_ORDER_DATE, 'bench-order-0'), False),
+    'order_operations.decode_order_cursor': (lambda d, c: order_operations.decode_order_cursor(
+        order_operations.encode_order_cursor(datagen.FIRST_ORDER_DATE, 'bench-order-0')), False),
+    'order_operations.build_user_orders_page_params': (lambda d, c: order_operations.build_user_orders_page_params(
+        c.cpf(), 20), False),
+    'order_operations.order_page_from_rows': (lambda d, c: order_operations.order_page_from_rows(
+        [{'id': f"o{i}", 'date': datagen.FIRST_ORDER_DATE} for i in range(21)], 20), False),
+    'order_operations.get_orders_products': (lambda d, c: order_operations.get_orders_products(
+        d, [c.order() for _ in range(10)]), False),
+    'order_operations.iter_user_orders_with_items': (
+        lambda d, c: _consume(order_operations.iter_user_orders_with_items(d, c.cpf())), False),
+    'order_operations.get_user_orders_with_items': (
+        lambda d, c: order_operations.get_user_orders_with_items(d, c.cpf()), False),
+    'order_operations.get_order_products': (lambda d, c: order_operations.get_order_products(d, c.order()), False),
+    'order_operations.iter_all_products': (lambda d, c: _consume(order_operations.iter_all_products(d)), True),
+    'order_operations.get_all_products': (lambda d, c: order_operations.get_all_products(d), True),
+    'order_operations.build_create_order_params': (lambda d, c: order_operations.build_create_order_params(
+        c.cpf(), c.cart()), False),
+    'order_operations.create_order_outcome': (lambda d, c: order_operations.create_order_outcome(
+        [(['bench-product-0'], [], 10.0)], 'bench-cpf-0', 'bench-order-0', {'bench-product-0': 1}), False),
+    'order_operations.create_order': (lambda d, c: order_operations.create_order(d, c.cpf(), c.cart()), False),
+
+    'favorite_operations.iter_user_favorites': (
+        lambda d, c: _consume(favorite_operations.iter_user_favorites(d, c.cpf())), False),
+    'favorite_operations.get_user_favorites': (lambda d, c: favorite_operations.get_user_favorites(d, c.cpf()), False),
+    'favorite_operations.iter_all_products': (lambda d, c: _consume(favorite_operations.iter_all_products(d)), True),
+    'favorite_operations.get_all_products': (lambda d, c: favorite_operations.get_all_products(d), True),
+    'favorite_operations.add_favorite_outcome': (lambda d, c: favorite_operations.add_favorite_outcome(
+        [(True, 'Bench')], 'bench-cpf-0'), False),
+    'favorite_operations.remove_favorite_outcome': (lambda d, c: favorite_operations.remove_favorite_outcome(
+        [('Bench',)]), False),
+    'favorite_operations.queue_favorite_change': (lambda d, c: favorite_operations.queue_favorite_change(
+        d, c.cpf(), c.product(), True), False),
+    'favorite_operations.add_favorite': (_add_favorite, False),
+    'favorite_operations.remove_favorite': (_remove_favorite, False),
+
+    'recommendation_operations.recommend_for_product': (
+        lambda d, c: recommendation_operations.recommend_for_product(d, c.product(), k=5), False),
+    'recommendation_operations.rebuild_co_purchases': (
+        lambda d, c: recommendation_operations.rebuild_co_purchases(d), True),
+
+    'popularity_operations.top_products': (
+        lambda d, c: popularity_operations.top_products(d, c.rng.choice(list(popularity_operations.COUNTERS))),
+        False),
+    'popularity_operations.top_products_by_brand': (lambda d, c: popularity_operations.top_products_by_brand(
+        d, datagen.brand(c.rng.randrange(datagen.BRAND_COUNT)), c.rng.choice(list(popularity_operations.COUNTERS))),
+        False),
+    'popularity_operations.reconcile_popularity': (
+        lambda d, c: popularity_operations.reconcile_popularity(d), True),
+
+    'inventory_operations.sharded_total': (lambda d, c: inventory_operations.sharded_total('unitsSold'), False),
+    'inventory_operations.get_product_stock': (
+        lambda d, c: inventory_operations.get_product_stock(d, c.product()), False),
+    'inventory_operations.shard_product_stock': (_shard_stock, False),
+    'inventory_operations.unshard_product_stock': (_unshard_stock, False),
+}
+
+
+def public_functions():
+    """Every public function defined in the operation modules, as 'module.function'"""
+    names = []
+    for module in OPERATION_MODULES:
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            if function.__module__ == module.__name__ and not name.startswith('_'):
+                names.append(f"{module.__name__}.{name}")
+    return names
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def time_scenario(driver, ctx, scenario, samples):
+    """Run a scenario samples times and summarize latency (ms) and round trips"""
+    latencies = []
+    errors = []
+    round_trips = driver.round_trips
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for _ in range(samples):
+            start = time.perf_counter()
+            try:
+                scenario(driver, ctx)
+            except Exception as e:
+                # The null backend returns no rows even where Neo4j always
+                # returns one, so a failing call is recorded, not fatal
+                errors.append(f"{type(e).__name__}: {e}")
+            latencies.append((time.perf_counter() - start) * 1000)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'samples': samples,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / samples,
+        'max_ms': latencies[-1],
+        'ops_per_sec': samples / elapsed if elapsed > 0 else 0.0,
+        'round_trips_per_call': (driver.round_trips - round_trips) / samples,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None
+    }
+
+
+def open_backend(args):
+    """Connect to the chosen backend; returns (connection, close function)"""
+    if args.backend == 'null':
+        return NullConnection(args.rtt_ms / 1000), lambda connection: None
+
+    overrides = {'backend': args.backend}
+    if args.uri:
+        overrides['uri'] = args.uri
+    if args.no_cache:
+        overrides.update({'product_cache_size': 0, 'identity_cache_size': 0})
+
+    connection = connect_neo4j(overrides)
+    if not connection:
+        raise SystemExit(f"Failed to open the {args.backend} backend")
+    return connection, close_connection
+
+
+def run(args):
+    spec = datagen.DatasetSpec(args.nodes, args.seed)
+    connection, close = open_backend(args)
+    driver = CountingConnection(connection)
+
+    try:
+        # The memory backend starts empty every run
+        if args.seed_data or args.backend == 'memory':
+            with contextlib.redirect_stdout(io.StringIO()):
+                datagen.load_dataset(driver, spec)
+
+        ctx = Context(spec, random.Random(args.seed))
+        pattern = re.compile(args.only) if args.only else None
+
+        results = {}
+        for name, (scenario, heavy) in SCENARIOS.items():
+            if pattern and not pattern.search(name):
+                continue
+            samples = max(3, int(args.samples * HEAVY_SAMPLE_RATIO)) if heavy else args.samples
+            results[name] = time_scenario(driver, ctx, scenario, samples)
+            summary = results[name]
+            print(f"{name:<58} p50 {summary['p50_ms']:8.3f} ms  p99 {summary['p99_ms']:8.3f} ms  "
+                  f"{summary['round_trips_per_call']:5.2f} rt/call", file=sys.stderr)
+
+        report = {
+            'meta': {
+                'backend': args.backend,
+                'rtt_ms': args.rtt_ms if args.backend == 'null' else None,
+                'dataset': spec.to_dict(),
+                'samples': args.samples,
+                'cache': not args.no_cache,
+                'python': platform.python_version(),
+                'started': datetime.now().isoformat()
+            },
+            'results': results,
+            'unbenchmarked': [name for name in public_functions() if name not in SCENARIOS]
+        }
+    finally:
+        close(connection)
+
+    for name in report['unbenchmarked']:
+        print(f"Warning: no benchmark scenario for {name}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+def compare_reports(base, head, threshold):
+    """
+    Compare two run reports
+
+    A function regresses when its p50 or p95 grew by more than threshold
+    (a fraction) or when it makes more round trips per call.
+
+    Returns:
+        list: (name, metric, base value, head value) for every regression
+    """
+    regressions = []
+    for name, old in base['results'].items():
+        new = head['results'].get(name)
+        if new is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if new[metric] > old[metric] * (1 + threshold):
+                regressions.append((name, metric, old[metric], new[metric]))
+        if new['round_trips_per_call'] > old['round_trips_per_call']:
+            regressions.append((name, 'round_trips_per_call', old['round_trips_per_call'],
+                                new['round_trips_per_call']))
+    return regressions
+
+
+def compare(args):
+    with open(args.base, encoding='utf-8') as file:
+        base = json.load(file)
+    with open(args.head, encoding='utf-8') as file:
+        head = json.load(file)
+
+    if base['meta']['dataset'] != head['meta']['dataset'] or base['meta']['backend'] != head['meta']['backend']:
+        print("Warning: the reports used different datasets or backends")
+
+    print(f"{'Function':<58} {'p50 base':>10} {'p50 head':>10} {'change':>8}")
+    for name in sorted(set(base['results']) & set(head['results'])):
+        old, new = base['results'][name]['p50_ms'], head['results'][name]['p50_ms']
+        change = (new - old) / old if old else 0.0
+        print(f"{name:<58} {old:10.3f} {new:10.3f} {change:+8.1%}")
+
+    regressions = compare_reports(base, head, args.threshold)
+    for name, metric, old, new in regressions:
+        print(f"REGRESSION {name} {metric}: {old:.3f} -> {new:.3f}")
+
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="time every operation")
+    run_parser.add_argument('--backend', choices=('neo4j', 'memory', 'null'), default='memory')
+    run_parser.add_argument('--uri', help="URI of the database the benchmark seeds and writes to")
+    run_parser.add_argument('--rtt-ms', type=float, default=0.0, help="simulated round trip of the null backend")
+    run_parser.add_argument('--nodes', type=int, default=datagen.MIN_NODES)
+    run_parser.add_argument('--seed', type=int, default=datagen.DEFAULT_SEED)
+    run_parser.add_argument('--seed-data', action='store_true', help="load the dataset before timing")
+    run_parser.add_argument('--samples', type=int, default=200)
+    run_parser.add_argument('--only', help="regular expression selecting functions to time")
+    run_parser.add_argument('--no-cache', action='store_true', help="disable the connection caches")
+    run_parser.add_argument('--out', help="write the JSON report here instead of stdout")
+
+    compare_parser = commands.add_parser('compare', help="flag regressions between two reports")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('head')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help="allowed relative latency growth (default 0.10)")
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.backend == 'neo4j' and not args.uri:
+            run_parser.error("--backend neo4j needs --uri")
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Offline stand-ins for Neo4jConnection used by the benchmark runner
+
+NullConnection answers every statement with no records after an optional
+simulated round-trip delay, so the operation modules run their full client
+side (parameter building, mapping, caching, printing) without a server.
+CountingConnection wraps any connection and counts round trips.
+"""
+import time
+from contextlib import contextmanager
+
+
+class _NullTransaction:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def run(self, query, parameters=None, **kwargs):
+        self._connection._round_trip()
+        return []
+
+
+class NullConnection:
+    """Connection that accepts every statement and returns no records"""
+
+    def __init__(self, rtt=0.0):
+        self.rtt = rtt
+        self.fetch_size = 1000
+        self.product_cache = None
+        self.identity_cache = None
+        self.catalog_snapshot = None
+
+    def _round_trip(self):
+        if self.rtt > 0:
+            time.sleep(self.rtt)
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def session(self, access=None, fetch_size=None):
+        yield _NullTransaction(self)
+
+    def run_query(self, query, parameters=None, operation=None):
+        self._round_trip()
+        return []
+
+    def stream_query(self, query, parameters=None, fetch_size=None, operation=None):
+        self._round_trip()
+        return iter(())
+
+    def execute_read(self, work, *args, **kwargs):
+        return work(_NullTransaction(self), *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        return work(_NullTransaction(self), *args, **kwargs)
+
+    def read_query(self, query, parameters=None, operation=None):
+        return self.run_query(query, parameters)
+
+    def write_query(self, query, parameters=None, operation=None):
+        return self.run_query(query, parameters)
+
+
+class CountingConnection:
+    """
+    Wrap a connection and count the statements it sends (round trips)
+
+    A streamed query counts once however many fetch batches it pulls.
+    Every other attribute (caches, config, session) is the wrapped
+    connection's own.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def run_query(self, query, parameters=None, operation=None):
+        self.round_trips += 1
+        return self.connection.run_query(query, parameters, operation=operation)
+
+    def read_query(self, query, parameters=None, operation=None):
+        self.round_trips += 1
+        return self.connection.read_query(query, parameters, operation=operation)
+
+    def write_query(self, query, parameters=None, operation=None):
+        self.round_trips += 1
+        return self.connection.write_query(query, parameters, operation=operation)
+
+    def stream_query(self, query, parameters=None, fetch_size=None, operation=None):
+        self.round_trips += 1
+        return self.connection.stream_query(query, parameters, fetch_size, operation=operation)
+
+    def execute_read(self, work, *args, **kwargs):
+        self.round_trips += 1
+        return self.connection.execute_read(work, *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        self.round_trips += 1
+        return self.connection.execute_write(work, *args, **kwargs)
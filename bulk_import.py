@@ -0,0 +1,109 @@
+"""
+Stream users, products or orders from a JSONL or CSV file into Neo4j
+
+Usage:
+    python bulk_import.py users users.jsonl --batch-size 1000
+    python bulk_import.py products products.csv --failed-out failed.txt
+    python bulk_import.py users users.jsonl --writers 8 --checkpoint users.ckpt
+    python bulk_import.py orders orders.jsonl --writers 8 --checkpoint orders.ckpt
+
+JSONL rows use the insert_user / insert_product argument names
+(e.g. last_name, is_seller, seller_cpf, addresses); orders have buyer_cpf,
+items (list of product_id and quantity) and optionally id, status and
+date. In CSV files the addresses and items columns, when present, hold
+JSON lists.
+
+With --writers the file is loaded by parallel_loader: parser processes,
+one writer thread per partition of the rows and a checkpoint file to
+resume an interrupted load. Orders are only loaded that way.
+"""
+import argparse
+import csv
+import json
+import sys
+
+from neo4j_connection import connect_neo4j, close_connection
+from parallel_loader import DEFAULT_CHUNK_SIZE, decode_csv_row, parallel_load
+from user_operations import insert_users_bulk
+from product_operations import insert_products_bulk
+from batching import DEFAULT_BATCH_SIZE
+
+
+def read_jsonl(path):
+    """Yield one dictionary per non-empty line (None for malformed lines)"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Still yielded so the row is counted and reported as failed
+                yield None
+
+
+def read_csv(path):
+    """Yield one dictionary per CSV row, decoding the CSV-only encodings (None for malformed rows)"""
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            try:
+                yield decode_csv_row(row)
+            except ValueError:
+                # A JSON column that doesn't parse; still yielded so the row
+                # is counted and reported as failed
+                yield None
+
+
+def read_rows(path):
+    """Pick the reader from the file extension"""
+    if path.lower().endswith('.csv'):
+        return read_csv(path)
+    return read_jsonl(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=('users', 'products', 'orders'))
+    parser.add_argument('path', help="JSONL or CSV file")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--failed-out', help="write the failed row numbers and errors to this file")
+    parser.add_argument('--writers', type=int, default=0, help="load with this many parallel writers")
+    parser.add_argument('--parsers', type=int, help="parser processes for --writers (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per parser task")
+    parser.add_argument('--checkpoint', help="progress file for --writers; resumes the load if it exists")
+    args = parser.parse_args()
+
+    if args.kind == 'orders' and not args.writers:
+        parser.error("orders are only loaded with --writers")
+
+    driver = connect_neo4j()
+    if not driver:
+        sys.exit(1)
+
+    try:
+        if args.writers:
+            report = parallel_load(driver, args.kind, args.path, args.writers, args.parsers, args.batch_size,
+                                   args.chunk_size, checkpoint_path=args.checkpoint)
+        elif args.kind == 'users':
+            report = insert_users_bulk(driver, read_rows(args.path), args.batch_size)
+        else:
+            report = insert_products_bulk(driver, read_rows(args.path), args.batch_size)
+    finally:
+        close_connection(driver)
+
+    print(f"{report['written']} rows in {report['seconds']:.1f}s ({report['rows_per_sec']:.0f} rows/s)")
+
+    if report['failed']:
+        print(f"{len(report['failed'])} rows failed")
+        if args.failed_out:
+            with open(args.failed_out, 'w', encoding='utf-8') as f:
+                for row_number, error in report['failed']:
+                    f.write(f"{row_number}\t{error}\n")
+        else:
+            for row_number, error in report['failed'][:20]:
+                print(f"  row {row_number}: {error}")
+
+
+if __name__ == '__main__':
+    main()
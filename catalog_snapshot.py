@@ -0,0 +1,290 @@
+import threading
+import time
+
+import numpy as np
+
+from inventory_operations import PRODUCT_STOCK, PRODUCT_UPDATED_AT
+from models import Product
+
+SNAPSHOT_QUERY = f"""
+MATCH (p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, {PRODUCT_UPDATED_AT}
+"""
+
+# Orders of a sharded product stamp the shards they took units from, not
+# the product (see inventory_operations), so those are looked up as well
+SNAPSHOT_CHANGES_QUERY = f"""
+CALL {{
+    MATCH (p:Product)
+    WHERE p.updatedAt >= $since
+    RETURN p
+    UNION
+    MATCH (s:StockShard)
+    WHERE s.updatedAt >= $since
+    MATCH (p:Product)-[:STOCK_SHARD]->(s)
+    RETURN p
+}}
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, {PRODUCT_UPDATED_AT}
+"""
+
+# updatedAt is the start time of the writing statement, which may commit a
+# little after a refresh has already read past it; re-reading this window on
+# every refresh catches those late commits (re-applying a row is harmless)
+REFRESH_OVERLAP_MS = 5000
+
+
+class CatalogSnapshot:
+    """
+    Columnar, in-process copy of the product catalog
+
+    Price, stock and rating live in NumPy arrays and brands are interned to
+    integer codes, so listings are answered with vectorized masks and sorts
+    instead of a Cypher query per filter. The snapshot is loaded once with
+    load() and then kept current by refresh(), which only reads products
+    whose updatedAt is past the watermark of the previous read.
+
+    Products are never deleted by this application, so the snapshot only
+    ever updates or appends rows.
+    """
+
+    def __init__(self, refresh_interval=5.0):
+        self.refresh_interval = refresh_interval
+        self.watermark = None
+        self.loaded_at = None
+        self.ids = np.empty(0, dtype=object)
+        self.names = np.empty(0, dtype=object)
+        self.descriptions = np.empty(0, dtype=object)
+        self.price = np.empty(0, dtype=np.float64)
+        self.stock = np.empty(0, dtype=np.int64)
+        self.rating = np.empty(0, dtype=np.float64)
+        self.brand_codes = np.empty(0, dtype=np.int32)
+        self.brands = []
+        self._brand_codes = {}
+        self._rows_by_id = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, driver):
+        """Replace the snapshot with a full streamed export of the catalog"""
+        started = time.monotonic()
+        records = list(driver.stream_query(SNAPSHOT_QUERY, operation='catalog_snapshot.load'))
+
+        with self._lock:
+            self.brands = []
+            self._brand_codes = {}
+            self._rows_by_id = {}
+            columns = self._columns(records)
+            (self.ids, self.names, self.descriptions, self.price,
+             self.stock, self.rating, self.brand_codes) = columns
+            self._rows_by_id = {product_id: row for row, product_id in enumerate(self.ids)}
+            self.watermark = self._max_updated_at(records, None)
+            self.loaded_at = started
+
+        return len(records)
+
+    def refresh(self, driver):
+        """
+        Apply products changed since the watermark
+
+        Returns:
+            int: Number of changed products read
+        """
+        if self.watermark is None:
+            return self.load(driver)
+
+        started = time.monotonic()
+        records = list(driver.stream_query(SNAPSHOT_CHANGES_QUERY,
+                                           {'since': self.watermark - REFRESH_OVERLAP_MS},
+                                           operation='catalog_snapshot.refresh'))
+
+        with self._lock:
+            new_records = []
+            for record in records:
+                row = self._rows_by_id.get(record[0])
+                if row is None:
+                    new_records.append(record)
+                    continue
+                self.names[row] = record[1]
+                self.descriptions[row] = record[2]
+                self.brand_codes[row] = self._brand_code(record[3])
+                self.price[row] = _number(record[4])
+                self.stock[row] = record[5] or 0
+                self.rating[row] = _number(record[6])
+
+            if new_records:
+                first_row = len(self.ids)
+                columns = self._columns(new_records)
+                (self.ids, self.names, self.descriptions, self.price,
+                 self.stock, self.rating, self.brand_codes) = (
+                    np.concatenate((current, added)) for current, added in zip(
+                        (self.ids, self.names, self.descriptions, self.price,
+                         self.stock, self.rating, self.brand_codes), columns))
+                for offset, record in enumerate(new_records):
+                    self._rows_by_id[record[0]] = first_row + offset
+
+            self.watermark = self._max_updated_at(records, self.watermark)
+            self.loaded_at = started
+
+        return len(records)
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.refresh_interval
+
+    def expire(self):
+        """Make the next current_snapshot() call refresh (after writes from this process)"""
+        self.loaded_at = None
+
+    def adjust_stock(self, product_id, delta):
+        """Apply a stock change made by this process without waiting for a refresh"""
+        with self._lock:
+            row = self._rows_by_id.get(product_id)
+            if row is not None:
+                self.stock[row] += delta
+
+    def mask(self, min_price=None, max_price=None, brand=None, in_stock=False, min_rating=None):
+        """Boolean row mask combining every given filter"""
+        with self._lock:
+            selected = np.ones(len(self.ids), dtype=bool)
+
+            if min_price is not None:
+                selected &= self.price >= float(min_price)
+            if max_price is not None:
+                selected &= self.price <= float(max_price)
+            if brand is not None:
+                code = self._brand_codes.get(brand)
+                if code is None:
+                    return np.zeros(len(self.ids), dtype=bool)
+                selected &= self.brand_codes == code
+            if in_stock:
+                selected &= self.stock > 0
+            if min_rating is not None:
+                selected &= self.rating >= float(min_rating)
+
+            return selected
+
+    def products(self, rows):
+        """Build Product models for an array of row numbers, in that order"""
+        with self._lock:
+            return [Product(self.ids[row], self.names[row], self.descriptions[row],
+                            self.brands[self.brand_codes[row]], _value(self.price[row]),
+                            int(self.stock[row]), _value(self.rating[row]))
+                    for row in rows]
+
+    def price_range(self, min_price, max_price, brand=None, in_stock=False):
+        """Products in a price range, cheapest first (ties by id, like the keyset pages)"""
+        with self._lock:
+            rows = np.flatnonzero(self.mask(min_price, max_price, brand, in_stock))
+            rows = rows[np.lexsort((self.ids[rows].astype(str), self.price[rows]))]
+            return self.products(rows)
+
+    def by_brand(self, brand, in_stock=False):
+        """Products of one brand, sorted by name"""
+        return self.sorted_by('name', rows=np.flatnonzero(self.mask(brand=brand, in_stock=in_stock)))
+
+    def in_stock(self):
+        """Products with stock left, sorted by name"""
+        return self.sorted_by('name', rows=np.flatnonzero(self.mask(in_stock=True)))
+
+    def top_rated(self, n=10, brand=None, in_stock=False):
+        """The n best rated products, best first"""
+        with self._lock:
+            rows = np.flatnonzero(self.mask(brand=brand, in_stock=in_stock))
+            ratings = np.nan_to_num(self.rating[rows], nan=-np.inf)
+
+            if n < len(rows):
+                # Partial selection first, then only the n winners are sorted
+                best = np.argpartition(-ratings, n - 1)[:n]
+                rows, ratings = rows[best], ratings[best]
+
+            return self.products(rows[np.argsort(-ratings, kind='stable')])
+
+    def sorted_by(self, column, descending=False, rows=None):
+        """
+        Products sorted by 'name', 'price', 'stock' or 'rating'
+
+        Args:
+            column: Sort column
+            descending: Largest first
+            rows: Row numbers to sort (every product if None)
+        """
+        with self._lock:
+            if rows is None:
+                rows = np.arange(len(self.ids))
+
+            if column == 'name':
+                keys = self.names[rows].astype(str)
+            elif column in ('price', 'stock', 'rating'):
+                keys = getattr(self, column)[rows]
+            else:
+                raise ValueError(f"Unknown sort column: {column}")
+
+            order = np.argsort(keys, kind='stable')
+            if descending:
+                order = order[::-1]
+
+            return self.products(rows[order])
+
+    def _brand_code(self, brand):
+        code = self._brand_codes.get(brand)
+        if code is None:
+            code = len(self.brands)
+            self.brands.append(brand)
+            self._brand_codes[brand] = code
+        return code
+
+    def _columns(self, records):
+        """Column arrays (ids, names, descriptions, price, stock, rating, brand codes) for records"""
+        count = len(records)
+        ids = np.empty(count, dtype=object)
+        names = np.empty(count, dtype=object)
+        descriptions = np.empty(count, dtype=object)
+        ids[:] = [record[0] for record in records]
+        names[:] = [record[1] for record in records]
+        descriptions[:] = [record[2] for record in records]
+
+        price = np.fromiter((_number(record[4]) for record in records), dtype=np.float64, count=count)
+        stock = np.fromiter((record[5] or 0 for record in records), dtype=np.int64, count=count)
+        rating = np.fromiter((_number(record[6]) for record in records), dtype=np.float64, count=count)
+        brand_codes = np.fromiter((self._brand_code(record[3]) for record in records),
+                                  dtype=np.int32, count=count)
+
+        return ids, names, descriptions, price, stock, rating, brand_codes
+
+    @staticmethod
+    def _max_updated_at(records, watermark):
+        for record in records:
+            if record[7] is not None and (watermark is None or record[7] > watermark):
+                watermark = record[7]
+        # Products written before updatedAt existed never show up in a
+        # refresh, so a fully unstamped catalog still gets a watermark
+        return watermark if watermark is not None else 0
+
+
+def _number(value):
+    """Missing numbers are stored as NaN"""
+    return np.nan if value is None else float(value)
+
+
+def _value(number):
+    """Turn a stored float back into a Python float, or None for NaN"""
+    return None if np.isnan(number) else float(number)
+
+
+def current_snapshot(driver):
+    """
+    Return the connection's catalog snapshot, loaded and refreshed as needed
+
+    Returns None when the connection has no snapshot, in which case callers
+    query Neo4j directly.
+    """
+    snapshot = getattr(driver, 'catalog_snapshot', None)
+
+    if snapshot is None:
+        return None
+
+    if snapshot.is_stale():
+        snapshot.refresh(driver)
+
+    return snapshot
@@ -1,107 +1,166 @@
+from catalog_snapshot import current_snapshot
+from inventory_operations import PRODUCT_STOCK
+from models import product_from_record
+from product_cache import cached_stream, invalidate_rankings
 
-def add_favorite(driver, user_cpf, product_id):
-    """Add a favorite relationship between user and product"""
-   
-    user_query = """
-    MATCH (u:User {cpf: $cpf})
-    RETURN u.id, u.name
-    """
-    
-    user_result = driver.run_query(user_query, {'cpf': user_cpf})
-    
-    if not user_result or not user_result[0]:
+# Cypher statements are module constants so the async counterparts in
+# async_favorite_operations.py run exactly the same queries
+
+# Matches the user by CPF directly; both sides are optional so a single
+# round trip still tells a missing user apart from a missing product.
+# favoriteCount only moves when the relationship is actually created or
+# deleted, in the same transaction, so repeated clicks can't skew it
+ADD_FAVORITE_QUERY = """
+OPTIONAL MATCH (u:User {cpf: $cpf})
+OPTIONAL MATCH (p:Product {id: $productId})
+FOREACH (_ IN CASE WHEN u IS NULL OR p IS NULL THEN [] ELSE [1] END |
+    MERGE (u)-[:FAVORITE]->(p)
+    ON CREATE SET p.favoriteCount = coalesce(p.favoriteCount, 0) + 1
+)
+RETURN u IS NOT NULL, p.name
+"""
+
+USER_FAVORITES_QUERY = f"""
+MATCH (u:User {{cpf: $cpf}})-[:FAVORITE]->(p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating
+ORDER BY p.name
+"""
+
+ALL_PRODUCTS_QUERY = f"""
+MATCH (p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating
+ORDER BY p.name
+"""
+
+REMOVE_FAVORITE_QUERY = """
+MATCH (u:User {cpf: $cpf})-[r:FAVORITE]->(p:Product {id: $productId})
+DELETE r
+SET p.favoriteCount = CASE WHEN p.favoriteCount > 0 THEN p.favoriteCount - 1 ELSE 0 END
+RETURN p.name
+"""
+
+# Applies the coalesced final state of many (user, product) pairs at once
+# for the write-behind queue (favorite_queue.py). Each pair appears once per
+# batch, and favoriteCount moves under the same rules as the two statements
+# above. Pairs whose user or product no longer exists are skipped.
+APPLY_FAVORITES_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {cpf: row.cpf})
+MATCH (p:Product {id: row.productId})
+OPTIONAL MATCH (u)-[r:FAVORITE]->(p)
+FOREACH (_ IN CASE WHEN row.favorite AND r IS NULL THEN [1] ELSE [] END |
+    MERGE (u)-[:FAVORITE]->(p)
+    ON CREATE SET p.favoriteCount = coalesce(p.favoriteCount, 0) + 1
+)
+FOREACH (_ IN CASE WHEN NOT row.favorite AND r IS NOT NULL THEN [1] ELSE [] END |
+    DELETE r
+    SET p.favoriteCount = CASE WHEN p.favoriteCount > 0 THEN p.favoriteCount - 1 ELSE 0 END
+)
+RETURN count(*)
+"""
+
+def add_favorite_outcome(result, user_cpf):
+    """Report the result of ADD_FAVORITE_QUERY and return whether it was added"""
+    user_found, product_name = result[0][0], result[0][1]
+
+    if not user_found:
         print(f"User with CPF {user_cpf} not found")
         return False
-    
-    user_id = user_result[0][0]
-    
-   
-    favorite_query = """
-    MATCH (u:User {id: $userId}), (p:Product {id: $productId})
-    MERGE (u)-[:FAVORITE]->(p)
-    RETURN p.name
-    """
-    
-    result = driver.run_query(favorite_query, {
-        'userId': user_id,
-        'productId': product_id
-    })
-    
-    if not result or not result[0]:
+
+    if product_name is None:
         print("Failed to add favorite - product may not exist")
         return False
-    
-    print(f"Product '{result[0][0]}' added to favorites")
+
+    print(f"Product '{product_name}' added to favorites")
+    return True
+
+def remove_favorite_outcome(result):
+    """Report the result of REMOVE_FAVORITE_QUERY and return whether it was removed"""
+    if not result or not result[0]:
+        print("Favorite relationship not found")
+        return False
+
+    print(f"Removed '{result[0][0]}' from favorites")
+    return True
+
+def queue_favorite_change(driver, user_cpf, product_id, favorite):
+    """
+    Put a favorite change on the connection's write-behind queue, if it has one
+
+    Returns:
+        bool: True if the change was queued, False if it has to be written now
+    """
+    queue = getattr(driver, 'favorite_queue', None)
+    if queue is None:
+        return False
+
+    queue.put(user_cpf, product_id, favorite)
+    print(f"Product {product_id} queued to be {'added to' if favorite else 'removed from'} favorites")
     return True
 
+def add_favorite(driver, user_cpf, product_id):
+    """
+    Add a favorite relationship between user and product
+
+    With the write-behind queue enabled (favorite_write_behind) the change is
+    only queued, so the user and product are checked when it is flushed.
+    """
+    if queue_favorite_change(driver, user_cpf, product_id, True):
+        return True
+
+    result = driver.write_query(ADD_FAVORITE_QUERY, {
+        'cpf': user_cpf,
+        'productId': product_id
+    }, operation='add_favorite')
+
+    added = add_favorite_outcome(result, user_cpf)
+    if added:
+        invalidate_rankings(driver)
+    return added
+
+def iter_user_favorites(driver, user_cpf, fetch_size=None):
+    """Stream all favorites for a user"""
+    queue = getattr(driver, 'favorite_queue', None)
+    if queue is not None:
+        # Read your own writes: changes still queued for this user go first
+        queue.sync(user_cpf)
+
+    for record in driver.stream_query(USER_FAVORITES_QUERY, {'cpf': user_cpf}, fetch_size,
+                                      operation='user_favorites'):
+        yield product_from_record(record)
+
 def get_user_favorites(driver, user_cpf):
     """Get all favorites for a user"""
-    query = """
-    MATCH (u:User {cpf: $cpf})-[:FAVORITE]->(p:Product)
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.rating
-    ORDER BY p.name
-    """
-    
-    result = driver.run_query(query, {'cpf': user_cpf})
-    
-    if not result:
-        return []
-    
-    favorites = []
-    for record in result:
-        favorites.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'rating': record[5]
-        })
-    
-    return favorites
+    return list(iter_user_favorites(driver, user_cpf))
+
+def iter_all_products(driver, fetch_size=None):
+    """Stream all products"""
+    snapshot = current_snapshot(driver)
+    if snapshot is not None:
+        yield from snapshot.sorted_by('name')
+        return
+
+    products = (product_from_record(record)
+                for record in driver.stream_query(ALL_PRODUCTS_QUERY, fetch_size=fetch_size,
+                                                   operation='all_products'))
+
+    yield from cached_stream(driver, ('all_products',), products)
 
 def get_all_products(driver):
     """Get all products"""
-    query = """
-    MATCH (p:Product)
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.rating
-    ORDER BY p.name
-    """
-    
-    result = driver.run_query(query)
-    
-    if not result:
-        return []
-    
-    products = []
-    for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'rating': record[5]
-        })
-    
-    return products
+    return list(iter_all_products(driver))
 
 def remove_favorite(driver, user_cpf, product_id):
-    """Remove a favorite relationship"""
-    query = """
-    MATCH (u:User {cpf: $cpf})-[r:FAVORITE]->(p:Product {id: $productId})
-    DELETE r
-    RETURN p.name
-    """
-    
-    result = driver.run_query(query, {
+    """Remove a favorite relationship (only queued with the write-behind queue enabled)"""
+    if queue_favorite_change(driver, user_cpf, product_id, False):
+        return True
+
+    result = driver.write_query(REMOVE_FAVORITE_QUERY, {
         'cpf': user_cpf,
         'productId': product_id
-    })
-    
-    if not result or not result[0]:
-        print("Favorite relationship not found")
-        return False
-    
-    print(f"Removed '{result[0][0]}' from favorites")
-    return True
\ No newline at end of file
+    }, operation='remove_favorite')
+
+    removed = remove_favorite_outcome(result)
+    if removed:
+        invalidate_rankings(driver)
+    return removed
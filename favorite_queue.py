@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+import time
+
+from batching import write_batch
+from favorite_operations import APPLY_FAVORITES_QUERY
+from product_cache import invalidate_rankings
+
+
+class FavoriteQueue:
+    """
+    Write-behind queue for favorite changes
+
+    add_favorite/remove_favorite put (cpf, product id) -> favorite? here
+    instead of writing. Changes to the same pair coalesce, so only the last
+    state is written, and a background thread applies everything pending
+    with one UNWIND statement once the oldest change is flush_interval
+    seconds old or flush_events changes have arrived.
+
+    Queued changes are lost if the process dies, unless spool_path is set:
+    every change is then also appended to that file and replayed into the
+    queue on the next start. After each flush the file is rewritten with
+    only the changes still pending, so it never grows past what a busy
+    queue holds. close() flushes whatever is still pending.
+
+    A failed batch is retried pair by pair (see batching.write_batch), and
+    the background thread waits twice as long after every failed flush, up
+    to max_backoff seconds. A pair that failed max_attempts times is dropped
+    and counted in dropped; a newer change to it starts over.
+    """
+
+    def __init__(self, driver, flush_interval=0.01, flush_events=500, spool_path=None, max_attempts=10,
+                 max_backoff=30.0):
+        self.driver = driver
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.spool_path = spool_path
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.flushes = 0
+        self.written = 0
+        self.dropped = 0
+        self._pending = {}
+        self._attempts = {}
+        self._in_flight = {}
+        self._events = 0
+        self._first_at = None
+        self._closed = False
+        self._changed = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._spool = None
+
+        if spool_path:
+            self._replay_spool()
+            self._spool = open(spool_path, 'a', encoding='utf-8')
+
+        self._worker = threading.Thread(target=self._run, name='favorite-queue', daemon=True)
+        self._worker.start()
+
+    def __len__(self):
+        with self._changed:
+            return len(self._pending)
+
+    def put(self, cpf, product_id, favorite):
+        """Queue the new state of one favorite (True added, False removed)"""
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("Favorite queue is closed")
+            if self._spool is not None:
+                self._spool.write(json.dumps([cpf, product_id, favorite]) + '\n')
+                self._spool.flush()
+            self._attempts.pop((cpf, product_id), None)
+            self._enqueue(cpf, product_id, favorite)
+
+    def sync(self, cpf):
+        """Write the changes queued or being written for one user before reading them"""
+        with self._changed:
+            waiting = any(key[0] == cpf for key in self._pending) or any(key[0] == cpf for key in self._in_flight)
+        if waiting:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every pending change now
+
+        Pairs that fail are queued again (under any newer change to them)
+        and a RuntimeError reports them once the others are written.
+
+        Returns:
+            int: Number of (user, product) pairs written
+        """
+        with self._flush_lock:
+            with self._changed:
+                batch, self._pending = self._pending, {}
+                self._in_flight = batch
+                self._events = 0
+                self._first_at = None
+
+            if not batch:
+                return 0
+
+            prepared = [(key, {'cpf': key[0], 'productId': key[1], 'favorite': favorite})
+                        for key, favorite in batch.items()]
+            failed = []
+            written = write_batch(self.driver, APPLY_FAVORITES_QUERY, prepared, 'flush_favorites', failed, [])
+
+            with self._changed:
+                dropped = []
+                for key, _ in failed:
+                    if key in self._pending:
+                        continue  # a newer change replaces the one that failed
+                    attempts = self._attempts.get(key, 0) + 1
+                    if attempts < self.max_attempts:
+                        self._attempts[key] = attempts
+                        self._enqueue(key[0], key[1], batch[key])
+                    else:
+                        self._attempts.pop(key, None)
+                        dropped.append(key)
+                for key in batch:
+                    if key not in self._pending:
+                        self._attempts.pop(key, None)
+                self._in_flight = {}
+                self.flushes += 1
+                self.written += written
+                self.dropped += len(dropped)
+                self._rewrite_spool()
+
+            if written:
+                invalidate_rankings(self.driver)
+            if dropped:
+                print(f"Dropped {len(dropped)} favorite changes after {self.max_attempts} failed attempts")
+            if failed:
+                raise RuntimeError(f"{len(failed)} favorite changes failed, first: {failed[0][1]}")
+
+            return written
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        with self._changed:
+            if self._closed:
+                return
+            self._closed = True
+            self._changed.notify()
+        self._worker.join()
+
+        try:
+            self.flush()
+        finally:
+            if self._spool is not None:
+                self._spool.close()
+
+    def _enqueue(self, cpf, product_id, favorite):
+        if self._first_at is None:
+            self._first_at = time.monotonic()
+        self._pending[(cpf, product_id)] = favorite
+        self._events += 1
+        self._changed.notify()
+
+    def _rewrite_spool(self):
+        # Called with self._changed held, so no put() appends meanwhile
+        if self._spool is None:
+            return
+
+        self._spool.close()
+        temporary = f"{self.spool_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as spool:
+            for (cpf, product_id), favorite in self._pending.items():
+                spool.write(json.dumps([cpf, product_id, favorite]) + '\n')
+        os.replace(temporary, self.spool_path)
+        self._spool = open(self.spool_path, 'a', encoding='utf-8')
+
+    def _replay_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+
+        with open(self.spool_path, encoding='utf-8') as spool, self._changed:
+            for line in spool:
+                try:
+                    cpf, product_id, favorite = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                self._enqueue(cpf, product_id, favorite)
+
+        if self._pending:
+            print(f"{len(self._pending)} favorite changes recovered from {self.spool_path}")
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._changed:
+                while not self._pending and not self._closed:
+                    self._changed.wait()
+                if self._closed:
+                    return
+                while self._events < self.flush_events and not self._closed:
+                    remaining = self._first_at + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                if self._closed:
+                    return
+
+            try:
+                self.flush()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                backoff = min(self.max_backoff, self.flush_interval * 2 ** failures)
+                print(f"Favorite flush failed, retrying in {backoff:.2f}s: {e}")
+                with self._changed:
+                    self._changed.wait_for(lambda: self._closed, backoff)
@@ -0,0 +1,327 @@
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+from batching import DEFAULT_BATCH_SIZE, iter_batches, write_batch
+from order_operations import order_time
+from product_cache import invalidate_catalog
+
+# A graph export is a directory holding manifest.json and, per section,
+# gzipped JSONL chunks of at most chunk_rows rows (<section>-00000.jsonl.gz,
+# ...). Every line is the record the section's export statement returned,
+# as a JSON array: [properties] for nodes, [from id, properties] for nodes
+# hanging off another one and [from id, to id(, property)] for relationships.
+# The manifest is written last, so an interrupted export has none.
+EXPORT_FORMAT = 1
+
+EXPORT_USERS_QUERY = """
+MATCH (u:User)
+RETURN properties(u)
+"""
+
+EXPORT_PRODUCTS_QUERY = """
+MATCH (p:Product)
+RETURN properties(p)
+"""
+
+EXPORT_ORDERS_QUERY = """
+MATCH (o:Order)
+RETURN properties(o)
+"""
+
+EXPORT_ADDRESSES_QUERY = """
+MATCH (u:User)-[:HAS_ADDRESS]->(a:Address)
+RETURN u.id, properties(a)
+"""
+
+EXPORT_STOCK_SHARDS_QUERY = """
+MATCH (p:Product)-[:STOCK_SHARD]->(s:StockShard)
+RETURN p.id, properties(s)
+"""
+
+EXPORT_SELLS_QUERY = """
+MATCH (u:User)-[:SELLS]->(p:Product)
+RETURN u.id, p.id
+"""
+
+EXPORT_ORDERED_QUERY = """
+MATCH (u:User)-[:ORDERED]->(o:Order)
+RETURN u.id, o.id
+"""
+
+EXPORT_CONTAINS_QUERY = """
+MATCH (o:Order)-[c:CONTAINS]->(p:Product)
+RETURN o.id, p.id, c.quantity
+"""
+
+EXPORT_FAVORITES_QUERY = """
+MATCH (u:User)-[:FAVORITE]->(p:Product)
+RETURN u.id, p.id
+"""
+
+EXPORT_BOUGHT_WITH_QUERY = """
+MATCH (a:Product)-[r:BOUGHT_WITH]->(b:Product)
+RETURN a.id, b.id, r.weight
+"""
+
+RESTORE_USERS_QUERY = """
+UNWIND $rows AS row
+CREATE (u:User)
+SET u = row[0]
+"""
+
+RESTORE_PRODUCTS_QUERY = """
+UNWIND $rows AS row
+CREATE (p:Product)
+SET p = row[0]
+"""
+
+RESTORE_ORDERS_QUERY = """
+UNWIND $rows AS row
+CREATE (o:Order)
+SET o = row[0]
+"""
+
+RESTORE_ADDRESSES_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {id: row[0]})
+CREATE (u)-[:HAS_ADDRESS]->(a:Address)
+SET a = row[1]
+"""
+
+RESTORE_STOCK_SHARDS_QUERY = """
+UNWIND $rows AS row
+MATCH (p:Product {id: row[0]})
+CREATE (p)-[:STOCK_SHARD]->(s:StockShard)
+SET s = row[1]
+"""
+
+RESTORE_SELLS_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {id: row[0]}), (p:Product {id: row[1]})
+CREATE (u)-[:SELLS]->(p)
+"""
+
+RESTORE_ORDERED_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {id: row[0]}), (o:Order {id: row[1]})
+CREATE (u)-[:ORDERED]->(o)
+"""
+
+RESTORE_CONTAINS_QUERY = """
+UNWIND $rows AS row
+MATCH (o:Order {id: row[0]}), (p:Product {id: row[1]})
+CREATE (o)-[:CONTAINS {quantity: row[2]}]->(p)
+"""
+
+RESTORE_FAVORITES_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {id: row[0]}), (p:Product {id: row[1]})
+CREATE (u)-[:FAVORITE]->(p)
+"""
+
+RESTORE_BOUGHT_WITH_QUERY = """
+UNWIND $rows AS row
+MATCH (a:Product {id: row[0]}), (b:Product {id: row[1]})
+CREATE (a)-[:BOUGHT_WITH {weight: row[2]}]->(b)
+"""
+
+# The restore statements CREATE, so they are only run against a database
+# holding none of the exported labels
+GRAPH_IS_EMPTY_QUERY = """
+RETURN NOT EXISTS {
+    MATCH (n)
+    WHERE n:User OR n:Product OR n:Order OR n:Address OR n:StockShard
+}
+"""
+
+
+def _restore_order(row):
+    # JSON has no datetime; the export wrote Order.date as ISO 8601
+    if row[0].get('date') is not None:
+        row[0]['date'] = order_time(row[0]['date'])
+    return row
+
+
+# (section, export statement, restore statement, row conversion or None), in
+# restore order: every section only refers to nodes of the sections before it
+SECTIONS = (
+    ('users', EXPORT_USERS_QUERY, RESTORE_USERS_QUERY, None),
+    ('products', EXPORT_PRODUCTS_QUERY, RESTORE_PRODUCTS_QUERY, None),
+    ('orders', EXPORT_ORDERS_QUERY, RESTORE_ORDERS_QUERY, _restore_order),
+    ('addresses', EXPORT_ADDRESSES_QUERY, RESTORE_ADDRESSES_QUERY, None),
+    ('stock_shards', EXPORT_STOCK_SHARDS_QUERY, RESTORE_STOCK_SHARDS_QUERY, None),
+    ('sells', EXPORT_SELLS_QUERY, RESTORE_SELLS_QUERY, None),
+    ('ordered', EXPORT_ORDERED_QUERY, RESTORE_ORDERED_QUERY, None),
+    ('contains', EXPORT_CONTAINS_QUERY, RESTORE_CONTAINS_QUERY, None),
+    ('favorites', EXPORT_FAVORITES_QUERY, RESTORE_FAVORITES_QUERY, None),
+    ('bought_with', EXPORT_BOUGHT_WITH_QUERY, RESTORE_BOUGHT_WITH_QUERY, None),
+)
+
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_CHUNK_ROWS = 100000
+DEFAULT_RESTORE_WRITERS = 4
+# Fast compression: exports are bound by CPU, not disk
+COMPRESS_LEVEL = 1
+
+
+def _json_value(value):
+    """Encode the temporal values json can't (neo4j DateTime or datetime) as ISO 8601"""
+    if hasattr(value, 'to_native'):
+        value = value.to_native()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot export value of type {type(value).__name__}")
+
+
+def _rate(rows, seconds):
+    return rows / seconds if seconds > 0 else 0.0
+
+
+def export_graph(driver, directory, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Export the User/Address/Product/Order graph into a directory of chunks
+
+    Every section is streamed with its own read transaction and written as
+    it arrives, so memory stays constant; the export is only consistent
+    across sections if nothing writes meanwhile.
+
+    Args:
+        driver: Neo4j connection driver
+        directory: Target directory (created if missing)
+        chunk_rows: Rows per chunk file
+
+    Returns:
+        dict: 'rows', 'seconds', 'rows_per_sec' and 'sections' (rows, chunks
+            and seconds of each)
+    """
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    sections = {}
+
+    for name, export_query, _, _ in SECTIONS:
+        section_start = time.perf_counter()
+        chunks = []
+        rows = 0
+        out = None
+
+        try:
+            for record in driver.stream_query(export_query, operation=f"export_graph.{name}"):
+                if rows % chunk_rows == 0:
+                    if out is not None:
+                        out.close()
+                    chunks.append(f"{name}-{len(chunks):05d}.jsonl.gz")
+                    out = gzip.open(os.path.join(directory, chunks[-1]), 'wt', encoding='utf-8',
+                                    compresslevel=COMPRESS_LEVEL)
+                out.write(json.dumps(list(record), default=_json_value, separators=(',', ':')) + '\n')
+                rows += 1
+        finally:
+            if out is not None:
+                out.close()
+
+        seconds = time.perf_counter() - section_start
+        sections[name] = {'rows': rows, 'chunks': chunks, 'seconds': seconds}
+        print(f"Exported {rows} {name} in {len(chunks)} chunks ({_rate(rows, seconds):.0f} rows/s)")
+
+    seconds = time.perf_counter() - start
+    total = sum(section['rows'] for section in sections.values())
+    manifest = {
+        'format': EXPORT_FORMAT,
+        'created': datetime.now(pytz.utc).isoformat(),
+        'rows': total,
+        'seconds': seconds,
+        'sections': sections,
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Export finished: {total} rows in {seconds:.1f}s ({_rate(total, seconds):.0f} rows/s)")
+    return {'rows': total, 'seconds': seconds, 'rows_per_sec': _rate(total, seconds), 'sections': sections}
+
+
+def _restore_chunk(driver, directory, chunk, restore_query, convert, batch_size, operation):
+    written = 0
+    failed = []
+    records = []
+
+    with gzip.open(os.path.join(directory, chunk), 'rt', encoding='utf-8') as f:
+        rows = ((f"{chunk}:{line_number}", json.loads(line)) for line_number, line in enumerate(f, 1))
+        for batch in iter_batches(rows, batch_size):
+            if convert is not None:
+                batch = [(row_number, convert(row)) for row_number, row in batch]
+            written += write_batch(driver, restore_query, batch, operation, failed, records)
+
+    return written, failed
+
+
+def restore_graph(driver, directory, writers=DEFAULT_RESTORE_WRITERS, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Load an export_graph directory into an empty database
+
+    Sections are restored one after the other (nodes before the
+    relationships between them), and the chunks of a section in parallel,
+    one transaction per batch. Relationships find their nodes by id through
+    the uniqueness constraints, so run it after ensure_schema, which
+    connect_neo4j does. Every row is CREATEd, so it raises ValueError before
+    writing anything if the database already holds users, products,
+    orders, addresses or stock shards.
+
+    Args:
+        driver: Neo4j connection driver
+        directory: Directory written by export_graph
+        writers: Chunks restored at the same time
+        batch_size: Rows per transaction
+
+    Returns:
+        dict: 'written', 'failed' (list of ('chunk:line', error)), 'seconds',
+            'rows_per_sec' and 'sections' (written and seconds of each)
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != EXPORT_FORMAT:
+        raise ValueError(f"Unsupported export format: {manifest.get('format')}")
+
+    if not driver.read_query(GRAPH_IS_EMPTY_QUERY, operation='restore_graph.is_empty')[0][0]:
+        raise ValueError("The database is not empty; restore into an empty database")
+
+    start = time.perf_counter()
+    written = 0
+    failed = []
+    sections = {}
+
+    with ThreadPoolExecutor(writers) as pool:
+        for name, _, restore_query, convert in SECTIONS:
+            section = manifest['sections'].get(name)
+            if not section or not section['chunks']:
+                continue
+
+            section_start = time.perf_counter()
+            restores = [pool.submit(_restore_chunk, driver, directory, chunk, restore_query, convert, batch_size,
+                                    f"restore_graph.{name}")
+                        for chunk in section['chunks']]
+            section_written = 0
+            for restore in restores:
+                chunk_written, chunk_failed = restore.result()
+                section_written += chunk_written
+                failed.extend(chunk_failed)
+
+            seconds = time.perf_counter() - section_start
+            written += section_written
+            sections[name] = {'written': section_written, 'seconds': seconds}
+            print(f"Restored {section_written} of {section['rows']} {name} ({_rate(section_written, seconds):.0f} rows/s)")
+
+    cache = getattr(driver, 'identity_cache', None)
+    if cache is not None:
+        cache.clear()
+    invalidate_catalog(driver)
+
+    seconds = time.perf_counter() - start
+    print(f"Restore finished: {written} rows in {seconds:.1f}s ({_rate(written, seconds):.0f} rows/s), "
+          f"failed: {len(failed)}")
+    return {'written': written, 'failed': failed, 'seconds': seconds, 'rows_per_sec': _rate(written, seconds),
+            'sections': sections}
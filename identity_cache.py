@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Stored for CPFs that matched no user, so repeated lookups of a wrong CPF
+# don't hit the database either; creating that user through this
+# connection invalidates it, and it expires after not_found_ttl seconds in
+# case the user was created elsewhere
+NOT_FOUND = object()
+
+
+class IdentityCache:
+    """Bounded LRU map of CPF -> User identity (id, name, last name)"""
+
+    def __init__(self, max_entries=10000, not_found_ttl=5.0):
+        self.max_entries = max_entries
+        self.not_found_ttl = not_found_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._not_found_until = {}
+        self._lock = threading.Lock()
+
+    def get(self, cpf):
+        """
+        Look up a CPF
+
+        Returns:
+            The User identity, NOT_FOUND for a known missing CPF, or
+            None when the CPF is not cached
+        """
+        with self._lock:
+            identity = self._entries.get(cpf)
+
+            if identity is NOT_FOUND and self._not_found_until[cpf] < time.monotonic():
+                self._forget(cpf)
+                identity = None
+
+            if identity is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(cpf)
+            self.hits += 1
+            return identity if identity is NOT_FOUND else identity.copy()
+
+    def put(self, cpf, identity):
+        """Cache a User identity, or NOT_FOUND (unless not_found_ttl is 0)"""
+        if self.max_entries <= 0 or (identity is NOT_FOUND and self.not_found_ttl <= 0):
+            return
+
+        with self._lock:
+            if identity is NOT_FOUND:
+                self._entries[cpf] = NOT_FOUND
+                self._not_found_until[cpf] = time.monotonic() + self.not_found_ttl
+            else:
+                self._entries[cpf] = identity.copy()
+                self._not_found_until.pop(cpf, None)
+            self._entries.move_to_end(cpf)
+
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._not_found_until.pop(oldest, None)
+
+    def invalidate(self, cpf):
+        """Forget a CPF (called when a user with that CPF is created)"""
+        with self._lock:
+            self._forget(cpf)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._not_found_until.clear()
+
+    def _forget(self, cpf):
+        self._entries.pop(cpf, None)
+        self._not_found_until.pop(cpf, None)
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
@@ -0,0 +1,156 @@
+from product_cache import invalidate_catalog
+
+# A hot product's stock can be split across N (:StockShard {productId,
+# shard, stock}) nodes linked with STOCK_SHARD. create_order then reserves
+# units on shards taken in a random order (as many as the quantity needs,
+# moving on to the others when the ones it picked were drained meanwhile),
+# so the stock check and the stock and counter updates of concurrent
+# buyers of the same product mostly lock different nodes. p.stockShards
+# holds N; p.stock keeps whatever was not moved into shards (0 right after
+# sharding).
+#
+# The product node itself is still locked by every order: creating the
+# order's CONTAINS relationship to it locks both ends (on a dense node,
+# its relationship group), and so does MERGEing the BOUGHT_WITH edges of a
+# cart with other products. Orders of a hot product therefore still queue
+# on it until they commit; sharding takes the stock updates off that path
+# but does not remove it (see benchmarks/bench_inventory.py).
+#
+# The sales counters (unitsSold, orderCount) and updatedAt are written on
+# the nodes an order took its units from, so they are split the same way:
+# a sharded product's counters are its own plus its shards', and its
+# updatedAt the latest of them.
+
+
+def sharded_total(prop):
+    """
+    Cypher expression for the total of a property of the product bound to p
+    and its shards
+
+    Only sharded products (a few hot ones) expand their shards; for every
+    other row it is just the property.
+    """
+    return (f"CASE WHEN p.stockShards IS NULL THEN p.{prop} "
+            f"ELSE p.{prop} + reduce(total = 0, shardValue IN "
+            f"[(p)-[:STOCK_SHARD]->(stockShard) | coalesce(stockShard.{prop}, 0)] | total + shardValue) END")
+
+
+# Sellable stock of the product bound to p. Every statement returning stock
+# uses it, on the rows it returns; filters use p.stock, or
+# p.stockShards IS NOT NULL for the products whose stock is in shards.
+PRODUCT_STOCK = sharded_total('stock')
+
+# Last write to the product bound to p or its shards, for CatalogSnapshot
+PRODUCT_UPDATED_AT = ("CASE WHEN p.stockShards IS NULL THEN p.updatedAt "
+                      "ELSE reduce(latest = p.updatedAt, shardUpdatedAt IN "
+                      "[(p)-[:STOCK_SHARD]->(stockShard) WHERE stockShard.updatedAt IS NOT NULL "
+                      "| stockShard.updatedAt] | "
+                      "CASE WHEN latest IS NULL OR shardUpdatedAt > latest THEN shardUpdatedAt ELSE latest END) END")
+
+
+SHARD_STOCK_QUERY = """
+MATCH (p:Product {id: $productId})
+WHERE p.stockShards IS NULL
+WITH p, p.stock AS units
+SET p.stockShards = $shards, p.stock = 0
+WITH p, units
+UNWIND range(0, $shards - 1) AS shard
+CREATE (p)-[:STOCK_SHARD]->(:StockShard {
+    productId: p.id,
+    shard: shard,
+    stock: units / $shards + CASE WHEN shard < units % $shards THEN 1 ELSE 0 END,
+    unitsSold: 0,
+    orderCount: 0
+})
+RETURN count(*)
+"""
+
+# Folding the shards back adds their stock and sales counters to the product's
+UNSHARD_STOCK_QUERY = """
+MATCH (p:Product {id: $productId})-[:STOCK_SHARD]->(s:StockShard)
+WITH p, collect(s) AS shards, sum(s.stock) AS units,
+     sum(coalesce(s.unitsSold, 0)) AS unitsSold, sum(coalesce(s.orderCount, 0)) AS orderCount
+SET p.stock = p.stock + units,
+    p.unitsSold = coalesce(p.unitsSold, 0) + unitsSold,
+    p.orderCount = coalesce(p.orderCount, 0) + orderCount,
+    p.updatedAt = timestamp()
+REMOVE p.stockShards
+FOREACH (s IN shards | DETACH DELETE s)
+RETURN p.stock
+"""
+
+PRODUCT_STOCK_QUERY = f"""
+MATCH (p:Product {{id: $productId}})
+RETURN {PRODUCT_STOCK}, p.stockShards, [(p)-[:STOCK_SHARD]->(s) | s.stock]
+"""
+
+DEFAULT_SHARDS = 8
+
+
+def shard_product_stock(driver, product_id, shards=DEFAULT_SHARDS):
+    """
+    Split a product's stock evenly across shard nodes
+
+    Use it for products about to get heavy concurrent ordering (a flash
+    sale). An order line larger than one shard is split across several,
+    which locks more nodes, so keep shards well below the stock divided by
+    the typical quantity.
+
+    Args:
+        driver: Neo4j connection driver
+        product_id: ID of the product
+        shards: Number of shards
+
+    Returns:
+        bool: True if the stock was sharded
+    """
+    if shards < 2:
+        raise ValueError("shards must be at least 2")
+
+    result = driver.write_query(SHARD_STOCK_QUERY, {'productId': product_id, 'shards': shards},
+                                operation='shard_product_stock')
+
+    if not result or not result[0][0]:
+        print(f"Product with ID {product_id} not found or already sharded")
+        return False
+
+    invalidate_catalog(driver)
+
+    print(f"Stock of product {product_id} split into {shards} shards")
+    return True
+
+
+def unshard_product_stock(driver, product_id):
+    """
+    Move a sharded product's stock back onto the product node
+
+    Returns:
+        int: The product's stock, or None if it was not sharded
+    """
+    result = driver.write_query(UNSHARD_STOCK_QUERY, {'productId': product_id},
+                                operation='unshard_product_stock')
+
+    if not result:
+        print(f"Product with ID {product_id} is not sharded")
+        return None
+
+    invalidate_catalog(driver)
+
+    print(f"Stock of product {product_id} merged back: {result[0][0]} units")
+    return result[0][0]
+
+
+def get_product_stock(driver, product_id):
+    """
+    Current sellable stock of a product, summed over its shards
+
+    Returns:
+        dict: 'stock', 'shards' (None if not sharded) and 'shard_stock'
+            (units per shard), or None if the product does not exist
+    """
+    result = driver.read_query(PRODUCT_STOCK_QUERY, {'productId': product_id}, operation='product_stock')
+
+    if not result:
+        return None
+
+    return {'stock': result[0][0], 'shards': result[0][1], 'shard_stock': result[0][2]}
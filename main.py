@@ -1,14 +1,22 @@
+import argparse
+import contextlib
+import sys
 
+from batch_runner import DEFAULT_GROUP_SIZE, DEFAULT_READ_WORKERS, run_batch
 from neo4j_connection import connect_neo4j, close_connection
-from user_operations import insert_user
+from user_operations import insert_user, find_user_by_cpf
 from product_operations import (
     insert_product, 
     search_products_by_name, 
     search_products_by_seller,
     search_products_by_seller_cpf
 )
-from order_operations import create_order, get_all_products, get_user_orders, get_order_products
+from recommendation_operations import recommend_for_product
+from popularity_operations import top_products, top_products_by_brand
+from order_operations import create_order, get_order_products, iter_all_products, iter_user_orders
 from favorite_operations import add_favorite, get_user_favorites, get_all_products as get_all_products_favorites, remove_favorite
+from favorite_operations import iter_user_favorites, iter_all_products as iter_all_products_favorites
+from schema import order_timezone
 
 
 get_all_products_for_favorites = get_all_products_favorites
@@ -112,6 +120,8 @@ def productMenu(driver):
                     1- Criar Produto
                     2- Buscar Produto por Nome
                     3- Buscar Produtos por Vendedor
+                    4- Quem comprou este produto também comprou
+                    5- Produtos mais populares
         """)
         option = input("Digite a opção desejada? (V para voltar) ")
 
@@ -143,7 +153,8 @@ def productMenu(driver):
             
             case '2':
                 name = input("Nome do produto (ou parte dele): ")
-                products = search_products_by_name(driver, name)
+                # "Part of it": interactive, so the costlier infix match is worth it
+                products = search_products_by_name(driver, name, infix=True)
                 display_products(products)
             
             case '3':
@@ -163,6 +174,30 @@ def productMenu(driver):
                 else:
                     print("Opção inválida!")
             
+            case '4':
+                product_id = input("ID do produto: ")
+                products = recommend_for_product(driver, product_id)
+                display_products(products)
+            
+            case '5':
+                print("Ordenar por: ")
+                print("1. Favoritos")
+                print("2. Unidades vendidas")
+                print("3. Pedidos")
+                by = {'1': 'favorites', '2': 'units_sold', '3': 'orders'}.get(input("Opção: "))
+                
+                if by is None:
+                    print("Opção inválida!")
+                    continue
+                
+                brand = input("Marca (deixe em branco para todas): ")
+                
+                if brand:
+                    products = top_products_by_brand(driver, brand, by)
+                else:
+                    products = top_products(driver, by)
+                display_products(products)
+            
             case 'v' | 'V':
                 return
             
@@ -186,22 +221,25 @@ def orderMenu(driver):
                 buyer_cpf = input("CPF do comprador: ")
                 
                 
-                find_buyer_query = """
-                MATCH (u:User {cpf: $cpf})
-                RETURN u.id, u.name, u.lastName
-                """
-                
-                buyer_result = driver.run_query(find_buyer_query, {'cpf': buyer_cpf})
+                buyer = find_user_by_cpf(driver, buyer_cpf)
                 
-                if not buyer_result or not buyer_result[0]:
+                if not buyer:
                     print(f"Comprador com CPF {buyer_cpf} não encontrado!")
                     continue
                 
-                buyer_name = f"{buyer_result[0][1]} {buyer_result[0][2]}"
+                buyer_name = f"{buyer['name']} {buyer['lastName']}"
                 print(f"Comprador: {buyer_name}")
                 
                
-                products = get_all_products(driver)
+                # The first table is printed while the products stream in;
+                # later passes reprint the list with the updated stock
+                products = []
+                print("\nProdutos disponíveis:")
+                print_order_products_header()
+                for idx, product in enumerate(iter_all_products(driver), 1):
+                    print_order_product_row(idx, product)
+                    products.append(product)
+                print("-" * 80)
                 
                 if not products:
                     print("Não há produtos disponíveis!")
@@ -209,19 +247,18 @@ def orderMenu(driver):
                 
                 
                 order_products = []
+                first_pass = True
                 
                 while True:
-                    print("\nProdutos disponíveis:")
-                    print("-" * 80)
-                    print(f"{'#':<3} {'Nome':<30} {'Marca':<15} {'Preço':<10} {'Estoque':<8}")
-                    print("-" * 80)
-                    
-                    for idx, product in enumerate(products, 1):
-                        name = product['name'][:28] + ".." if len(product['name']) > 30 else product['name']
-                        brand = product['brand'][:13] + ".." if len(product['brand']) > 15 else product['brand']
-                        print(f"{idx:<3} {name:<30} {brand:<15} R$ {product['price']:<7.2f} {product['stock']:<8}")
-                    
-                    print("-" * 80)
+                    if not first_pass:
+                        print("\nProdutos disponíveis:")
+                        print_order_products_header()
+                        
+                        for idx, product in enumerate(products, 1):
+                            print_order_product_row(idx, product)
+                        
+                        print("-" * 80)
+                    first_pass = False
                    
                     try:
                         product_idx = int(input("\nSelecione o número do produto (0 para finalizar): "))
@@ -285,20 +322,23 @@ def orderMenu(driver):
               
                 buyer_cpf = input("CPF do cliente: ")
                 
-                orders = get_user_orders(driver, buyer_cpf)
+                # Dates are stored as instants; show them in the zone the
+                # migration read the old naive dates in, so they keep their clock time
+                zone = order_timezone(driver.config['legacy_order_timezone'])
+                idx = 0
+                for idx, order in enumerate(iter_user_orders(driver, buyer_cpf), 1):
+                    if idx == 1:
+                        print("\nPedidos do cliente:")
+                        print("-" * 80)
+                        print(f"{'#':<3} {'ID':<36} {'Valor':<12} {'Status':<15} {'Data':<20}")
+                        print("-" * 80)
+                    
+                    print(f"{idx:<3} {order['id']:<36} R$ {order['value']:<9.2f} {order['status']:<15} {order['date'].astimezone(zone):%Y-%m-%d %H:%M:%S}")
                 
-                if not orders:
+                if not idx:
                     print(f"Nenhum pedido encontrado para o cliente com CPF {buyer_cpf}")
                     continue
                 
-                print("\nPedidos do cliente:")
-                print("-" * 80)
-                print(f"{'#':<3} {'ID':<36} {'Valor':<12} {'Status':<15} {'Data':<20}")
-                print("-" * 80)
-                
-                for idx, order in enumerate(orders, 1):
-                    print(f"{idx:<3} {order['id']:<36} R$ {order['value']:<9.2f} {order['status']:<15} {order['date'][:19]}")
-                
                 print("-" * 80)
             
             case '3':
@@ -346,24 +386,26 @@ def favoriteMenu(driver):
         match option:
             case '1':
                 
-                products = get_all_products(driver)
-                
-                if not products:
-                    print("Não há produtos disponíveis")
-                    continue
-                
+                # Rows are printed as they stream in; only id and name are
+                # kept for the selection below
+                products = []
                 print("\nProdutos disponíveis:")
                 print("-" * 80)
                 print(f"{'#':<3} {'Nome':<30} {'Marca':<15} {'Preço':<10} {'Avaliação':<10}")
                 print("-" * 80)
                 
-                for idx, product in enumerate(products, 1):
+                for idx, product in enumerate(iter_all_products_favorites(driver), 1):
                     name = product['name'][:28] + ".." if len(product['name']) > 30 else product['name']
                     brand = product['brand'][:13] + ".." if len(product['brand']) > 15 else product['brand']
                     print(f"{idx:<3} {name:<30} {brand:<15} R$ {product['price']:<7.2f} {product['rating']:<10.1f}")
+                    products.append({'id': product['id'], 'name': product['name']})
                 
                 print("-" * 80)
                 
+                if not products:
+                    print("Não há produtos disponíveis")
+                    continue
+                
                 
                 try:
                     product_idx = int(input("\nSelecione o número do produto: "))
@@ -389,23 +431,24 @@ def favoriteMenu(driver):
               
                 user_cpf = input("Digite seu CPF: ")
                 
-                favorites = get_user_favorites(driver, user_cpf)
-                
-                if not favorites:
-                    print(f"Nenhum produto favorito encontrado para o CPF {user_cpf}")
-                    continue
-                
-                print(f"\nSeus produtos favoritos ({len(favorites)}):")
-                print("-" * 80)
-                print(f"{'#':<3} {'Nome':<30} {'Marca':<15} {'Preço':<10} {'Avaliação':<10}")
-                print("-" * 80)
-                
-                for idx, product in enumerate(favorites, 1):
+                idx = 0
+                for idx, product in enumerate(iter_user_favorites(driver, user_cpf), 1):
+                    if idx == 1:
+                        print("\nSeus produtos favoritos:")
+                        print("-" * 80)
+                        print(f"{'#':<3} {'Nome':<30} {'Marca':<15} {'Preço':<10} {'Avaliação':<10}")
+                        print("-" * 80)
+                    
                     name = product['name'][:28] + ".." if len(product['name']) > 30 else product['name']
                     brand = product['brand'][:13] + ".." if len(product['brand']) > 15 else product['brand']
                     print(f"{idx:<3} {name:<30} {brand:<15} R$ {product['price']:<7.2f} {product['rating']:<10.1f}")
                 
+                if not idx:
+                    print(f"Nenhum produto favorito encontrado para o CPF {user_cpf}")
+                    continue
+                
                 print("-" * 80)
+                print(f"Total: {idx} produto(s)")
             
             case '3':
                
@@ -456,21 +499,74 @@ def favoriteMenu(driver):
 
 
 def display_products(products):
-    """Display a list of products in a formatted way"""
-    if products:
-        print(f"\nProdutos encontrados ({len(products)}):")
-        print("-" * 80)
-        for product in products:
-            print(f"ID: {product['id']}")
-            print(f"Nome: {product['name']}")
-            print(f"Descrição: {product['description']}")
-            print(f"Marca: {product['brand']}")
-            print(f"Preço: R$ {product['price']:.2f}")
-            print(f"Estoque: {product['stock']}")
-            print(f"Avaliação: {product['rating']:.1f}")
-            print("-" * 30)
+    """Display products in a formatted way as they arrive (accepts any iterable)"""
+    count = 0
+    for product in products:
+        if count == 0:
+            print("\nProdutos encontrados:")
+            print("-" * 80)
+        count += 1
+        print(f"ID: {product['id']}")
+        print(f"Nome: {product['name']}")
+        print(f"Descrição: {product['description']}")
+        print(f"Marca: {product['brand']}")
+        print(f"Preço: R$ {product['price']:.2f}")
+        print(f"Estoque: {product['stock']}")
+        print(f"Avaliação: {product['rating']:.1f}")
+        print("-" * 30)
+    
+    if count:
+        print(f"Total: {count} produto(s)")
     else:
         print("Nenhum produto encontrado")
 
+def print_order_products_header():
+    """Print the header of the product table used when building an order"""
+    print("-" * 80)
+    print(f"{'#':<3} {'Nome':<30} {'Marca':<15} {'Preço':<10} {'Estoque':<8}")
+    print("-" * 80)
+
+def print_order_product_row(idx, product):
+    """Print one row of the product table used when building an order"""
+    name = product['name'][:28] + ".." if len(product['name']) > 30 else product['name']
+    brand = product['brand'][:13] + ".." if len(product['brand']) > 15 else product['brand']
+    print(f"{idx:<3} {name:<30} {brand:<15} R$ {product['price']:<7.2f} {product['stock']:<8}")
+
+def batchMain(args):
+    """Run the operations of a JSONL file (or stdin) without menus"""
+    # stdout may be the results stream, so connection messages go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        driver = connect_neo4j()
+    if not driver:
+        print("Failed to connect to Neo4j. Please check your connection settings.", file=sys.stderr)
+        sys.exit(1)
+
+    source = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+    out = sys.stdout if args.out is None else open(args.out, 'w', encoding='utf-8')
+
+    try:
+        report = run_batch(driver, source, out, args.group_size, args.workers)
+    finally:
+        close_connection(driver)
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+    if report['failed']:
+        sys.exit(1)
+
 if __name__ == "__main__":
-    mainMenu()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Menu interativo, ou execução em lote com --batch")
+    parser.add_argument('--batch', help="arquivo JSONL de operações ('-' para stdin)")
+    parser.add_argument('--out', help="arquivo de resultados (padrão: stdout)")
+    parser.add_argument('--group-size', type=int, default=DEFAULT_GROUP_SIZE,
+                        help="escritas consecutivas por transação")
+    parser.add_argument('--workers', type=int, default=DEFAULT_READ_WORKERS,
+                        help="leituras executadas em paralelo")
+    args = parser.parse_args()
+
+    if args.batch:
+        batchMain(args)
+    else:
+        mainMenu()
\ No newline at end of file
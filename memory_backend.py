@@ -0,0 +1,1232 @@
+"""
+In-process graph store that can stand in for a Neo4j server
+
+MemoryBackend plugs in under Neo4jConnection (backend='memory') and answers
+the exact Cypher statements the operation modules send: every statement
+constant is registered with a handler that runs it against MemoryGraph's
+dictionaries and indexes. The operation modules therefore run unchanged on
+either backend. A statement without a handler raises UnsupportedQueryError.
+
+Data lives only as long as the process. Each handler runs under the graph
+lock, and execute_read/execute_write hold it for the whole transaction
+function, so transactions are isolated. A failed handler validates before
+it mutates, but there is no rollback of earlier statements in the same
+transaction function.
+"""
+import random
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+from catalog_snapshot import SNAPSHOT_CHANGES_QUERY, SNAPSHOT_QUERY
+from favorite_operations import (
+    ADD_FAVORITE_QUERY,
+    ALL_PRODUCTS_QUERY,
+    APPLY_FAVORITES_QUERY,
+    REMOVE_FAVORITE_QUERY,
+    USER_FAVORITES_QUERY
+)
+from graph_export import (
+    EXPORT_ADDRESSES_QUERY,
+    EXPORT_BOUGHT_WITH_QUERY,
+    EXPORT_CONTAINS_QUERY,
+    EXPORT_FAVORITES_QUERY,
+    EXPORT_ORDERED_QUERY,
+    EXPORT_ORDERS_QUERY,
+    EXPORT_PRODUCTS_QUERY,
+    EXPORT_SELLS_QUERY,
+    EXPORT_STOCK_SHARDS_QUERY,
+    EXPORT_USERS_QUERY,
+    GRAPH_IS_EMPTY_QUERY,
+    RESTORE_ADDRESSES_QUERY,
+    RESTORE_BOUGHT_WITH_QUERY,
+    RESTORE_CONTAINS_QUERY,
+    RESTORE_FAVORITES_QUERY,
+    RESTORE_ORDERED_QUERY,
+    RESTORE_ORDERS_QUERY,
+    RESTORE_PRODUCTS_QUERY,
+    RESTORE_SELLS_QUERY,
+    RESTORE_STOCK_SHARDS_QUERY,
+    RESTORE_USERS_QUERY
+)
+from inventory_operations import PRODUCT_STOCK_QUERY, SHARD_STOCK_QUERY, UNSHARD_STOCK_QUERY
+from order_operations import (
+    AVAILABLE_PRODUCTS_QUERY,
+    CREATE_ORDER_QUERY,
+    ORDER_PRODUCTS_QUERY,
+    ORDERS_PRODUCTS_QUERY,
+    USER_ORDERS_PAGE_QUERY,
+    USER_ORDERS_QUERY,
+    USER_ORDERS_WITH_ITEMS_QUERY,
+    order_time
+)
+from product_operations import (
+    INSERT_PRODUCT_QUERY,
+    INSERT_PRODUCTS_BULK_QUERY,
+    PRICE_PAGE_QUERY,
+    PRODUCTS_BY_PRICE_RANGE_QUERY,
+    PRODUCTS_BY_SELLER_CPF_QUERY,
+    PRODUCTS_BY_SELLER_QUERY
+)
+from parallel_loader import LOAD_ORDER_LINES_QUERY, LOAD_ORDERS_QUERY, LOAD_PRODUCTS_QUERY, LOAD_USERS_QUERY
+from popularity_operations import (
+    COUNTERS,
+    RECONCILE_POPULARITY_QUERY,
+    TOP_PRODUCTS_BY_BRAND_QUERIES,
+    TOP_PRODUCTS_QUERIES
+)
+from product_search import (
+    LIST_ALL_PRODUCTS_QUERY,
+    LIST_PRODUCTS_QUERY,
+    SEARCH_ALL_QUERY,
+    SEARCH_FIELDS,
+    SEARCH_QUERY,
+    fold_text
+)
+from recommendation_operations import REBUILD_CO_PURCHASES_QUERY, RECOMMEND_FOR_PRODUCT_QUERY
+from schema import (
+    EXPECTED_INDEXES,
+    MIGRATE_ORDER_DATES,
+    SCHEMA_STATEMENTS,
+    SCHEMA_VERSION_QUERY,
+    SET_SCHEMA_VERSION_QUERY,
+    SHOW_INDEXES_QUERY,
+    order_timezone
+)
+from user_operations import (
+    ADD_ADDRESS_QUERY,
+    FIND_USER_BY_CPF_QUERY,
+    INSERT_USER_QUERY,
+    INSERT_USERS_BULK_QUERY
+)
+
+# Cypher statement -> handler(graph, parameters) returning a list of records
+_HANDLERS = {}
+
+
+class UnsupportedQueryError(Exception):
+    """Raised for a statement the memory backend has no handler for"""
+
+
+class MemoryConstraintError(Exception):
+    """Raised when a write would break a uniqueness constraint (like Neo4j's ConstraintError)"""
+
+
+def handles(*queries):
+    """Register the decorated function as the handler of these exact statements"""
+    def register(handler):
+        for query in queries:
+            _HANDLERS[query] = handler
+        return handler
+    return register
+
+
+def _timestamp():
+    """Milliseconds since the epoch, like Cypher's timestamp()"""
+    return int(time.time() * 1000)
+
+
+def _tokens(text):
+    """Terms of a text as the standard-folding analyzer produces them"""
+    return re.findall(r'\w+', fold_text(text)) if text else []
+
+
+class SortedIndex:
+    """
+    Keys kept in order, split into sorted chunks
+
+    Adding or discarding a key shifts the entries of one chunk (and the
+    short list of chunk maxima) instead of the whole index, so keeping a
+    large index sorted costs about the same per key as a hash insert. Range
+    reads bisect to their first key and stop at the last one they need.
+    """
+
+    CHUNK_SIZE = 512
+
+    def __init__(self, keys=()):
+        self._chunks = []
+        self._maxes = []
+        self._length = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+        else:
+            i = min(bisect_left(self._maxes, key), len(self._chunks) - 1)
+            chunk = self._chunks[i]
+            insort(chunk, key)
+            self._maxes[i] = chunk[-1]
+            if len(chunk) > 2 * self.CHUNK_SIZE:
+                self._chunks[i:i + 1] = [chunk[:self.CHUNK_SIZE], chunk[self.CHUNK_SIZE:]]
+                self._maxes[i:i + 1] = [chunk[self.CHUNK_SIZE - 1], chunk[-1]]
+        self._length += 1
+
+    def discard(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._chunks):
+            return
+        chunk = self._chunks[i]
+        j = bisect_left(chunk, key)
+        if chunk[j] != key:
+            return
+        del chunk[j]
+        self._length -= 1
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+
+    def irange(self, minimum=None, maximum=None, exclusive_minimum=False):
+        """Keys from minimum (left out if exclusive_minimum) up to maximum, in order"""
+        i = j = 0
+        if minimum is not None:
+            find = bisect_right if exclusive_minimum else bisect_left
+            i = find(self._maxes, minimum)
+            if i < len(self._chunks):
+                j = find(self._chunks[i], minimum)
+        for chunk in self._chunks[i:]:
+            for key in chunk[j:]:
+                if maximum is not None and key > maximum:
+                    return
+                yield key
+            j = 0
+
+    def islice(self, start=0, stop=None):
+        """Keys at positions start to stop (stop excluded, None for the end)"""
+        for chunk in self._chunks:
+            if stop is not None and stop <= 0:
+                return
+            if start < len(chunk):
+                yield from chunk[start:stop]
+            start = max(start - len(chunk), 0)
+            if stop is not None:
+                stop -= len(chunk)
+
+
+class MemoryGraph:
+    """
+    Users, products, orders and their relationships with the lookup indexes
+    the statements need
+
+    Hash indexes cover User.id, User.cpf, Product.id and Order.id. Products
+    are also kept in SortedIndexes: by id for the batched maintenance
+    statements, by (price, id) and (name, id) for range seeks and ordered
+    listings, and by (-count, id) per popularity counter (overall and per
+    brand) for the top-k rankings. The search fields have an inverted index
+    with their terms sorted for prefix matches. Every index is updated as
+    the data changes, never rebuilt.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.schema_version = None
+        self.reset()
+
+    def reset(self):
+        """Drop every node and relationship (the lock and the schema version stay)"""
+        self.users = {}
+        self.user_ids_by_cpf = {}
+        self.addresses = {}
+        self.products = {}
+        self.product_ids = SortedIndex()
+        self.price_index = SortedIndex()
+        self.name_index = SortedIndex()
+        self.rankings = {counter: SortedIndex() for counter in COUNTERS.values()}
+        self.brand_rankings = {counter: {} for counter in COUNTERS.values()}
+        self.products_by_seller = {}
+        self.orders = {}
+        self.orders_by_user = {}
+        self.order_lines = {}
+        self.orders_by_product = {}
+        self.bought_with = {}
+        self.favorites = {}
+        self.terms = {field: {} for field in SEARCH_FIELDS}
+        self.sorted_terms = {field: SortedIndex() for field in SEARCH_FIELDS}
+
+    # Users
+
+    def check_new_users(self, props_list):
+        """Raise MemoryConstraintError if any of these users can't be created"""
+        ids, cpfs = set(), set()
+        for props in props_list:
+            if props['id'] in self.users or props['id'] in ids:
+                raise MemoryConstraintError(f"User with id {props['id']} already exists")
+            if props.get('cpf') in self.user_ids_by_cpf or props.get('cpf') in cpfs:
+                raise MemoryConstraintError(f"User with cpf {props['cpf']} already exists")
+            ids.add(props['id'])
+            cpfs.add(props.get('cpf'))
+
+    def add_user(self, props):
+        user = dict(props)
+        self.users[user['id']] = user
+        if user.get('cpf') is not None:
+            self.user_ids_by_cpf[user['cpf']] = user['id']
+        return user
+
+    def user_by_cpf(self, cpf):
+        user_id = self.user_ids_by_cpf.get(cpf)
+        return self.users[user_id] if user_id is not None else None
+
+    def add_address(self, user_id, props):
+        address = dict(props)
+        self.addresses.setdefault(user_id, []).append(address)
+        return address
+
+    # Products
+
+    def check_new_products(self, props_list):
+        ids = set()
+        for props in props_list:
+            if props['id'] in self.products or props['id'] in ids:
+                raise MemoryConstraintError(f"Product with id {props['id']} already exists")
+            ids.add(props['id'])
+
+    def add_product(self, props, seller=None):
+        product = dict(props)
+        product.update(updatedAt=_timestamp(), favoriteCount=0, unitsSold=0, orderCount=0)
+        self.products[product['id']] = product
+        self.product_ids.add(product['id'])
+
+        if product.get('price') is not None:
+            self.price_index.add((product['price'], product['id']))
+        self.name_index.add((product.get('name') or '', product['id']))
+        self.rank_product(product)
+
+        for field in SEARCH_FIELDS:
+            for token in set(_tokens(product.get(field))):
+                postings = self.terms[field].get(token)
+                if postings is None:
+                    postings = self.terms[field][token] = set()
+                    self.sorted_terms[field].add(token)
+                postings.add(product['id'])
+
+        if seller is not None:
+            product['sellerId'] = seller['id']
+            self.products_by_seller.setdefault(seller['id'], set()).add(product['id'])
+
+        return product
+
+    def rank_product(self, product):
+        """
+        Move the product to its place in the counter rankings; called after
+        any change to its counters or to its shards'
+        """
+        ranked = product.setdefault('_ranked', {})
+        for counter, ranking in self.rankings.items():
+            total = _sharded_total(product, counter)
+            key = None if total is None else (-total, product['id'])
+            if ranked.get(counter) == key:
+                continue
+            rankings = [ranking]
+            if product.get('brand') is not None:
+                rankings.append(self.brand_rankings[counter].setdefault(product['brand'], SortedIndex()))
+            for index in rankings:
+                if ranked.get(counter) is not None:
+                    index.discard(ranked[counter])
+                if key is not None:
+                    index.add(key)
+            ranked[counter] = key
+
+    def products_by_name(self, product_ids):
+        return sorted((self.products[pid] for pid in product_ids), key=lambda p: (p.get('name') or '', p['id']))
+
+    def matching_products(self, field, token, match='exact'):
+        """
+        Ids of products whose field has the token ('exact'), a token
+        starting with it ('prefix') or a token containing it ('infix')
+        """
+        if match == 'exact':
+            return self.terms[field].get(token, set())
+
+        ids = set()
+        if match == 'infix':
+            for term, postings in self.terms[field].items():
+                if token in term:
+                    ids |= postings
+            return ids
+
+        for term in self.sorted_terms[field].irange(token):
+            if not term.startswith(token):
+                break
+            ids |= self.terms[field][term]
+        return ids
+
+    # Orders
+
+    def add_order(self, props, user, lines):
+        order = dict(props)
+        self.orders[order['id']] = order
+        self.orders_by_user.setdefault(user['id'], []).append(order['id'])
+        self.order_lines[order['id']] = [(product['id'], quantity) for product, quantity in lines]
+        for product, _ in lines:
+            self.orders_by_product.setdefault(product['id'], []).append(order['id'])
+        return order
+
+    def add_co_purchase(self, product_ids):
+        """Count one more order containing all of product_ids in their BOUGHT_WITH weights"""
+        for a in product_ids:
+            weights = self.bought_with.setdefault(a, {})
+            for b in product_ids:
+                if a != b:
+                    weights[b] = weights.get(b, 0) + 1
+
+    def co_purchases(self, product_id):
+        """Weights of product_id recomputed from the orders: {other product id: shared orders}"""
+        weights = {}
+        for order_id in self.orders_by_product.get(product_id, ()):
+            for other_id, _ in self.order_lines[order_id]:
+                if other_id != product_id:
+                    weights[other_id] = weights.get(other_id, 0) + 1
+        return weights
+
+
+def _sharded_total(product, key):
+    """
+    A property summed over the product and its shards (kept under '_shards'
+    as {'shard', 'stock', 'unitsSold', 'orderCount', 'updatedAt'} dictionaries)
+    """
+    total = product.get(key)
+    if total is not None:
+        total += sum(shard.get(key) or 0 for shard in product.get('_shards', ()))
+    return total
+
+
+def _stock(product):
+    return _sharded_total(product, 'stock')
+
+
+def _updated_at(product):
+    """Latest updatedAt of the product and its shards"""
+    holders = [product, *product.get('_shards', ())]
+    return max((held['updatedAt'] for held in holders if held.get('updatedAt') is not None), default=None)
+
+
+def _product_row(product):
+    return (product['id'], product.get('name'), product.get('description'), product.get('brand'),
+            product.get('price'), _stock(product), product.get('rating'))
+
+
+def _snapshot_row(product):
+    return _product_row(product) + (_updated_at(product),)
+
+
+# Schema: the indexes are built in, so the DDL statements only need accepting
+
+@handles(*(statement for _, statement in SCHEMA_STATEMENTS))
+def _schema_statement(graph, params):
+    return []
+
+
+@handles(MIGRATE_ORDER_DATES)
+def _migrate_order_dates(graph, params):
+    zone = order_timezone(params['tz'])
+    for order in graph.orders.values():
+        if isinstance(order.get('date'), str):
+            order['date'] = order_time(zone.localize(datetime.fromisoformat(order['date'])))
+    return []
+
+
+@handles(SCHEMA_VERSION_QUERY)
+def _schema_version(graph, params):
+    return [(graph.schema_version,)] if graph.schema_version is not None else []
+
+
+@handles(SET_SCHEMA_VERSION_QUERY)
+def _set_schema_version(graph, params):
+    graph.schema_version = params['version']
+    return []
+
+
+@handles(SHOW_INDEXES_QUERY)
+def _show_indexes(graph, params):
+    return [(name, 'ONLINE', 100.0) for name in EXPECTED_INDEXES]
+
+
+# Users
+
+@handles(INSERT_USER_QUERY)
+def _insert_user(graph, params):
+    graph.check_new_users([params['props']])
+    return [(graph.add_user(params['props'])['id'],)]
+
+
+@handles(ADD_ADDRESS_QUERY)
+def _add_address(graph, params):
+    if params['userId'] not in graph.users:
+        return []
+    return [(graph.add_address(params['userId'], params['addressProps']),)]
+
+
+@handles(FIND_USER_BY_CPF_QUERY)
+def _find_user_by_cpf(graph, params):
+    user = graph.user_by_cpf(params['cpf'])
+    return [(user['id'], user.get('name'), user.get('lastName'))] if user else []
+
+
+@handles(INSERT_USERS_BULK_QUERY)
+def _insert_users_bulk(graph, params):
+    graph.check_new_users([row['props'] for row in params['rows']])
+    for row in params['rows']:
+        user = graph.add_user(row['props'])
+        for address in row.get('addresses') or []:
+            graph.add_address(user['id'], address)
+    return []
+
+
+# Products
+
+@handles(INSERT_PRODUCT_QUERY)
+def _insert_product(graph, params):
+    graph.check_new_products([params['props']])
+    seller = graph.user_by_cpf(params['sellerCpf']) if params.get('sellerCpf') else None
+    product = graph.add_product(params['props'], seller)
+    return [(product['id'], seller['id'] if seller else None)]
+
+
+@handles(INSERT_PRODUCTS_BULK_QUERY)
+def _insert_products_bulk(graph, params):
+    graph.check_new_products([row['props'] for row in params['rows']])
+    unknown = []
+    for row in params['rows']:
+        seller = graph.user_by_cpf(row['sellerCpf']) if row.get('sellerCpf') else None
+        graph.add_product(row['props'], seller)
+        if row.get('sellerCpf') and seller is None:
+            unknown.append((row['sellerCpf'],))
+    return unknown
+
+
+@handles(PRODUCTS_BY_PRICE_RANGE_QUERY)
+def _products_by_price_range(graph, params):
+    keys = graph.price_index.irange((params['minPrice'],), (params['maxPrice'], '\U0010ffff'))
+    return [_product_row(graph.products[pid]) for _, pid in keys]
+
+
+@handles(PRICE_PAGE_QUERY)
+def _price_page(graph, params):
+    rows = []
+    for price, pid in graph.price_index.irange((params['fromPrice'], params['afterId']), exclusive_minimum=True):
+        if price > params['maxPrice'] or len(rows) == params['limit']:
+            break
+        product = graph.products[pid]
+        if params.get('brand') is not None and product.get('brand') != params['brand']:
+            continue
+        if params.get('minRating') is not None and (product.get('rating') or 0) < params['minRating']:
+            continue
+        rows.append(_product_row(product))
+    return rows
+
+
+@handles(PRODUCTS_BY_SELLER_QUERY)
+def _products_by_seller(graph, params):
+    product_ids = graph.products_by_seller.get(params['sellerId'], ())
+    return [_product_row(product) for product in graph.products_by_name(product_ids)]
+
+
+@handles(PRODUCTS_BY_SELLER_CPF_QUERY)
+def _products_by_seller_cpf(graph, params):
+    seller = graph.user_by_cpf(params['sellerCpf'])
+    return _products_by_seller(graph, {'sellerId': seller['id']}) if seller else []
+
+
+@handles(SNAPSHOT_QUERY)
+def _snapshot(graph, params):
+    return [_snapshot_row(product) for product in graph.products.values()]
+
+
+@handles(SNAPSHOT_CHANGES_QUERY)
+def _snapshot_changes(graph, params):
+    rows = []
+    for product in graph.products.values():
+        updated_at = _updated_at(product)
+        if updated_at is not None and updated_at >= params['since']:
+            rows.append(_snapshot_row(product))
+    return rows
+
+
+# Full-text search: the Lucene subset product_search.build_search_query
+# produces (field:(...), AND/OR, term*, *term*, ^boost, backslash escapes)
+
+_LUCENE_TOKEN = re.compile(r'\s*(?:(\()|(\))|((?:\\.|[^\s()\\])+))')
+
+
+def _lucene_tokens(query):
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = _LUCENE_TOKEN.match(query, position)
+        if not match or match.end() == position:
+            break
+        position = match.end()
+        if match.group(1):
+            tokens.append(('(', None))
+        elif match.group(2):
+            tokens.append((')', None))
+        else:
+            tokens.extend(_lucene_word(match.group(3)))
+    return tokens
+
+
+def _lucene_word(word):
+    """Split a raw word into field, term and boost tokens (escapes are kept literal)"""
+    if word in ('AND', 'OR'):
+        return [(word, None)]
+
+    tokens = []
+    plain = re.sub(r'\\.', '__', word)
+
+    if ':' in plain:
+        split = plain.index(':')
+        tokens.append(('field', word[:split]))
+        word, plain = word[split + 1:], plain[split + 1:]
+
+    boost = None
+    if '^' in plain:
+        split = plain.index('^')
+        boost = float(word[split + 1:])
+        word, plain = word[:split], plain[:split]
+
+    if word:
+        match = 'exact'
+        if plain.endswith('*'):
+            word = word[:-1]
+            match = 'prefix'
+            if plain.startswith('*'):
+                word = word[1:]
+                match = 'infix'
+        text = re.sub(r'\\(.)', r'\1', word)
+        tokens.append(('term', (text, match)))
+
+    if boost is not None:
+        tokens.append(('boost', boost))
+    return tokens
+
+
+class _LuceneQuery:
+    """Recursive-descent evaluator returning {product id: score}"""
+
+    def __init__(self, graph, query):
+        self.graph = graph
+        self.tokens = _lucene_tokens(query)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def evaluate(self):
+        return self.or_expression(None) if self.tokens else {}
+
+    def or_expression(self, field):
+        scores = self.and_expression(field)
+        while self.peek() == 'OR':
+            self.take()
+            for pid, score in self.and_expression(field).items():
+                scores[pid] = scores.get(pid, 0.0) + score
+        return scores
+
+    def and_expression(self, field):
+        scores = self.unary(field)
+        while self.peek() == 'AND':
+            self.take()
+            other = self.unary(field)
+            scores = {pid: score + other[pid] for pid, score in scores.items() if pid in other}
+        return scores
+
+    def unary(self, field):
+        if self.peek() == 'field':
+            field = self.take()[1]
+
+        if self.peek() == '(':
+            self.take()
+            scores = self.or_expression(field)
+            if self.peek() == ')':
+                self.take()
+        else:
+            text, match = self.take()[1]
+            scores = {}
+            for term_field in ([field] if field else SEARCH_FIELDS):
+                for token in _tokens(text) or ['']:
+                    for pid in self.graph.matching_products(term_field, token, match):
+                        scores[pid] = scores.get(pid, 0.0) + 1.0
+
+        if self.peek() == 'boost':
+            boost = self.take()[1]
+            scores = {pid: score * boost for pid, score in scores.items()}
+        return scores
+
+
+def _page(rows, params):
+    end = None if params.get('limit') is None else params['skip'] + params['limit']
+    return rows[params['skip']:end]
+
+
+@handles(SEARCH_QUERY, SEARCH_ALL_QUERY)
+def _search(graph, params):
+    scores = _LuceneQuery(graph, params['search']).evaluate()
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [_product_row(graph.products[pid]) + (score,) for pid, score in _page(ranked, params)]
+
+
+@handles(LIST_PRODUCTS_QUERY, LIST_ALL_PRODUCTS_QUERY)
+def _list_products(graph, params):
+    end = None if params.get('limit') is None else params['skip'] + params['limit']
+    return [_product_row(graph.products[pid]) + (None,) for _, pid in graph.name_index.islice(params['skip'], end)]
+
+
+# Orders
+
+@handles(CREATE_ORDER_QUERY)
+def _create_order(graph, params):
+    user = graph.user_by_cpf(params['cpf'])
+    if user is None:
+        return []
+
+    lines = []
+    takes = []
+    short_ids = []
+    for item in params['items']:
+        product = graph.products.get(item['productId'])
+        if product is None:
+            continue
+        quantity = item['quantity']
+        lines.append((product, quantity))
+        if product.get('stockShards') is None:
+            holders = [product]
+        else:
+            # The quantity is split across the shards holding stock, in a random order
+            holders = [shard for shard in product['_shards'] if shard['stock'] > 0]
+            random.shuffle(holders)
+        left = quantity
+        takes.append([])
+        for held in holders:
+            if left == 0 or (held.get('stock') or 0) <= 0:
+                continue
+            units = min(held['stock'], left)
+            takes[-1].append((held, units))
+            left -= units
+        if left > 0:
+            short_ids.append(product['id'])
+
+    total = sum(product['price'] * quantity for product, quantity in lines)
+
+    if lines and not short_ids:
+        graph.add_order({'id': params['orderId'], 'value': total, 'status': 'Pending',
+                         'date': params['date'], 'buyerId': user['id']}, user, lines)
+        now = _timestamp()
+        for line_takes in takes:
+            for i, (held, units) in enumerate(line_takes):
+                held['stock'] -= units
+                held['unitsSold'] = (held.get('unitsSold') or 0) + units
+                held['orderCount'] = (held.get('orderCount') or 0) + (1 if i == 0 else 0)
+                held['updatedAt'] = now
+        for product, _ in lines:
+            graph.rank_product(product)
+        graph.add_co_purchase([product['id'] for product, _ in lines])
+
+    return [([product['id'] for product, _ in lines], short_ids, total)]
+
+
+@handles(AVAILABLE_PRODUCTS_QUERY)
+def _available_products(graph, params):
+    rows = []
+    for _, pid in graph.name_index:
+        product = graph.products[pid]
+        if (_stock(product) or 0) > 0:
+            rows.append(_product_row(product))
+    return rows
+
+
+def _orders_newest_first(graph, cpf, keep):
+    user = graph.user_by_cpf(cpf)
+    if user is None:
+        return []
+    orders = [graph.orders[oid] for oid in graph.orders_by_user.get(user['id'], ())]
+    orders = [o for o in orders if o.get('date') is not None and keep(o['date'], o['id'])]
+    orders.sort(key=lambda o: (o['date'], o['id']), reverse=True)
+    return [(o['id'], o.get('value'), o.get('status'), o['date']) for o in orders]
+
+
+@handles(USER_ORDERS_QUERY)
+def _user_orders(graph, params):
+    return _orders_newest_first(graph, params['cpf'],
+                                lambda when, oid: params['since'] <= when < params['until'])
+
+
+@handles(USER_ORDERS_PAGE_QUERY)
+def _user_orders_page(graph, params):
+    def keep(when, oid):
+        return (params['since'] <= when <= params['fromDate']
+                and (when < params['fromDate'] or oid < params['beforeId']))
+    return _orders_newest_first(graph, params['cpf'], keep)[:params['limit']]
+
+
+@handles(ORDER_PRODUCTS_QUERY)
+def _order_products(graph, params):
+    return _order_line_rows(graph, params['orderId'])
+
+
+def _order_line_rows(graph, order_id):
+    rows = []
+    for pid, quantity in graph.order_lines.get(order_id, ()):
+        product = graph.products[pid]
+        rows.append((pid, product.get('name'), product.get('price'), quantity, product.get('price') * quantity))
+    return rows
+
+
+@handles(ORDERS_PRODUCTS_QUERY)
+def _orders_products(graph, params):
+    return [(order_id,) + row for order_id in params['orderIds'] for row in _order_line_rows(graph, order_id)]
+
+
+@handles(USER_ORDERS_WITH_ITEMS_QUERY)
+def _user_orders_with_items(graph, params):
+    return [row + (_order_line_rows(graph, row[0]),) for row in _user_orders(graph, params)]
+
+
+# Inventory shards
+
+@handles(SHARD_STOCK_QUERY)
+def _shard_stock(graph, params):
+    product = graph.products.get(params['productId'])
+    if product is None or product.get('stockShards') is not None:
+        return [(0,)]
+    units, count = product.get('stock') or 0, params['shards']
+    product['_shards'] = [{'shard': i, 'stock': units // count + (1 if i < units % count else 0),
+                           'unitsSold': 0, 'orderCount': 0}
+                          for i in range(count)]
+    product['stockShards'] = count
+    product['stock'] = 0
+    return [(count,)]
+
+
+@handles(UNSHARD_STOCK_QUERY)
+def _unshard_stock(graph, params):
+    product = graph.products.get(params['productId'])
+    if product is None or not product.get('_shards'):
+        return []
+    for key in ('stock', 'unitsSold', 'orderCount'):
+        product[key] = _sharded_total(product, key) or 0
+    del product['_shards']
+    product.pop('stockShards', None)
+    product['updatedAt'] = _timestamp()
+    return [(product['stock'],)]
+
+
+@handles(PRODUCT_STOCK_QUERY)
+def _product_stock(graph, params):
+    product = graph.products.get(params['productId'])
+    if product is None:
+        return []
+    return [(_stock(product), product.get('stockShards'),
+             [shard['stock'] for shard in product.get('_shards', ())])]
+
+
+# Recommendations
+
+@handles(RECOMMEND_FOR_PRODUCT_QUERY)
+def _recommend_for_product(graph, params):
+    weights = graph.bought_with.get(params['productId'], {})
+    ranked = sorted(weights.items(), key=lambda item: (-item[1], item[0]))[:params['k']]
+    return [_product_row(graph.products[pid]) + (weight,) for pid, weight in ranked]
+
+
+@handles(REBUILD_CO_PURCHASES_QUERY)
+def _rebuild_co_purchases(graph, params):
+    product_ids = list(islice(graph.product_ids.irange(params['after'], exclusive_minimum=True),
+                              params['batchSize']))
+    for pid in product_ids:
+        weights = graph.co_purchases(pid)
+        if weights:
+            graph.bought_with.setdefault(pid, {}).update(weights)
+    return [(len(product_ids), product_ids[-1] if product_ids else None)]
+
+
+# Popularity
+
+def _top_products_handler(counter, by_brand):
+    def handler(graph, params):
+        if by_brand:
+            ranking = graph.brand_rankings[counter].get(params['brand'], ())
+        else:
+            ranking = graph.rankings[counter]
+        if not ranking:
+            return []
+        return [_product_row(graph.products[pid]) + (-negated_total,)
+                for negated_total, pid in ranking.islice(0, params['k'])]
+    return handler
+
+
+for _by, _counter in COUNTERS.items():
+    handles(TOP_PRODUCTS_QUERIES[_by])(_top_products_handler(_counter, False))
+    handles(TOP_PRODUCTS_BY_BRAND_QUERIES[_by])(_top_products_handler(_counter, True))
+
+
+@handles(RECONCILE_POPULARITY_QUERY)
+def _reconcile_popularity(graph, params):
+    product_ids = list(islice(graph.product_ids.irange(params['after'], exclusive_minimum=True),
+                              params['batchSize']))
+    batch = set(product_ids)
+
+    favorites = dict.fromkeys(product_ids, 0)
+    for user_favorites in graph.favorites.values():
+        for pid in user_favorites:
+            if pid in batch:
+                favorites[pid] += 1
+
+    repaired = 0
+    for pid in product_ids:
+        lines = [quantity for order_id in graph.orders_by_product.get(pid, ())
+                 for other_id, quantity in graph.order_lines[order_id] if other_id == pid]
+        product = graph.products[pid]
+        shards = product.get('_shards', ())
+        counts = {'favoriteCount': favorites[pid],
+                  'orderCount': len(lines) - sum(shard.get('orderCount') or 0 for shard in shards),
+                  'unitsSold': sum(lines) - sum(shard.get('unitsSold') or 0 for shard in shards)}
+        if any(product.get(name) != value for name, value in counts.items()):
+            product.update(counts)
+            graph.rank_product(product)
+            repaired += 1
+
+    return [(len(product_ids), product_ids[-1] if product_ids else None, repaired)]
+
+
+# Favorites
+
+@handles(ADD_FAVORITE_QUERY)
+def _add_favorite(graph, params):
+    user = graph.user_by_cpf(params['cpf'])
+    product = graph.products.get(params['productId'])
+    if user is not None and product is not None:
+        favorites = graph.favorites.setdefault(user['id'], {})
+        if product['id'] not in favorites:
+            favorites[product['id']] = True
+            product['favoriteCount'] = (product.get('favoriteCount') or 0) + 1
+            graph.rank_product(product)
+    return [(user is not None, product.get('name') if product else None)]
+
+
+@handles(USER_FAVORITES_QUERY)
+def _user_favorites(graph, params):
+    user = graph.user_by_cpf(params['cpf'])
+    if user is None:
+        return []
+    return [_product_row(product) for product in graph.products_by_name(graph.favorites.get(user['id'], ()))]
+
+
+@handles(ALL_PRODUCTS_QUERY)
+def _all_products(graph, params):
+    return [_product_row(graph.products[pid]) for _, pid in graph.name_index]
+
+
+@handles(REMOVE_FAVORITE_QUERY)
+def _remove_favorite(graph, params):
+    user = graph.user_by_cpf(params['cpf'])
+    favorites = graph.favorites.get(user['id'], {}) if user else {}
+    if favorites.pop(params['productId'], None) is None:
+        return []
+    product = graph.products[params['productId']]
+    product['favoriteCount'] = max((product.get('favoriteCount') or 0) - 1, 0)
+    graph.rank_product(product)
+    return [(product.get('name'),)]
+
+
+@handles(APPLY_FAVORITES_QUERY)
+def _apply_favorites(graph, params):
+    applied = 0
+    for row in params['rows']:
+        user = graph.user_by_cpf(row['cpf'])
+        product = graph.products.get(row['productId'])
+        if user is None or product is None:
+            continue
+        applied += 1
+        favorites = graph.favorites.setdefault(user['id'], {})
+        if row['favorite'] and product['id'] not in favorites:
+            favorites[product['id']] = True
+            product['favoriteCount'] = (product.get('favoriteCount') or 0) + 1
+        elif not row['favorite'] and favorites.pop(product['id'], None) is not None:
+            product['favoriteCount'] = max((product.get('favoriteCount') or 0) - 1, 0)
+        graph.rank_product(product)
+    return [(applied,)]
+
+
+# Parallel loader: the MERGE statements only create what is missing
+
+@handles(LOAD_USERS_QUERY)
+def _load_users(graph, params):
+    for row in params['rows']:
+        if graph.user_by_cpf(row['props']['cpf']) is None:
+            user = graph.add_user(row['props'])
+            for address in row.get('addresses') or []:
+                graph.add_address(user['id'], address)
+    return []
+
+
+@handles(LOAD_PRODUCTS_QUERY)
+def _load_products(graph, params):
+    unknown = []
+    for row in params['rows']:
+        seller = graph.user_by_cpf(row['sellerCpf']) if row.get('sellerCpf') else None
+        product = graph.products.get(row['props']['id'])
+        if product is None:
+            graph.add_product(row['props'], seller)
+        elif seller is not None:
+            product['sellerId'] = seller['id']
+            graph.products_by_seller.setdefault(seller['id'], set()).add(product['id'])
+        if row.get('sellerCpf') and seller is None:
+            unknown.append((row['sellerCpf'],))
+    return unknown
+
+
+@handles(LOAD_ORDERS_QUERY)
+def _load_orders(graph, params):
+    for row in params['rows']:
+        user = graph.user_by_cpf(row['cpf'])
+        if user is None:
+            continue
+        value = sum(graph.products[item['productId']]['price'] * item['quantity']
+                    for item in row['items'] if item['productId'] in graph.products)
+        if row['id'] not in graph.orders:
+            graph.add_order({'id': row['id'], 'status': row['status'], 'date': row['date'],
+                             'buyerId': user['id']}, user, [])
+        graph.orders[row['id']]['value'] = value
+    return []
+
+
+@handles(LOAD_ORDER_LINES_QUERY)
+def _load_order_lines(graph, params):
+    unmatched = []
+    for row in params['rows']:
+        order_id, product_id = row['orderId'], row['productId']
+        if order_id not in graph.orders or product_id not in graph.products:
+            unmatched.append((order_id, product_id, order_id in graph.orders))
+            continue
+        if any(line_product_id == product_id for line_product_id, _ in graph.order_lines[order_id]):
+            continue
+        graph.order_lines[order_id].append((product_id, row['quantity']))
+        graph.orders_by_product.setdefault(product_id, []).append(order_id)
+    return unmatched
+
+
+# Graph export and restore
+
+def _properties(node):
+    """The stored properties of a node, without the backend's bookkeeping keys"""
+    return {key: value for key, value in node.items() if not key.startswith('_')}
+
+
+@handles(EXPORT_USERS_QUERY)
+def _export_users(graph, params):
+    return [(_properties(user),) for user in graph.users.values()]
+
+
+@handles(EXPORT_PRODUCTS_QUERY)
+def _export_products(graph, params):
+    return [(_properties(product),) for product in graph.products.values()]
+
+
+@handles(EXPORT_ORDERS_QUERY)
+def _export_orders(graph, params):
+    return [(dict(order),) for order in graph.orders.values()]
+
+
+@handles(EXPORT_ADDRESSES_QUERY)
+def _export_addresses(graph, params):
+    return [(user_id, dict(address)) for user_id, addresses in graph.addresses.items() for address in addresses]
+
+
+@handles(EXPORT_STOCK_SHARDS_QUERY)
+def _export_stock_shards(graph, params):
+    return [(product['id'], dict(shard, productId=product['id']))
+            for product in graph.products.values() for shard in product.get('_shards', ())]
+
+
+@handles(EXPORT_SELLS_QUERY)
+def _export_sells(graph, params):
+    return [(seller_id, product_id) for seller_id, product_ids in graph.products_by_seller.items()
+            for product_id in product_ids]
+
+
+@handles(EXPORT_ORDERED_QUERY)
+def _export_ordered(graph, params):
+    return [(user_id, order_id) for user_id, order_ids in graph.orders_by_user.items() for order_id in order_ids]
+
+
+@handles(EXPORT_CONTAINS_QUERY)
+def _export_contains(graph, params):
+    return [(order_id, product_id, quantity) for order_id, lines in graph.order_lines.items()
+            for product_id, quantity in lines]
+
+
+@handles(EXPORT_FAVORITES_QUERY)
+def _export_favorites(graph, params):
+    return [(user_id, product_id) for user_id, favorites in graph.favorites.items() for product_id in favorites]
+
+
+@handles(EXPORT_BOUGHT_WITH_QUERY)
+def _export_bought_with(graph, params):
+    return [(a, b, weight) for a, weights in graph.bought_with.items() for b, weight in weights.items()]
+
+
+@handles(GRAPH_IS_EMPTY_QUERY)
+def _graph_is_empty(graph, params):
+    return [(not (graph.users or graph.products or graph.orders or graph.addresses),)]
+
+
+@handles(RESTORE_USERS_QUERY)
+def _restore_users(graph, params):
+    graph.check_new_users([row[0] for row in params['rows']])
+    for row in params['rows']:
+        graph.add_user(row[0])
+    return []
+
+
+@handles(RESTORE_PRODUCTS_QUERY)
+def _restore_products(graph, params):
+    graph.check_new_products([row[0] for row in params['rows']])
+    for row in params['rows']:
+        # add_product starts the counters over; the exported values win
+        product = graph.add_product(row[0])
+        product.update(row[0])
+        graph.rank_product(product)
+    return []
+
+
+@handles(RESTORE_ORDERS_QUERY)
+def _restore_orders(graph, params):
+    for row in params['rows']:
+        if row[0]['id'] in graph.orders:
+            raise MemoryConstraintError(f"Order with id {row[0]['id']} already exists")
+    for row in params['rows']:
+        graph.orders[row[0]['id']] = dict(row[0])
+        graph.order_lines.setdefault(row[0]['id'], [])
+    return []
+
+
+@handles(RESTORE_ADDRESSES_QUERY)
+def _restore_addresses(graph, params):
+    for user_id, address in params['rows']:
+        if user_id in graph.users:
+            graph.add_address(user_id, address)
+    return []
+
+
+@handles(RESTORE_STOCK_SHARDS_QUERY)
+def _restore_stock_shards(graph, params):
+    for product_id, shard in params['rows']:
+        product = graph.products.get(product_id)
+        if product is not None:
+            product.setdefault('_shards', []).append({key: value for key, value in shard.items()
+                                                      if key != 'productId'})
+            product['_shards'].sort(key=lambda s: s['shard'])
+            graph.rank_product(product)
+    return []
+
+
+@handles(RESTORE_SELLS_QUERY)
+def _restore_sells(graph, params):
+    for user_id, product_id in params['rows']:
+        if user_id in graph.users and product_id in graph.products:
+            graph.products_by_seller.setdefault(user_id, set()).add(product_id)
+    return []
+
+
+@handles(RESTORE_ORDERED_QUERY)
+def _restore_ordered(graph, params):
+    for user_id, order_id in params['rows']:
+        if user_id in graph.users and order_id in graph.orders:
+            graph.orders_by_user.setdefault(user_id, []).append(order_id)
+    return []
+
+
+@handles(RESTORE_CONTAINS_QUERY)
+def _restore_contains(graph, params):
+    for order_id, product_id, quantity in params['rows']:
+        if order_id in graph.orders and product_id in graph.products:
+            graph.order_lines[order_id].append((product_id, quantity))
+            graph.orders_by_product.setdefault(product_id, []).append(order_id)
+    return []
+
+
+@handles(RESTORE_FAVORITES_QUERY)
+def _restore_favorites(graph, params):
+    for user_id, product_id in params['rows']:
+        if user_id in graph.users and product_id in graph.products:
+            graph.favorites.setdefault(user_id, {})[product_id] = True
+    return []
+
+
+@handles(RESTORE_BOUGHT_WITH_QUERY)
+def _restore_bought_with(graph, params):
+    for a, b, weight in params['rows']:
+        if a in graph.products and b in graph.products:
+            graph.bought_with.setdefault(a, {})[b] = weight
+    return []
+
+
+class MemorySession:
+    """Session/transaction object of the memory backend (run, execute_read, execute_write)"""
+
+    def __init__(self, graph, handlers=None):
+        self.graph = graph
+        self.handlers = handlers or {}
+
+    def run(self, query, parameters=None, **kwargs):
+        handler = self.handlers.get(query) or _HANDLERS.get(query)
+        if handler is None:
+            first_line = next((line.strip() for line in query.splitlines() if line.strip()), '')
+            raise UnsupportedQueryError(f"The memory backend has no handler for: {first_line}")
+
+        with self.graph.lock:
+            return handler(self.graph, parameters or {})
+
+    def execute_read(self, work, *args, **kwargs):
+        with self.graph.lock:
+            return work(self, *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        with self.graph.lock:
+            return work(self, *args, **kwargs)
+
+
+class MemoryBackend:
+    """Backend keeping the whole graph in this process (no server, nothing persisted)"""
+
+    name = 'memory'
+
+    def __init__(self, uri=None, user=None, password=None, config=None):
+        self.graph = MemoryGraph()
+        self.handlers = {}
+
+    def add_handlers(self, handlers):
+        """
+        Answer more statements on this backend only: handlers maps each
+        statement to a handler(graph, parameters), as @handles registers
+        them for every backend (for scripts with statements of their own)
+        """
+        self.handlers.update(handlers)
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def session(self, access=None, fetch_size=None):
+        yield MemorySession(self.graph, self.handlers)
@@ -0,0 +1,154 @@
+"""
+Compact row types returned by the operation modules
+
+Each type uses __slots__ so a row costs a fixed-size object instead of a
+per-row dict with repeated keys. They still support row['name'],
+row['stock'] -= 1, row.get(...) and dict(row), so callers written against
+the old dictionaries keep working.
+"""
+
+
+class Model:
+    """Base class giving slotted rows read/write dictionary-style access"""
+
+    __slots__ = ()
+
+    # Dictionary key -> attribute name, for keys that are not valid or
+    # idiomatic attribute names (the Neo4j property names are camelCase)
+    _aliases = {}
+    # Attributes only some rows have (e.g. a search score): left out of
+    # keys() and dict(row) while None
+    _optional = ()
+
+    def _attribute(self, key):
+        attribute = self._aliases.get(key, key)
+        if attribute not in self.__slots__:
+            raise KeyError(key)
+        return attribute
+
+    def __getitem__(self, key):
+        return getattr(self, self._attribute(key))
+
+    def __setitem__(self, key, value):
+        setattr(self, self._attribute(key), value)
+
+    def __contains__(self, key):
+        attribute = self._aliases.get(key, key)
+        return attribute in self.__slots__ and not (attribute in self._optional and getattr(self, attribute) is None)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        reverse = {attribute: key for key, attribute in self._aliases.items()}
+        return [reverse.get(attribute, attribute) for attribute in self.__slots__
+                if attribute not in self._optional or getattr(self, attribute) is not None]
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def copy(self):
+        clone = object.__new__(type(self))
+        for attribute in self.__slots__:
+            setattr(clone, attribute, getattr(self, attribute))
+        return clone
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{a}={getattr(self, a)!r}" for a in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Product(Model):
+    __slots__ = ('id', 'name', 'description', 'brand', 'price', 'stock', 'rating', 'score')
+    _optional = ('score',)
+
+    def __init__(self, id, name, description=None, brand=None, price=None, stock=None, rating=None, score=None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.brand = brand
+        self.price = price
+        self.stock = stock
+        self.rating = rating
+        self.score = score
+
+
+class Order(Model):
+    __slots__ = ('id', 'value', 'status', 'date', 'products')
+
+    def __init__(self, id, value=None, status=None, date=None, products=None):
+        self.id = id
+        self.value = value
+        self.status = status
+        self.date = date
+        self.products = products
+
+
+class OrderLine(Model):
+    __slots__ = ('id', 'name', 'price', 'quantity', 'total')
+
+    def __init__(self, id, name, price, quantity, total):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.total = total
+
+
+class User(Model):
+    __slots__ = ('id', 'name', 'last_name', 'email', 'cpf', 'is_seller')
+    _aliases = {'lastName': 'last_name', 'isSeller': 'is_seller'}
+
+    def __init__(self, id, name=None, last_name=None, email=None, cpf=None, is_seller=None):
+        self.id = id
+        self.name = name
+        self.last_name = last_name
+        self.email = email
+        self.cpf = cpf
+        self.is_seller = is_seller
+
+
+# Row mappers, one per query projection. They index the record positionally,
+# which is the cheapest way to read a neo4j Record.
+
+def product_from_record(record):
+    """(id, name, description, brand, price, stock, rating) -> Product"""
+    return Product(record[0], record[1], record[2], record[3], record[4], record[5], record[6])
+
+
+def search_result_from_record(record):
+    """(id, name, description, brand, price, stock, rating, score) -> Product with score"""
+    return Product(record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7])
+
+
+def order_from_record(record):
+    """(id, value, status, date) -> Order, with the Neo4j DateTime as a Python datetime"""
+    order_date = record[3]
+    if hasattr(order_date, 'to_native'):
+        order_date = order_date.to_native()
+    return Order(record[0], record[1], record[2], order_date)
+
+
+def order_with_lines_from_record(record):
+    """(id, value, status, date, [line, ...]) -> Order with its OrderLines"""
+    order = order_from_record(record)
+    order.products = [order_line_from_record(line) for line in record[4]]
+    return order
+
+
+def order_line_from_record(record):
+    """(id, name, price, quantity, total) -> OrderLine"""
+    return OrderLine(record[0], record[1], record[2], record[3], record[4])
+
+
+def user_from_record(record):
+    """(id, name, lastName) -> User identity"""
+    return User(record[0], record[1], record[2])
@@ -1,38 +1,383 @@
 
-from neo4j import GraphDatabase
+import os
+import time
+from contextlib import contextmanager
+
+from neo4j import GraphDatabase, READ_ACCESS, WRITE_ACCESS
+
+from catalog_snapshot import CatalogSnapshot
+from favorite_queue import FavoriteQueue
+from identity_cache import IdentityCache
+from memory_backend import MemoryBackend
+from product_cache import ProductCache
+from query_metrics import QueryMetrics, result_summary, server_time_ms
+from schema import ensure_schema
+from slow_query_log import SlowQueryLog
+
+# Settings read from the environment (or overridden by a config dictionary),
+# with the values the project has always used as defaults. The database
+# and its credentials have none: see require_credentials.
+DEFAULT_CONFIG = {
+    'backend': 'neo4j',
+    'uri': None,
+    'user': None,
+    'password': None,
+    'database': None,
+    'max_connection_pool_size': 100,
+    'connection_acquisition_timeout': 60.0,
+    'keep_alive': True,
+    'fetch_size': 1000,
+    'max_transaction_retry_time': 30.0,
+    'product_cache_size': 256,
+    'product_cache_ttl': 30.0,
+    'product_cache_max_rows': 10000,
+    'identity_cache_size': 10000,
+    'identity_cache_not_found_ttl': 5.0,
+    'catalog_snapshot': False,
+    'catalog_snapshot_refresh': 5.0,
+    'query_metrics': True,
+    'query_metrics_file': None,
+    'slow_query_ms': 1000.0,
+    'slow_query_log': 'neo4j_slow_queries.log',
+    'slow_query_log_bytes': 1048576,
+    'slow_query_log_backups': 5,
+    'slow_query_profile': False,
+    'slow_query_dedupe_seconds': 3600.0,
+    'favorite_write_behind': False,
+    'favorite_flush_ms': 10.0,
+    'favorite_flush_events': 500,
+    'favorite_spool': None,
+    'favorite_max_attempts': 10,
+    'favorite_max_backoff': 30.0,
+    'legacy_order_timezone': None,
+}
+
+ENV_VARIABLES = {
+    'backend': 'NEO4J_BACKEND',
+    'uri': 'NEO4J_URI',
+    'user': 'NEO4J_USERNAME',
+    'password': 'NEO4J_PASSWORD',
+    'database': 'NEO4J_DATABASE',
+    'max_connection_pool_size': 'NEO4J_MAX_POOL_SIZE',
+    'connection_acquisition_timeout': 'NEO4J_ACQUISITION_TIMEOUT',
+    'keep_alive': 'NEO4J_KEEP_ALIVE',
+    'fetch_size': 'NEO4J_FETCH_SIZE',
+    'max_transaction_retry_time': 'NEO4J_MAX_RETRY_TIME',
+    'product_cache_size': 'PRODUCT_CACHE_SIZE',
+    'product_cache_ttl': 'PRODUCT_CACHE_TTL',
+    'product_cache_max_rows': 'PRODUCT_CACHE_MAX_ROWS',
+    'identity_cache_size': 'IDENTITY_CACHE_SIZE',
+    'identity_cache_not_found_ttl': 'IDENTITY_CACHE_NOT_FOUND_TTL',
+    'catalog_snapshot': 'CATALOG_SNAPSHOT',
+    'catalog_snapshot_refresh': 'CATALOG_SNAPSHOT_REFRESH',
+    'query_metrics': 'NEO4J_QUERY_METRICS',
+    'query_metrics_file': 'NEO4J_QUERY_METRICS_FILE',
+    'slow_query_ms': 'NEO4J_SLOW_QUERY_MS',
+    'slow_query_log': 'NEO4J_SLOW_QUERY_LOG',
+    'slow_query_log_bytes': 'NEO4J_SLOW_QUERY_LOG_BYTES',
+    'slow_query_log_backups': 'NEO4J_SLOW_QUERY_LOG_BACKUPS',
+    'slow_query_profile': 'NEO4J_SLOW_QUERY_PROFILE',
+    'slow_query_dedupe_seconds': 'NEO4J_SLOW_QUERY_DEDUPE_SECONDS',
+    'favorite_write_behind': 'FAVORITE_WRITE_BEHIND',
+    'favorite_flush_ms': 'FAVORITE_FLUSH_MS',
+    'favorite_flush_events': 'FAVORITE_FLUSH_EVENTS',
+    'favorite_spool': 'FAVORITE_SPOOL',
+    'favorite_max_attempts': 'FAVORITE_MAX_ATTEMPTS',
+    'favorite_max_backoff': 'FAVORITE_MAX_BACKOFF',
+    'legacy_order_timezone': 'LEGACY_ORDER_TIMEZONE',
+}
+
+
+def require_credentials(uri, user, password):
+    """Raise ValueError naming the environment variables missing for a Neo4j connection"""
+    settings = {'uri': uri, 'user': user, 'password': password}
+    missing = [ENV_VARIABLES[key] for key, value in settings.items() if not value]
+    if missing:
+        raise ValueError(f"Missing Neo4j connection settings, set {', '.join(missing)}")
+
+
+def _convert(key, value):
+    """Convert a string setting to the type of its default value"""
+    default = DEFAULT_CONFIG[key]
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def load_config(overrides=None):
+    """
+    Build the connection settings
+
+    Precedence: explicit overrides, then environment variables, then defaults.
+    """
+    config = dict(DEFAULT_CONFIG)
+
+    for key, variable in ENV_VARIABLES.items():
+        value = os.environ.get(variable)
+        if value not in (None, ''):
+            config[key] = _convert(key, value)
+
+    for key, value in (overrides or {}).items():
+        if key not in DEFAULT_CONFIG:
+            raise ValueError(f"Unknown Neo4j setting: {key}")
+        config[key] = _convert(key, value) if isinstance(value, str) else value
+
+    return config
+
+
+def _collect_records(tx, query, parameters):
+    """Transaction function returning every record of one statement and its summary"""
+    result = tx.run(query, parameters)
+    records = [record for record in result]
+    return records, result_summary(result)
+
+
+class Neo4jBackend:
+    """Backend talking to a Neo4j server through the official driver"""
+
+    name = 'neo4j'
+
+    def __init__(self, uri, user, password, config):
+        require_credentials(uri, user, password)
+        self.database = config['database']
+        self.driver = GraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=config['max_connection_pool_size'],
+            connection_acquisition_timeout=config['connection_acquisition_timeout'],
+            keep_alive=config['keep_alive'],
+            max_transaction_retry_time=config['max_transaction_retry_time'],
+        )
+        # Shared by every session, so a read routed to a follower always
+        # waits for the writes this connection has already committed
+        self.bookmarks = GraphDatabase.bookmark_manager()
+
+    def close(self):
+        self.driver.close()
+
+    def session(self, access, fetch_size):
+        return self.driver.session(database=self.database, default_access_mode=access, fetch_size=fetch_size,
+                                   bookmark_manager=self.bookmarks)
+
+
+# A backend only has to provide close() and session(access, fetch_size),
+# returning a context manager whose session offers run(), execute_read()
+# and execute_write(); everything else in Neo4jConnection is built on that
+BACKENDS = {
+    'neo4j': Neo4jBackend,
+    'memory': MemoryBackend,
+}
+
 
 class Neo4jConnection:
     """Simple Neo4j database connection"""
-    
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+
+    def __init__(self, uri, user, password, config=None):
+        self.config = load_config(config)
+        self.database = self.config['database']
+        self.fetch_size = self.config['fetch_size']
+
+        backend = BACKENDS.get(self.config['backend'])
+        if backend is None:
+            raise ValueError(f"Unknown backend: {self.config['backend']}")
+        self.backend = backend(uri, user, password, self.config)
+
+        # Shared by the product read functions; a size of 0 disables it
+        self.product_cache = None
+        if self.config['product_cache_size'] > 0:
+            self.product_cache = ProductCache(self.config['product_cache_size'],
+                                              self.config['product_cache_ttl'],
+                                              self.config['product_cache_max_rows'])
+        # CPF -> user identity, shared by everything that resolves a user by CPF
+        self.identity_cache = None
+        if self.config['identity_cache_size'] > 0:
+            self.identity_cache = IdentityCache(self.config['identity_cache_size'],
+                                                self.config['identity_cache_not_found_ttl'])
+        # Columnar copy of the catalog answering product listings locally;
+        # loaded on first use and refreshed every catalog_snapshot_refresh seconds
+        self.catalog_snapshot = None
+        if self.config['catalog_snapshot']:
+            self.catalog_snapshot = CatalogSnapshot(self.config['catalog_snapshot_refresh'])
+        # Per-operation latency histograms and summary counters of every statement
+        self.metrics = QueryMetrics() if self.config['query_metrics'] else None
+        # Plans of statements slower than slow_query_ms; a threshold of 0 disables it
+        self.slow_queries = None
+        if self.config['slow_query_ms'] > 0 and self.config['slow_query_log']:
+            self.slow_queries = SlowQueryLog(self.config['slow_query_ms'],
+                                             self.config['slow_query_log'],
+                                             self.config['slow_query_log_bytes'],
+                                             self.config['slow_query_log_backups'],
+                                             self.config['slow_query_profile'],
+                                             self.config['slow_query_dedupe_seconds'])
+        # Favorite changes coalesced and written in batches by a background thread
+        self.favorite_queue = None
+        if self.config['favorite_write_behind']:
+            self.favorite_queue = FavoriteQueue(self, self.config['favorite_flush_ms'] / 1000,
+                                                self.config['favorite_flush_events'],
+                                                self.config['favorite_spool'],
+                                                self.config['favorite_max_attempts'],
+                                                self.config['favorite_max_backoff'])
 
     def close(self):
-        """Close the Neo4j connection"""
-        self.driver.close()
+        """Close the Neo4j connection (writing the metrics to query_metrics_file, if set)"""
+        try:
+            if self.favorite_queue is not None:
+                self.favorite_queue.close()
+        finally:
+            if self.slow_queries is not None:
+                self.slow_queries.close()
+            if self.metrics is not None and self.config['query_metrics_file']:
+                self.metrics.dump(self.config['query_metrics_file'])
+            self.backend.close()
+
+    @contextmanager
+    def session(self, access=WRITE_ACCESS, fetch_size=None):
+        """
+        Open a session to run several statements or transactions in a row
+
+        Use access=READ_ACCESS for read-only work so a cluster can route it
+        to a follower.
+        """
+        with self.backend.session(access, fetch_size or self.fetch_size) as session:
+            yield session
+
+    def _observe(self, operation, query, parameters, started, records=0, summary=None, failed=False,
+                 read_only=False, slow_ms=None):
+        """
+        Record one statement execution in the metrics and, if it was slow, in
+        the slow-query log (judged by slow_ms if given, else the elapsed time)
+        """
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if self.metrics is not None:
+            self.metrics.record(operation, elapsed_ms, records, summary, failed)
+
+        if self.slow_queries is not None and not failed:
+            self.slow_queries.observe(self, operation, query, parameters,
+                                      elapsed_ms if slow_ms is None else slow_ms, read_only)
+
+    def _measured(self, execute, query, parameters, operation, read_only=False):
+        """Call execute(query, parameters) -> (records, summary) and record it under operation"""
+        parameters = parameters or {}
+        started = time.perf_counter()
+
+        try:
+            records, summary = execute(query, parameters)
+        except Exception:
+            self._observe(operation, query, parameters, started, failed=True)
+            raise
+
+        self._observe(operation, query, parameters, started, len(records), summary, read_only=read_only)
+        return records
+
+    def _auto_commit(self, query, parameters):
+        with self.session() as session:
+            return _collect_records(session, query, parameters)
 
-    def run_query(self, query, parameters=None):
-        """Execute a Cypher query"""
-        with self.driver.session() as session:
-            result = session.run(query, parameters or {})
-            return [record for record in result]
+    def _read_transaction(self, query, parameters):
+        return self.execute_read(_collect_records, query, parameters)
 
-def connect_neo4j():
+    def _write_transaction(self, query, parameters):
+        return self.execute_write(_collect_records, query, parameters)
+
+    def run_query(self, query, parameters=None, operation=None):
+        """
+        Execute a Cypher query in an auto-commit transaction (schema and admin statements)
+
+        Every query method takes an operation name (for example
+        'create_order' or 'catalog_snapshot.refresh') under which the
+        statement is recorded in self.metrics. Statements slower than
+        slow_query_ms also get their plan written to the slow-query log.
+        """
+        return self._measured(self._auto_commit, query, parameters, operation)
+
+    def stream_query(self, query, parameters=None, fetch_size=None, operation=None):
+        """
+        Execute a read-only Cypher query and yield its records one by one
+
+        Records are pulled from the server fetch_size at a time as the
+        generator is consumed, so memory stays bounded no matter how many rows
+        match. The session stays open until the generator is exhausted or closed.
+        The statement is recorded once the generator finishes, with the time
+        from the call to the end of the stream as its client time, like the
+        other query methods, and the server's own times from the summary.
+        The slow-query log judges it by the server's time when the summary
+        has it, since the time the consumer spends between records is not
+        the statement's.
+        """
+        parameters = parameters or {}
+        started = time.perf_counter()
+        count = 0
+        summary = None
+        failed = False
+
+        try:
+            with self.session(READ_ACCESS, fetch_size) as session:
+                result = session.run(query, parameters)
+                try:
+                    for record in result:
+                        count += 1
+                        yield record
+                finally:
+                    # Also discards whatever a consumer that stopped early left unread
+                    summary = result_summary(result)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._observe(operation, query, parameters, started, count, summary, failed, read_only=True,
+                          slow_ms=server_time_ms(summary))
+
+    def execute_read(self, work, *args, **kwargs):
+        """
+        Run work(tx, *args, **kwargs) as one managed read transaction
+
+        The driver retries the whole function on transient errors (leader
+        switches, deadlocks, unavailable members) for up to
+        max_transaction_retry_time seconds, so work must be safe to repeat.
+        """
+        with self.session(READ_ACCESS) as session:
+            return session.execute_read(work, *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        """Run work(tx, *args, **kwargs) as one managed write transaction, retried like execute_read"""
+        with self.session(WRITE_ACCESS) as session:
+            return session.execute_write(work, *args, **kwargs)
+
+    def read_query(self, query, parameters=None, operation=None):
+        """Execute a read-only Cypher query (routable to followers)"""
+        return self._measured(self._read_transaction, query, parameters, operation, read_only=True)
+
+    def write_query(self, query, parameters=None, operation=None):
+        """Execute a Cypher query that writes (always sent to the leader)"""
+        return self._measured(self._write_transaction, query, parameters, operation)
+
+def connect_neo4j(config=None):
     """Connect to Neo4j database"""
-  
-    uri = "neo4j+ssc://8a569689.databases.neo4j.io"
-    user = "neo4j"
-    password = "n6zO8HsnKL-CffsF6DmzHlT5BPGNfNWGzUzYuVfIX_k"
-    
+
+    settings = load_config(config)
+    conn = None
+
     try:
-        conn = Neo4jConnection(uri, user, password)
-        print("Connected to Neo4j successfully")
+        conn = Neo4jConnection(settings['uri'], settings['user'], settings['password'], config)
+        if conn.backend.name == 'memory':
+            print("Using the in-memory graph backend")
+        else:
+            print("Connected to Neo4j successfully")
+        ensure_schema(conn, conn.config['legacy_order_timezone'])
         return conn
     except Exception as e:
         print(f"Failed to connect to Neo4j: {e}")
+        # The driver, its pool and the background threads were already started
+        if conn is not None:
+            conn.close()
         return None
 
 def close_connection(driver):
     """Close Neo4j connection"""
     if driver:
-        driver.close()
\ No newline at end of file
+        driver.close()
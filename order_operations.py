@@ -1,127 +1,371 @@
 
+import base64
+import json
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 
-def create_order(driver, buyer_cpf, products):
+import pytz
+
+from catalog_snapshot import current_snapshot
+from inventory_operations import PRODUCT_STOCK
+from product_cache import apply_stock_changes, cached_stream
+from models import order_from_record, order_line_from_record, order_with_lines_from_record, product_from_record
+
+# Cypher statements are module constants so the async counterparts in
+# async_order_operations.py run exactly the same queries
+
+CREATE_ORDER_QUERY = """
+MATCH (u:User {cpf: $cpf})
+// Products are locked in product id order whatever the cart order, so two
+// orders sharing products can't each hold one the other is waiting for
+UNWIND $items AS item
+WITH u, item
+ORDER BY item.productId
+OPTIONAL MATCH (p:Product {id: item.productId})
+// A sharded product (see inventory_operations) is served by its stock
+// shards: taken in a random order, as many as the stock read before
+// locking says it takes to cover the quantity
+CALL {
+    WITH p, item
+    OPTIONAL MATCH (p)-[:STOCK_SHARD]->(s:StockShard)
+    WHERE s.stock > 0
+    WITH item, s
+    ORDER BY rand()
+    WITH item, collect(s) AS shards
+    RETURN reduce(picked = [], s IN shards |
+        CASE WHEN reduce(units = 0, t IN picked | units + t.stock) >= item.quantity THEN picked
+             ELSE picked + s END) AS picked
+}
+// Take the write lock on every node holding the stock (product or shards,
+// in shard order) before reading it, so two concurrent orders can never
+// both pass the check for the same units
+CALL {
+    WITH p, picked
+    UNWIND CASE WHEN p.stockShards IS NULL THEN [p] ELSE picked END AS held
+    WITH held
+    ORDER BY held.shard
+    SET held._lock = true
+    REMOVE held._lock
+    RETURN count(held) AS locked
+}
+// Shards drained by an order that committed meanwhile: move on to the rest
+// of the product's shards, locked in shard order as well
+CALL {
+    WITH p, item, picked
+    WITH p, item, picked
+    WHERE p.stockShards IS NOT NULL AND reduce(units = 0, s IN picked | units + s.stock) < item.quantity
+    MATCH (p)-[:STOCK_SHARD]->(s:StockShard)
+    WHERE NOT s IN picked
+    WITH s
+    ORDER BY s.shard
+    SET s._lock = true
+    REMOVE s._lock
+    RETURN collect(s) AS rest
+}
+// Split the quantity across the locked holders, in the order they were picked
+WITH u, item, p,
+     reduce(split = {left: item.quantity, takes: []},
+            held IN CASE WHEN p.stockShards IS NULL THEN [p] ELSE picked + rest END |
+         CASE WHEN split.left = 0 OR held.stock <= 0 THEN split
+              ELSE {left: split.left - CASE WHEN held.stock < split.left THEN held.stock ELSE split.left END,
+                    takes: split.takes + {held: held,
+                                          units: CASE WHEN held.stock < split.left THEN held.stock
+                                                      ELSE split.left END}} END) AS split
+WITH u, collect(CASE WHEN p IS NULL THEN null
+                     ELSE {product: p, quantity: item.quantity, takes: split.takes, short: split.left > 0}
+                END) AS lines
+WITH u, lines,
+     [l IN lines WHERE l.short | l.product.id] AS shortIds,
+     reduce(total = 0.0, l IN lines | total + l.product.price * l.quantity) AS total
+CALL {
+    WITH u, lines, shortIds, total
+    WITH u, lines, total
+    WHERE size(lines) > 0 AND size(shortIds) = 0
+    CREATE (u)-[:ORDERED]->(o:Order {id: $orderId, value: total, status: 'Pending',
+                                     date: $date, buyerId: u.id})
+    WITH o, lines
+    UNWIND lines AS line
+    WITH o, line, line.product AS p
+    // Locks p as well, sharded or not (see inventory_operations)
+    CREATE (o)-[:CONTAINS {quantity: line.quantity}]->(p)
+    // The units, their sales counters and updatedAt go on the nodes they
+    // were taken from (see inventory_operations); the order counts once,
+    // on the first of them
+    WITH line
+    UNWIND range(0, size(line.takes) - 1) AS i
+    WITH line.takes[i].held AS held, line.takes[i].units AS units, i
+    SET held.stock = held.stock - units,
+        held.unitsSold = coalesce(held.unitsSold, 0) + units,
+        held.orderCount = coalesce(held.orderCount, 0) + CASE WHEN i = 0 THEN 1 ELSE 0 END,
+        held.updatedAt = timestamp()
+}
+// Count this order in the co-purchase weights read by
+// recommendation_operations, one BOUGHT_WITH edge per direction and pair
+CALL {
+    WITH lines, shortIds
+    WITH [l IN lines | l.product] AS products
+    WHERE size(products) > 1 AND size(shortIds) = 0
+    UNWIND products AS a
+    UNWIND products AS b
+    WITH a, b
+    WHERE a <> b
+    MERGE (a)-[r:BOUGHT_WITH]->(b)
+    ON CREATE SET r.weight = 1
+    ON MATCH SET r.weight = r.weight + 1
+}
+RETURN [l IN lines | l.product.id] AS foundIds, shortIds, total
+"""
+
+# Seeks product_stock and product_stock_shards; only the sharded products
+# need their shards summed to know whether they still have stock
+AVAILABLE_PRODUCTS_QUERY = f"""
+MATCH (p:Product)
+WHERE p.stock > 0 OR p.stockShards IS NOT NULL
+WITH p, {PRODUCT_STOCK} AS stock
+WHERE stock > 0
+RETURN p.id, p.name, p.description, p.brand, p.price, stock, p.rating
+ORDER BY p.name
+"""
+
+# Orders are found through their buyerId and date, so both statements are
+# one seek into the order_buyer_date index, read newest first ($until is
+# exclusive; unbounded ranges get the MIN/MAX_ORDER_DATE sentinels so the
+# predicates always stay index-usable)
+USER_ORDERS_QUERY = """
+MATCH (u:User {cpf: $cpf})
+MATCH (o:Order)
+WHERE o.buyerId = u.id AND o.date >= $since AND o.date < $until
+RETURN o.id, o.value, o.status, o.date
+ORDER BY o.date DESC, o.id DESC
+"""
+
+# Keyset page: resumes strictly before the (date, id) of the previous page's
+# last order, so every page is a bounded index read however deep it is
+USER_ORDERS_PAGE_QUERY = """
+MATCH (u:User {cpf: $cpf})
+MATCH (o:Order)
+WHERE o.buyerId = u.id AND o.date >= $since AND o.date <= $fromDate
+  AND (o.date < $fromDate OR o.id < $beforeId)
+RETURN o.id, o.value, o.status, o.date
+ORDER BY o.date DESC, o.id DESC
+LIMIT $limit
+"""
+
+ORDER_PRODUCTS_QUERY = """
+MATCH (o:Order {id: $orderId})-[r:CONTAINS]->(p:Product)
+RETURN p.id, p.name, p.price, r.quantity, p.price * r.quantity
+"""
+
+ORDERS_PRODUCTS_QUERY = """
+UNWIND $orderIds AS orderId
+MATCH (o:Order {id: orderId})-[r:CONTAINS]->(p:Product)
+RETURN o.id, p.id, p.name, p.price, r.quantity, p.price * r.quantity
+"""
+
+# The orders of USER_ORDERS_QUERY with their line items collected per order,
+# so a buyer's history with items is one statement instead of 1 + N
+USER_ORDERS_WITH_ITEMS_QUERY = """
+MATCH (u:User {cpf: $cpf})
+MATCH (o:Order)
+WHERE o.buyerId = u.id AND o.date >= $since AND o.date < $until
+CALL {
+    WITH o
+    MATCH (o)-[r:CONTAINS]->(p:Product)
+    RETURN collect([p.id, p.name, p.price, r.quantity, p.price * r.quantity]) AS lines
+}
+RETURN o.id, o.value, o.status, o.date, lines
+ORDER BY o.date DESC, o.id DESC
+"""
+
+MIN_ORDER_DATE = datetime(1970, 1, 1, tzinfo=pytz.utc)
+MAX_ORDER_DATE = datetime(9999, 12, 31, tzinfo=pytz.utc)
+
+def order_time(value):
     """
-    Create an order with multiple products
-    
-    Args:
-        driver: Neo4j connection driver
-        buyer_cpf: CPF of the buyer
-        products: List of dictionaries with product_id and quantity
-        
-    Returns:
-        str: ID of the created order, or None if creation failed
+    Convert a date filter to an aware UTC datetime
+
+    Accepts aware or naive datetimes (naive ones are taken as UTC), dates
+    (midnight UTC) and ISO 8601 strings.
     """
- 
-    find_buyer_query = """
-    MATCH (u:User {cpf: $cpf})
-    RETURN u.id
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+
+    if value.tzinfo is None:
+        return pytz.utc.localize(value)
+    return value.astimezone(pytz.utc)
+
+def build_user_orders_params(buyer_cpf, since=None, until=None):
+    """Build the parameters of USER_ORDERS_QUERY"""
+    return {
+        'cpf': buyer_cpf,
+        'since': order_time(since) if since is not None else MIN_ORDER_DATE,
+        'until': order_time(until) if until is not None else MAX_ORDER_DATE
+    }
+
+def encode_order_cursor(order_date, order_id):
+    """Encode the (date, id) of the last order of a page as an opaque cursor"""
+    raw = json.dumps([order_date.isoformat(), order_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_order_cursor(cursor):
+    """Decode a cursor created by encode_order_cursor into (date, id)"""
+    order_date, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return order_time(order_date), order_id
+
+def build_user_orders_page_params(buyer_cpf, limit, cursor=None, since=None, until=None):
+    """Build the parameters of USER_ORDERS_PAGE_QUERY (fetching one extra row to detect a next page)"""
+    params = build_user_orders_params(buyer_cpf, since, until)
+
+    if cursor:
+        from_date, before_id = decode_order_cursor(cursor)
+    else:
+        # No order has an empty id, so the first page only keeps date < until
+        from_date, before_id = params['until'], ''
+
+    return {
+        'cpf': buyer_cpf,
+        'since': params['since'],
+        'fromDate': from_date,
+        'beforeId': before_id,
+        'limit': int(limit) + 1
+    }
+
+def order_page_from_rows(orders, limit):
+    """Turn the orders of a page query into (orders, next cursor)"""
+    page = orders[:limit]
+
+    next_cursor = None
+    if len(orders) > limit:
+        last = page[-1]
+        next_cursor = encode_order_cursor(last['date'], last['id'])
+
+    return page, next_cursor
+
+def build_create_order_params(buyer_cpf, products):
     """
+    Build the parameters of CREATE_ORDER_QUERY
     
-    buyer_result = driver.run_query(find_buyer_query, {'cpf': buyer_cpf})
+    Repeated products are merged so each one is locked and decremented once,
+    and the items are sorted by product id, the order they are locked in.
     
-    if not buyer_result or not buyer_result[0]:
-        print(f"Buyer with CPF {buyer_cpf} not found")
-        return None
+    Raises:
+        ValueError: If a quantity is not a positive integer
     
-    buyer_id = buyer_result[0][0]
+    Returns:
+        tuple: (order id, {product id: quantity}, query parameters)
+    """
+    quantities = {}
+    for product_entry in products:
+        product_id = product_entry['product_id']
+        quantity = int(product_entry['quantity'])
+        if quantity <= 0:
+            raise ValueError(f"Invalid quantity {quantity} for product with ID {product_id}")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
     
- 
     order_id = str(uuid.uuid4())
     
-    # Calculate total value and prepare products for the order
-    total_value = 0
-    order_products = []
+    params = {
+        'cpf': buyer_cpf,
+        'orderId': order_id,
+        'date': datetime.now(pytz.utc),
+        'items': [{'productId': product_id, 'quantity': quantities[product_id]}
+                  for product_id in sorted(quantities)]
+    }
     
-    for product_entry in products:
-        product_id = product_entry['product_id']
-        quantity = product_entry['quantity']
-        
+    return order_id, quantities, params
+
+def create_order_outcome(result, buyer_cpf, order_id, quantities):
+    """Report the result of CREATE_ORDER_QUERY and return the order id, or None if rejected"""
+    if not result:
+        print(f"Buyer with CPF {buyer_cpf} not found")
+        return None
     
-        product_query = """
-        MATCH (p:Product {id: $productId})
-        RETURN p.name, p.price
-        """
-        
-        product_result = driver.run_query(product_query, {'productId': product_id})
-        
-        if not product_result or not product_result[0]:
+    found_ids, short_ids, total_value = result[0][0], result[0][1], result[0][2]
+    
+    for product_id in quantities:
+        if product_id not in found_ids:
             print(f"Product with ID {product_id} not found")
-            continue
-        
-        product_name = product_result[0][0]
-        product_price = product_result[0][1]
-        product_total = product_price * quantity
-        total_value += product_total
-        
-        order_products.append({
-            'id': product_id,
-            'name': product_name,
-            'price': product_price,
-            'quantity': quantity
-        })
-    
-    if not order_products:
+    
+    if not found_ids:
         print("No valid products for the order")
         return None
-   
-    order_props = {
-        'id': order_id,
-        'value': total_value,
-        'status': "Pending",
-        'date': datetime.now().isoformat(),
-        'buyerId': buyer_id
-    }
     
-    order_query = """
-    CREATE (o:Order $props)
-    RETURN o.id
+    if short_ids:
+        for product_id in short_ids:
+            print(f"Insufficient stock for product with ID {product_id}")
+        print("Order rejected")
+        return None
+    
+    print(f"Order created successfully with ID: {order_id}")
+    print(f"Total value: R$ {total_value:.2f}")
+    
+    return order_id
+
+def create_order(driver, buyer_cpf, products):
     """
+    Create an order with multiple products
     
-    order_result = driver.run_query(order_query, {'props': order_props})
+    The buyer lookup, stock check, total, order creation and stock decrement
+    all happen in one statement inside one write transaction. Every product
+    is locked (in product id order) before its stock is checked, and the
+    order is rejected as a whole if any item is short, so concurrent orders
+    can't oversell. Sharded products lock and decrement the stock shards the
+    units are taken from instead. The same transaction adds the order to the
+    BOUGHT_WITH weights of every pair of its products (see
+    recommendation_operations) and to their unitsSold/orderCount counters
+    (see popularity_operations). An order with a quantity that is not a
+    positive integer is rejected before anything is sent.
     
-    if not order_result:
-        print("Failed to create order")
+    Args:
+        driver: Neo4j connection driver
+        buyer_cpf: CPF of the buyer
+        products: List of dictionaries with product_id and quantity (> 0)
+        
+    Returns:
+        str: ID of the created order, or None if creation failed
+    """
+    try:
+        order_id, quantities, params = build_create_order_params(buyer_cpf, products)
+    except ValueError as e:
+        print(f"Order rejected: {e}")
         return None
     
-   
-    buyer_order_query = """
-    MATCH (u:User {id: $buyerId}), (o:Order {id: $orderId})
-    CREATE (u)-[:ORDERED]->(o)
-    """
+    if not quantities:
+        print("No valid products for the order")
+        return None
     
-    driver.run_query(buyer_order_query, {'buyerId': buyer_id, 'orderId': order_id})
+    result = driver.write_query(CREATE_ORDER_QUERY, params, operation='create_order')
     
-  
-    for product in order_products:
-        product_order_query = """
-        MATCH (o:Order {id: $orderId}), (p:Product {id: $productId})
-        CREATE (o)-[:CONTAINS {quantity: $quantity}]->(p)
-        """
-        
-        driver.run_query(product_order_query, {
-            'orderId': order_id,
-            'productId': product['id'],
-            'quantity': product['quantity']
-        })
-        
-     
-        update_stock_query = """
-        MATCH (p:Product {id: $productId})
-        SET p.stock = p.stock - $quantity
-        """
+    created_id = create_order_outcome(result, buyer_cpf, order_id, quantities)
+    
+    if created_id:
+        apply_stock_changes(driver, quantities)
+    
+    return created_id
+
+def iter_all_products(driver, fetch_size=None):
+    """
+    Stream all available products
+    
+    Args:
+        driver: Neo4j connection driver
+        fetch_size: Records pulled from the server per batch (connection default if None)
         
-        driver.run_query(update_stock_query, {
-            'productId': product['id'],
-            'quantity': product['quantity']
-        })
+    Yields:
+        dict: One product dictionary at a time
+    """
+    snapshot = current_snapshot(driver)
+    if snapshot is not None:
+        yield from snapshot.in_stock()
+        return
     
-    print(f"Order created successfully with ID: {order_id}")
-    print(f"Total value: R$ {total_value:.2f}")
+    products = (product_from_record(record)
+                for record in driver.stream_query(AVAILABLE_PRODUCTS_QUERY, fetch_size=fetch_size,
+                                                   operation='available_products'))
     
-    return order_id
+    yield from cached_stream(driver, ('available_products',), products)
 
 def get_all_products(driver):
     """
@@ -133,64 +377,66 @@ def get_all_products(driver):
     Returns:
         list: List of product dictionaries
     """
-    query = """
-    MATCH (p:Product)
-    WHERE p.stock > 0
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.stock, p.rating
-    ORDER BY p.name
+    return list(iter_all_products(driver))
+
+def iter_user_orders(driver, buyer_cpf, fetch_size=None, since=None, until=None):
     """
+    Stream all orders for a user, newest first
     
-    result = driver.run_query(query)
-    
-    if not result:
-        return []
-    
-    products = []
-    for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'stock': record[5],
-            'rating': record[6]
-        })
+    Args:
+        driver: Neo4j connection driver
+        buyer_cpf: CPF of the buyer
+        fetch_size: Records pulled from the server per batch (connection default if None)
+        since: Only orders placed at or after this date/datetime
+        until: Only orders placed before this date/datetime
+        
+    Yields:
+        dict: One order dictionary at a time (date is an aware UTC datetime)
+    """
+    params = build_user_orders_params(buyer_cpf, since, until)
     
-    return products
+    for record in driver.stream_query(USER_ORDERS_QUERY, params, fetch_size, operation='user_orders'):
+        yield order_from_record(record)
 
-def get_user_orders(driver, buyer_cpf):
+def get_user_orders(driver, buyer_cpf, since=None, until=None):
     """
     Get all orders for a user
     
     Args:
         driver: Neo4j connection driver
         buyer_cpf: CPF of the buyer
+        since: Only orders placed at or after this date/datetime
+        until: Only orders placed before this date/datetime
         
     Returns:
         list: List of order dictionaries
     """
-    query = """
-    MATCH (u:User {cpf: $cpf})-[:ORDERED]->(o:Order)
-    RETURN o.id, o.value, o.status, o.date
-    ORDER BY o.date DESC
+    return list(iter_user_orders(driver, buyer_cpf, since=since, until=until))
+
+def get_user_orders_page(driver, buyer_cpf, limit=20, cursor=None, since=None, until=None):
     """
+    Get a user's orders one page at a time, newest first
     
-    result = driver.run_query(query, {'cpf': buyer_cpf})
+    Uses keyset pagination on (date, id) over the order_buyer_date index,
+    so a page of a buyer with thousands of orders costs the same as the
+    first page of a new buyer.
     
-    if not result:
-        return []
+    Args:
+        driver: Neo4j connection driver
+        buyer_cpf: CPF of the buyer
+        limit: Page size
+        cursor: Cursor returned with the previous page, or None for the first page
+        since: Only orders placed at or after this date/datetime
+        until: Only orders placed before this date/datetime
+        
+    Returns:
+        tuple: (list of order dictionaries, cursor for the next page or None)
+    """
+    params = build_user_orders_page_params(buyer_cpf, limit, cursor, since, until)
     
-    orders = []
-    for record in result:
-        orders.append({
-            'id': record[0],
-            'value': record[1],
-            'status': record[2],
-            'date': record[3]
-        })
+    result = driver.read_query(USER_ORDERS_PAGE_QUERY, params, operation='user_orders_page')
     
-    return orders
+    return order_page_from_rows([order_from_record(record) for record in result], limit)
 
 def get_order_products(driver, order_id):
     """
@@ -201,26 +447,74 @@ def get_order_products(driver, order_id):
         order_id: ID of the order
         
     Returns:
-        list: List of product dictionaries with quantities
-    """
-    query = """
-    MATCH (o:Order {id: $orderId})-[r:CONTAINS]->(p:Product)
-    RETURN p.id, p.name, p.price, r.quantity
+        list: List of product dictionaries with quantities and line totals
     """
-    
-    result = driver.run_query(query, {'orderId': order_id})
+    result = driver.read_query(ORDER_PRODUCTS_QUERY, {'orderId': order_id}, operation='order_products')
     
     if not result:
         return []
     
-    products = []
+    return [order_line_from_record(record) for record in result]
+
+def get_orders_products(driver, order_ids):
+    """
+    Get the products of several orders in one round trip
+    
+    Args:
+        driver: Neo4j connection driver
+        order_ids: IDs of the orders
+        
+    Returns:
+        dict: Order ID -> list of product dictionaries with quantities and
+            line totals (an empty list for unknown orders)
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    lines = {order_id: [] for order_id in order_ids}
+    
+    if not order_ids:
+        return lines
+    
+    result = driver.read_query(ORDERS_PRODUCTS_QUERY, {'orderIds': order_ids}, operation='orders_products')
+    
     for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'price': record[2],
-            'quantity': record[3],
-            'total': record[2] * record[3]
-        })
-    
-    return products
\ No newline at end of file
+        lines[record[0]].append(order_line_from_record(record[1:]))
+    
+    return lines
+
+def iter_user_orders_with_items(driver, buyer_cpf, fetch_size=None, since=None, until=None):
+    """
+    Stream a user's orders with their line items, newest first
+    
+    Args:
+        driver: Neo4j connection driver
+        buyer_cpf: CPF of the buyer
+        fetch_size: Records pulled from the server per batch (connection default if None)
+        since: Only orders placed at or after this date/datetime
+        until: Only orders placed before this date/datetime
+        
+    Yields:
+        dict: One order dictionary at a time, with its lines under 'products'
+    """
+    params = build_user_orders_params(buyer_cpf, since, until)
+    
+    for record in driver.stream_query(USER_ORDERS_WITH_ITEMS_QUERY, params, fetch_size,
+                                      operation='user_orders_with_items'):
+        yield order_with_lines_from_record(record)
+
+def get_user_orders_with_items(driver, buyer_cpf, since=None, until=None):
+    """
+    Get a user's orders with their line items from a single query
+    
+    Each line has the product id, name, unit price, quantity and the line
+    total computed by the server.
+    
+    Args:
+        driver: Neo4j connection driver
+        buyer_cpf: CPF of the buyer
+        since: Only orders placed at or after this date/datetime
+        until: Only orders placed before this date/datetime
+        
+    Returns:
+        list: Order dictionaries with a 'products' list
+    """
+    return list(iter_user_orders_with_items(driver, buyer_cpf, since=since, until=until))
@@ -0,0 +1,483 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import pytz
+
+from batching import DEFAULT_BATCH_SIZE, iter_batches, load_report, write_batch
+from order_operations import order_time
+from popularity_operations import reconcile_popularity
+from product_cache import invalidate_catalog
+from product_operations import new_product_props
+from recommendation_operations import rebuild_co_purchases
+from schema import order_timezone
+from user_operations import address_props, new_user_props
+
+# Parallel loader for initial migrations: parser processes decode and
+# validate chunks of the input file, rows are partitioned by their key
+# (buyer or seller CPF) so that writer threads do not lock the same nodes,
+# and each writer commits its partition in batches taken from a bounded
+# queue, which stalls parsing whenever the writers fall behind.
+#
+# Orders touch two kinds of shared nodes, their buyer and their products,
+# so they are loaded in two passes over the file: the orders partitioned
+# by buyer (without touching the products), then their CONTAINS lines
+# partitioned by order. Creating a line locks its product as well, and a
+# product is in orders of every partition, so that pass does share nodes
+# between writers: each batch locks its products in id order, which makes
+# writers of a popular product wait for each other instead of deadlocking.
+#
+# The statements MERGE on the key instead of creating, so rows written again
+# after resuming from a checkpoint do not duplicate anything. Rows without
+# an id get one derived from the file name and row number for the same reason.
+
+LOAD_USERS_QUERY = """
+UNWIND $rows AS row
+MERGE (u:User {cpf: row.props.cpf})
+ON CREATE SET u = row.props
+WITH u, row
+// Only a user created by this row has the id generated for it, so a
+// replayed row does not add its addresses twice
+WHERE u.id = row.props.id
+FOREACH (address IN row.addresses |
+    CREATE (u)-[:HAS_ADDRESS]->(a:Address)
+    SET a = address
+)
+"""
+
+LOAD_PRODUCTS_QUERY = """
+UNWIND $rows AS row
+MERGE (p:Product {id: row.props.id})
+ON CREATE SET p = row.props, p.updatedAt = timestamp(), p.favoriteCount = 0, p.unitsSold = 0, p.orderCount = 0
+WITH p, row
+OPTIONAL MATCH (u:User {cpf: row.sellerCpf})
+FOREACH (seller IN CASE WHEN u IS NULL THEN [] ELSE [u] END |
+    SET p.sellerId = seller.id
+    MERGE (seller)-[:SELLS]->(p)
+)
+WITH row, u
+WHERE row.sellerCpf IS NOT NULL AND u IS NULL
+RETURN row.sellerCpf
+"""
+
+# Historical orders: no stock is taken, and orders of unknown buyers or
+# lines of unknown products are skipped. The value only reads the
+# products, so it takes no lock on them.
+LOAD_ORDERS_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User {cpf: row.cpf})
+MERGE (o:Order {id: row.id})
+ON CREATE SET o.status = row.status, o.date = row.date, o.buyerId = u.id
+MERGE (u)-[:ORDERED]->(o)
+WITH o, row
+CALL {
+    WITH row
+    UNWIND row.items AS item
+    OPTIONAL MATCH (p:Product {id: item.productId})
+    RETURN coalesce(sum(p.price * item.quantity), 0.0) AS value
+}
+SET o.value = value
+"""
+
+# Second pass of an orders load: one row per order line, taken in
+# product id order (see above). Returns the lines whose order (not created
+# by the first pass, e.g. of an unknown buyer) or product is missing.
+LOAD_ORDER_LINES_QUERY = """
+UNWIND $rows AS row
+WITH row ORDER BY row.productId
+OPTIONAL MATCH (o:Order {id: row.orderId})
+OPTIONAL MATCH (p:Product {id: row.productId})
+FOREACH (line IN CASE WHEN o IS NULL OR p IS NULL THEN [] ELSE [row] END |
+    MERGE (o)-[c:CONTAINS]->(p)
+    ON CREATE SET c.quantity = line.quantity
+)
+WITH row, o, p
+WHERE o IS NULL OR p IS NULL
+RETURN row.orderId, row.productId, o IS NOT NULL
+"""
+
+TRUE_VALUES = ('1', 'true', 't', 's', 'sim', 'y', 'yes')
+
+LOAD_NAMESPACE = uuid.UUID('519ef4d9-4322-40d0-b5f9-eb9f35e4793e')
+
+DEFAULT_WRITERS = 4
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_QUEUE_BATCHES = 4
+
+
+def decode_csv_row(row):
+    """Drop empty CSV cells and decode the CSV-only encodings (JSON lists, booleans)"""
+    row = {key: value for key, value in row.items() if value != ''}
+    for key in ('addresses', 'items'):
+        if key in row:
+            row[key] = json.loads(row[key])
+    if 'is_seller' in row:
+        row['is_seller'] = row['is_seller'].strip().lower() in TRUE_VALUES
+    return row
+
+
+def iter_raw_records(path):
+    """Yield the undecoded rows of a file: non-empty JSONL lines or CSV dictionaries"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def decode_record(record):
+    if isinstance(record, str):
+        return json.loads(record)
+    return decode_csv_row(record)
+
+
+def row_id(source, kind, row_number):
+    """Stable id for a row that has none, so loading the same file again finds it"""
+    return str(uuid.uuid5(LOAD_NAMESPACE, f"{source}:{kind}:{row_number}"))
+
+
+def _order_date(value, timezone):
+    """
+    An order date as an aware UTC datetime; a naive one is a local time of
+    timezone, as MIGRATE_ORDER_DATES reads the old naive dates
+    """
+    value = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if value.tzinfo is None:
+        value = order_timezone(timezone).localize(value)
+    return order_time(value)
+
+
+def _user_load_params(user, row_number, source):
+    props = new_user_props(user['name'], user['last_name'], user['email'], user['cpf'], user['password'],
+                           bool(user.get('is_seller', False)), user.get('company_name'), user.get('cnpj'))
+    addresses = [address_props(address['street'], address['number'], address['neighborhood'],
+                               address['state'], address['zipCode'])
+                 for address in user.get('addresses') or []]
+    return {'props': props, 'addresses': addresses}
+
+
+def _product_load_params(product, row_number, source):
+    props = new_product_props(product['name'], product['description'], product['brand'],
+                              product['price'], product['stock'], product['rating'])
+    props['id'] = product.get('id') or row_id(source, 'products', row_number)
+    return {'props': props, 'sellerCpf': product.get('seller_cpf') or None}
+
+
+def _order_load_params(order, row_number, source, timezone=None):
+    items = [{'productId': item['product_id'], 'quantity': int(item['quantity'])} for item in order['items']]
+    if not items:
+        raise ValueError("order without items")
+
+    return {
+        'id': order.get('id') or row_id(source, 'orders', row_number),
+        'cpf': order['buyer_cpf'],
+        'status': order.get('status') or 'Pending',
+        'date': _order_date(order['date'], timezone) if order.get('date') else datetime.now(pytz.utc),
+        'items': items
+    }
+
+
+def _order_line_load_params(order, row_number, source, timezone=None):
+    # Validated like the first pass, so both passes fail the same rows
+    params = _order_load_params(order, row_number, source, timezone)
+    return [{'orderId': params['id'], 'productId': item['productId'], 'quantity': item['quantity']}
+            for item in params['items']]
+
+
+# kind -> (statement, prepare(row, row number, source, timezone of naive
+# dates) -> list of parameter rows, partition key(parameter row, row
+# number)). Products are partitioned by seller since SELLS locks the seller
+# node; 'order_lines' is the second pass of an orders load.
+LOADERS = {
+    'users': (LOAD_USERS_QUERY,
+              lambda row, row_number, source, timezone: [_user_load_params(row, row_number, source)],
+              lambda params, row_number: params['props']['cpf']),
+    'products': (LOAD_PRODUCTS_QUERY,
+                 lambda row, row_number, source, timezone: [_product_load_params(row, row_number, source)],
+                 lambda params, row_number: params['sellerCpf'] or row_number),
+    'orders': (LOAD_ORDERS_QUERY,
+               lambda row, row_number, source, timezone: [_order_load_params(row, row_number, source, timezone)],
+               lambda params, row_number: params['cpf']),
+    'order_lines': (LOAD_ORDER_LINES_QUERY, _order_line_load_params, lambda params, row_number: params['orderId']),
+}
+
+
+def _unmatched_order_lines(batch, records):
+    """The (row number, error) of the lines LOAD_ORDER_LINES_QUERY returned as not written"""
+    row_numbers = {(params['orderId'], params['productId']): row_number for _, row_number, params in batch}
+    return [(row_numbers[order_id, product_id],
+             f"product {product_id} not found" if order_found else f"order {order_id} not found")
+            for order_id, product_id, order_found in records]
+
+
+# kind -> (batch, records) -> (row number, error) of the parameter rows
+# written without effect, which count as failed instead
+UNMATCHED = {
+    'order_lines': _unmatched_order_lines,
+}
+
+
+def parse_chunk(kind, source, timezone, writers, first_row_number, records):
+    """
+    Decode, validate and partition one chunk of raw records (runs in a parser process)
+
+    Returns:
+        tuple: (partitions, failed) where partitions[i] holds the (row number,
+            parameters) for writer i and failed the (row number, error) of
+            invalid rows
+    """
+    _, prepare, key = LOADERS[kind]
+    partitions = [[] for _ in range(writers)]
+    failed = []
+
+    for row_number, record in enumerate(records, first_row_number):
+        try:
+            prepared = [(zlib.crc32(str(key(params, row_number)).encode()) % writers, params)
+                        for params in prepare(decode_record(record), row_number, source, timezone)]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            failed.append((row_number, f"invalid row: {e}"))
+            continue
+        for partition, params in prepared:
+            partitions[partition].append((row_number, params))
+
+    return partitions, failed
+
+
+class LoadProgress:
+    """
+    Counts of a parallel load and its checkpoint file
+
+    Chunks finish out of order, so the checkpoint only moves past a chunk
+    ('rows') once it and every chunk before it are fully written or failed.
+    Resuming starts after that row; later chunks that had already been
+    written are written again, which the MERGE statements make harmless.
+    """
+
+    def __init__(self, path, kind, source):
+        self.path = path
+        self.kind = kind
+        self.source = source
+        self.rows = 0
+        self.written = 0
+        self.failed = []
+        self.records = []
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            if (state['kind'], state['source']) != (kind, source):
+                raise ValueError(f"Checkpoint {path} belongs to a {state['kind']} load of {state['source']}")
+            self.rows = state['rows']
+
+    def begin_chunk(self, first_row, last_row, rows_to_write, failed):
+        """Register a parsed chunk (and the parameter rows it has to write) before any is written"""
+        with self._lock:
+            self.failed.extend(failed)
+            self._chunks[first_row] = [last_row, rows_to_write]
+            self._advance()
+
+    def batch_written(self, chunk_rows, written, failed, records):
+        """Record a written batch; chunk_rows counts its rows per chunk"""
+        with self._lock:
+            self.written += written
+            self.failed.extend(failed)
+            self.records.extend(records)
+            for first_row, rows in chunk_rows.items():
+                self._chunks[first_row][1] -= rows
+            self._advance()
+
+    def _advance(self):
+        # Chunks are registered in file order, so the first one is the oldest
+        advanced = False
+        while self._chunks:
+            first_row = next(iter(self._chunks))
+            last_row, left = self._chunks[first_row]
+            if left:
+                break
+            del self._chunks[first_row]
+            self.rows = last_row
+            advanced = True
+
+        if advanced:
+            print(f"{self.rows} rows done: {self.written} {self.kind} written, {len(self.failed)} failed")
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        state = {'kind': self.kind, 'source': self.source, 'rows': self.rows}
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+
+
+def _write_partition(driver, query, operation, batches, progress, unmatched=None):
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+
+        failed = []
+        records = []
+        written = write_batch(driver, query, [(row_number, params) for _, row_number, params in batch],
+                              operation, failed, records)
+        if unmatched is not None:
+            rejected = unmatched(batch, records)
+            written -= len(rejected)
+            failed.extend(rejected)
+            records = []
+        progress.batch_written(Counter(first_row for first_row, _, _ in batch), written, failed, records)
+
+
+def _load_pass(driver, kind, path, source, timezone, writers, parsers, batch_size, chunk_size, queue_batches,
+               checkpoint_path):
+    query, _, _ = LOADERS[kind]
+    operation = f"parallel_load.{kind}"
+
+    progress = LoadProgress(checkpoint_path, kind, source)
+    if progress.rows:
+        print(f"Resuming the {kind} load of {source} after row {progress.rows}")
+    resumed_after = progress.rows
+
+    queues = [queue.Queue(maxsize=queue_batches) for _ in range(writers)]
+    threads = [threading.Thread(target=_write_partition,
+                                args=(driver, query, operation, batches, progress, UNMATCHED.get(kind)),
+                                name=f"loader-writer-{partition}", daemon=True)
+               for partition, batches in enumerate(queues)]
+    for thread in threads:
+        thread.start()
+
+    buffers = [[] for _ in range(writers)]
+
+    def dispatch(first_row, count, parsed):
+        partitions, failed = parsed.result()
+        progress.begin_chunk(first_row, first_row + count - 1, sum(len(rows) for rows in partitions), failed)
+        for partition, rows in enumerate(partitions):
+            buffer = buffers[partition]
+            buffer.extend((first_row, row_number, params) for row_number, params in rows)
+            while len(buffer) >= batch_size:
+                # Blocks while this writer is queue_batches behind
+                queues[partition].put(buffer[:batch_size])
+                del buffer[:batch_size]
+
+    try:
+        with ProcessPoolExecutor(parsers) as pool:
+            parsing = deque()
+            first_row = resumed_after + 1
+            for records in iter_batches(islice(iter_raw_records(path), resumed_after, None), chunk_size):
+                parsing.append((first_row, len(records),
+                                pool.submit(parse_chunk, kind, source, timezone, writers, first_row, records)))
+                first_row += len(records)
+                if len(parsing) >= 2 * parsers:
+                    dispatch(*parsing.popleft())
+            while parsing:
+                dispatch(*parsing.popleft())
+
+        for partition, buffer in enumerate(buffers):
+            if buffer:
+                queues[partition].put(buffer)
+    finally:
+        for batches in queues:
+            batches.put(None)
+        for thread in threads:
+            thread.join()
+
+    return progress, resumed_after
+
+
+def parallel_load(driver, kind, path, writers=DEFAULT_WRITERS, parsers=None, batch_size=DEFAULT_BATCH_SIZE,
+                  chunk_size=DEFAULT_CHUNK_SIZE, queue_batches=DEFAULT_QUEUE_BATCHES, checkpoint_path=None):
+    """
+    Load users, products or orders from a JSONL or CSV file with parallel writers
+
+    Rows use the insert_user / insert_product argument names; orders have
+    buyer_cpf, items (create_order's list of product_id and quantity), and
+    optionally id, status and date. A date without a UTC offset is a local
+    time of the connection's legacy_order_timezone (this host's by default),
+    the same reading the schema migration gives the old naive dates. Orders
+    do not take stock, and the co-purchase weights and popularity counters
+    are rebuilt after them.
+
+    Orders are read twice: the first pass creates the orders partitioned by
+    buyer, the second their lines partitioned by order. Writers of the
+    second pass still share the products, which they lock in id order, so
+    a popular product serializes them but does not deadlock them. The
+    second pass keeps its checkpoint in checkpoint_path + '.lines'.
+
+    Args:
+        driver: Neo4j connection driver
+        kind: 'users', 'products' or 'orders'
+        path: JSONL or CSV file
+        writers: Writer threads (partitions)
+        parsers: Parser processes (CPU count if None)
+        batch_size: Rows per transaction
+        chunk_size: Rows handed to a parser at a time
+        queue_batches: Batches waiting per writer before parsing stalls
+        checkpoint_path: File recording the progress; an existing one
+            makes the load resume after the rows it covers
+
+    Returns:
+        dict: 'written', 'failed' (list of (row number, error)), 'seconds',
+            'rows_per_sec', 'resumed_after' and, for products,
+            'unknown_sellers' or, for orders, 'lines' (order lines written;
+            a line of a missing order or product fails its row)
+    """
+    if kind not in ('users', 'products', 'orders'):
+        raise ValueError(f"Unknown kind: {kind}")
+    source = os.path.basename(path)
+    timezone = driver.config['legacy_order_timezone']
+    parsers = parsers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    progress, resumed_after = _load_pass(driver, kind, path, source, timezone, writers, parsers, batch_size,
+                                         chunk_size, queue_batches, checkpoint_path)
+    failed = progress.failed
+
+    if kind == 'orders':
+        lines, _ = _load_pass(driver, 'order_lines', path, source, timezone, writers, parsers, batch_size,
+                              chunk_size, queue_batches, f"{checkpoint_path}.lines" if checkpoint_path else None)
+        # Rows the first pass rejected fail the same way in the second one,
+        # and a row only needs its first missing line
+        failed = list(failed)
+        failed_rows = {row_number for row_number, _ in failed}
+        for row_number, error in lines.failed:
+            if row_number not in failed_rows:
+                failed_rows.add(row_number)
+                failed.append((row_number, error))
+
+    report = load_report(progress.written, failed, progress.records, start)
+    report['resumed_after'] = resumed_after
+
+    if kind == 'users':
+        # A CPF may have been cached as missing before this load
+        cache = getattr(driver, 'identity_cache', None)
+        if cache is not None and report['written']:
+            cache.clear()
+    elif kind == 'products':
+        report['unknown_sellers'] = sorted({record[0] for record in report['records']})
+        invalidate_catalog(driver)
+    else:
+        report['lines'] = lines.written
+        rebuild_co_purchases(driver, batch_size)
+        reconcile_popularity(driver, batch_size)
+        invalidate_catalog(driver)
+    report.pop('records')
+
+    print(f"{kind.capitalize()} loaded: {report['written']} ({report['rows_per_sec']:.0f} rows/s) "
+          f"with {writers} writers, failed: {len(report['failed'])}")
+    return report
@@ -0,0 +1,192 @@
+import time
+
+from inventory_operations import PRODUCT_STOCK, sharded_total
+from models import search_result_from_record
+from product_cache import cached_list, invalidate_rankings
+
+# Denormalized popularity counters on Product, kept current by the writes
+# that change them: favoriteCount by add_favorite/remove_favorite,
+# unitsSold and orderCount by create_order. Each has a range index alone
+# and one after brand, so a top-k is an index-ordered read of k entries.
+# create_order counts the sales of a sharded product on the shards it took
+# the units from (see inventory_operations), so those few products are
+# always read too and ranked by their total.
+COUNTERS = {
+    'favorites': 'favoriteCount',
+    'units_sold': 'unitsSold',
+    'orders': 'orderCount',
+}
+
+# A property name can't be a parameter, so there is one statement per counter
+TOP_PRODUCTS_QUERIES = {
+    by: f"""
+CALL {{
+    MATCH (p:Product)
+    WHERE p.{counter} IS NOT NULL
+    RETURN p
+    ORDER BY p.{counter} DESC
+    LIMIT $k
+    UNION
+    MATCH (s:StockShard {{shard: 0}})<-[:STOCK_SHARD]-(p:Product)
+    WHERE p.{counter} IS NOT NULL
+    RETURN p
+}}
+WITH p, {sharded_total(counter)} AS score
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, score
+ORDER BY score DESC
+LIMIT $k
+"""
+    for by, counter in COUNTERS.items()
+}
+
+TOP_PRODUCTS_BY_BRAND_QUERIES = {
+    by: f"""
+CALL {{
+    MATCH (p:Product)
+    WHERE p.brand = $brand AND p.{counter} IS NOT NULL
+    RETURN p
+    ORDER BY p.{counter} DESC
+    LIMIT $k
+    UNION
+    MATCH (s:StockShard {{shard: 0}})<-[:STOCK_SHARD]-(p:Product)
+    WHERE p.brand = $brand AND p.{counter} IS NOT NULL
+    RETURN p
+}}
+WITH p, {sharded_total(counter)} AS score
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, score
+ORDER BY score DESC
+LIMIT $k
+"""
+    for by, counter in COUNTERS.items()
+}
+
+# One batch of the reconciliation: recount the next $batchSize products by
+# id from their relationships and rewrite only the counters that drifted.
+# The share a sharded product's shards hold is left where it is; the
+# product's own counter takes the difference.
+RECONCILE_POPULARITY_QUERY = """
+MATCH (p:Product)
+WHERE p.id > $after
+WITH p
+ORDER BY p.id
+LIMIT $batchSize
+CALL {
+    WITH p
+    OPTIONAL MATCH (:User)-[f:FAVORITE]->(p)
+    RETURN count(f) AS favorites
+}
+CALL {
+    WITH p
+    OPTIONAL MATCH (:Order)-[c:CONTAINS]->(p)
+    RETURN count(c) AS orders, coalesce(sum(c.quantity), 0) AS units
+}
+CALL {
+    WITH p
+    OPTIONAL MATCH (p)-[:STOCK_SHARD]->(s:StockShard)
+    RETURN coalesce(sum(s.orderCount), 0) AS shardOrders, coalesce(sum(s.unitsSold), 0) AS shardUnits
+}
+WITH p, favorites, orders - shardOrders AS orders, units - shardUnits AS units,
+     coalesce(p.favoriteCount, -1) <> favorites OR coalesce(p.orderCount, -1) <> orders - shardOrders
+     OR coalesce(p.unitsSold, -1) <> units - shardUnits AS drifted
+FOREACH (_ IN CASE WHEN drifted THEN [1] ELSE [] END |
+    SET p.favoriteCount = favorites, p.orderCount = orders, p.unitsSold = units
+)
+RETURN count(p) AS products, max(p.id) AS lastId, sum(CASE WHEN drifted THEN 1 ELSE 0 END) AS repaired
+"""
+
+DEFAULT_RECONCILE_BATCH_SIZE = 500
+
+
+def _check_counter(by):
+    if by not in COUNTERS:
+        raise ValueError(f"Unknown popularity counter: {by} (use one of {', '.join(COUNTERS)})")
+
+
+def top_products(driver, by='favorites', k=10):
+    """
+    The k most popular products by one counter
+
+    Args:
+        driver: Neo4j connection driver
+        by: 'favorites', 'units_sold' or 'orders'
+        k: Number of products
+
+    Returns:
+        list: Products, most popular first, with the counter value as score
+    """
+    _check_counter(by)
+
+    def load():
+        result = driver.read_query(TOP_PRODUCTS_QUERIES[by], {'k': k}, operation='top_products')
+        return [search_result_from_record(record) for record in result]
+
+    return cached_list(driver, ('top_products', by, k), load)
+
+
+def top_products_by_brand(driver, brand, by='favorites', k=10):
+    """
+    The k most popular products of one brand
+
+    Args:
+        driver: Neo4j connection driver
+        brand: Product brand
+        by: 'favorites', 'units_sold' or 'orders'
+        k: Number of products
+
+    Returns:
+        list: Products, most popular first, with the counter value as score
+    """
+    _check_counter(by)
+
+    def load():
+        result = driver.read_query(TOP_PRODUCTS_BY_BRAND_QUERIES[by], {'brand': brand, 'k': k},
+                                   operation='top_products_by_brand')
+        return [search_result_from_record(record) for record in result]
+
+    return cached_list(driver, ('top_products_by_brand', brand, by, k), load)
+
+
+def reconcile_popularity(driver, batch_size=DEFAULT_RECONCILE_BATCH_SIZE, after=''):
+    """
+    Detect and repair drift between the popularity counters and the graph
+
+    Counters drift when relationships are written outside the operation
+    functions (imports, manual fixes) or for products created before the
+    counters existed. Each batch of products is its own write transaction
+    and only drifted products are written, so it can run alongside normal
+    traffic; a favorite or order committed while its batch runs may still
+    need the next pass.
+
+    Args:
+        driver: Neo4j connection driver
+        batch_size: Products per transaction
+        after: Resume after this product id (the last one a previous run reported)
+
+    Returns:
+        dict: 'products' checked, 'repaired', 'batches', 'last_id' and 'seconds'
+    """
+    start = time.perf_counter()
+    products = 0
+    repaired = 0
+    batches = 0
+
+    while True:
+        result = driver.write_query(RECONCILE_POPULARITY_QUERY, {'after': after, 'batchSize': batch_size},
+                                    operation='reconcile_popularity')
+        count, last_id, drifted = result[0][0], result[0][1], result[0][2]
+        if not count:
+            break
+
+        products += count
+        repaired += drifted
+        batches += 1
+        after = last_id
+
+    if repaired:
+        invalidate_rankings(driver)
+
+    seconds = time.perf_counter() - start
+    print(f"Popularity counters checked for {products} products, {repaired} repaired in {seconds:.1f}s")
+
+    return {'products': products, 'repaired': repaired, 'batches': batches, 'last_id': after,
+            'seconds': seconds}
@@ -0,0 +1,249 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ProductCache:
+    """
+    In-process read-through cache for product listings and searches
+
+    Entries are evicted least-recently-used once there are more than
+    max_entries, and expire ttl seconds after they were loaded, which bounds
+    how stale anything shown from the cache can be when another process
+    changes the catalog. Writes made through this process patch or drop the
+    affected entries right away.
+    """
+
+    def __init__(self, max_entries=256, ttl=30.0, max_entry_rows=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_entry_rows = max_entry_rows
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_product = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up an entry
+
+        Returns:
+            tuple: (True, copy of the cached rows) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # Callers are free to modify what they get back
+            return True, [row.copy() for row in entry[1]]
+
+    def put(self, key, rows):
+        """Store a list of product rows (ignored if longer than max_entry_rows)"""
+        if self.max_entries <= 0 or len(rows) > self.max_entry_rows:
+            return
+
+        rows = [row.copy() for row in rows]
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl, rows)
+            for row in rows:
+                self._keys_by_product.setdefault(row['id'], set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def adjust_stock(self, product_id, delta):
+        """
+        Apply a stock change to every cached copy of a product
+
+        Entries where the product runs out of stock are dropped, since
+        listings of available products must no longer contain it.
+        """
+        with self._lock:
+            for key in list(self._keys_by_product.get(product_id, ())):
+                rows = self._entries[key][1]
+                for row in rows:
+                    if row['id'] == product_id and row.get('stock') is not None:
+                        row['stock'] += delta
+                        if row['stock'] <= 0:
+                            self._remove(key)
+                            break
+
+    def invalidate_product(self, product_id):
+        """Drop every entry containing the product"""
+        with self._lock:
+            for key in list(self._keys_by_product.get(product_id, ())):
+                self._remove(key)
+
+    def invalidate_kinds(self, kinds):
+        """Drop every entry whose key starts with one of these kinds (e.g. 'top_products')"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in kinds]:
+                self._remove(key)
+
+    def clear(self):
+        """Drop every entry (a new product may belong to any listing or search)"""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_product.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+    def _remove(self, key):
+        """Remove an entry and its product index references (lock must be held)"""
+        _, rows = self._entries.pop(key)
+        for row in rows:
+            keys = self._keys_by_product.get(row['id'])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_product[row['id']]
+
+
+def cached_list(driver, key, load):
+    """Return load() through the connection's product cache, if it has one"""
+    cache = getattr(driver, 'product_cache', None)
+
+    if cache is None:
+        return load()
+
+    hit, rows = cache.get(key)
+    if hit:
+        return rows
+
+    rows = load()
+    cache.put(key, rows)
+    return rows
+
+
+def cached_stream(driver, key, rows):
+    """
+    Yield rows through the connection's product cache, if it has one
+
+    On a hit the cached rows are yielded; on a miss the rows are streamed
+    as usual and cached once fully consumed, unless there are more than the
+    cache's max_entry_rows (so streaming huge listings stays memory bounded).
+    """
+    cache = getattr(driver, 'product_cache', None)
+
+    if cache is None:
+        yield from rows
+        return
+
+    hit, cached = cache.get(key)
+    if hit:
+        yield from cached
+        return
+
+    collected = []
+    for row in rows:
+        if collected is not None:
+            collected.append(row.copy())
+            if len(collected) > cache.max_entry_rows:
+                collected = None
+        yield row
+
+    if collected is not None:
+        cache.put(key, collected)
+
+
+async def cached_list_async(driver, key, load):
+    """cached_list for an async connection: load is a coroutine function"""
+    cache = getattr(driver, 'product_cache', None)
+
+    if cache is None:
+        return await load()
+
+    hit, rows = cache.get(key)
+    if hit:
+        return rows
+
+    rows = await load()
+    cache.put(key, rows)
+    return rows
+
+
+async def cached_stream_async(driver, key, rows):
+    """cached_stream for an async connection: rows is an async iterable"""
+    cache = getattr(driver, 'product_cache', None)
+
+    if cache is None:
+        async for row in rows:
+            yield row
+        return
+
+    hit, cached = cache.get(key)
+    if hit:
+        for row in cached:
+            yield row
+        return
+
+    collected = []
+    async for row in rows:
+        if collected is not None:
+            collected.append(row.copy())
+            if len(collected) > cache.max_entry_rows:
+                collected = None
+        yield row
+
+    if collected is not None:
+        cache.put(key, collected)
+
+
+def invalidate_catalog(driver):
+    """Forget every cached listing after products were added"""
+    cache = getattr(driver, 'product_cache', None)
+    if cache is not None:
+        cache.clear()
+
+    snapshot = getattr(driver, 'catalog_snapshot', None)
+    if snapshot is not None:
+        snapshot.expire()
+
+
+# Cached rankings by the popularity counters (popularity_operations). Any
+# product's counter moving can reorder them, so they are dropped whole.
+RANKING_KINDS = ('top_products', 'top_products_by_brand')
+
+
+def invalidate_rankings(driver):
+    """Forget the cached popularity rankings after favorites or sales changed"""
+    cache = getattr(driver, 'product_cache', None)
+    if cache is not None:
+        cache.invalidate_kinds(RANKING_KINDS)
+
+
+def apply_stock_changes(driver, quantities):
+    """Patch cached stock and drop the rankings after an order took quantities ({product id: units})"""
+    cache = getattr(driver, 'product_cache', None)
+    if cache is not None:
+        for product_id, quantity in quantities.items():
+            cache.adjust_stock(product_id, -quantity)
+        cache.invalidate_kinds(RANKING_KINDS)
+
+    snapshot = getattr(driver, 'catalog_snapshot', None)
+    if snapshot is not None:
+        for product_id, quantity in quantities.items():
+            snapshot.adjust_stock(product_id, -quantity)
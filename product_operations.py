@@ -1,14 +1,84 @@
 
+import base64
+import binascii
+import json
 import uuid
 
-def insert_product(driver, name, description, brand, price, stock, rating, seller_cpf=None):
-    """Insert a product into Neo4j"""
- 
-    product_id = str(uuid.uuid4())
-    
-   
-    product_props = {
-        'id': product_id,
+from batching import DEFAULT_BATCH_SIZE, run_batches
+from catalog_snapshot import current_snapshot
+from inventory_operations import PRODUCT_STOCK
+from models import product_from_record
+from product_cache import cached_list, cached_stream, invalidate_catalog
+from product_search import search_products
+
+# Cypher statements are module constants so the async counterparts in
+# async_product_operations.py run exactly the same queries
+
+# The seller is matched by CPF in the same statement; $sellerCpf is null
+# when the product has no seller
+INSERT_PRODUCT_QUERY = """
+CREATE (p:Product $props)
+SET p.updatedAt = timestamp(), p.favoriteCount = 0, p.unitsSold = 0, p.orderCount = 0
+WITH p
+OPTIONAL MATCH (u:User {cpf: $sellerCpf})
+FOREACH (seller IN CASE WHEN u IS NULL THEN [] ELSE [u] END |
+    SET p.sellerId = seller.id
+    CREATE (seller)-[:SELLS]->(p)
+)
+RETURN p.id, u.id
+"""
+
+INSERT_PRODUCTS_BULK_QUERY = """
+UNWIND $rows AS row
+CREATE (p:Product)
+SET p = row.props, p.updatedAt = timestamp(), p.favoriteCount = 0, p.unitsSold = 0, p.orderCount = 0
+WITH p, row
+OPTIONAL MATCH (u:User {cpf: row.sellerCpf})
+FOREACH (seller IN CASE WHEN u IS NULL THEN [] ELSE [u] END |
+    SET p.sellerId = seller.id
+    CREATE (seller)-[:SELLS]->(p)
+)
+WITH row, u
+WHERE row.sellerCpf IS NOT NULL AND u IS NULL
+RETURN row.sellerCpf
+"""
+
+PRODUCTS_BY_PRICE_RANGE_QUERY = f"""
+MATCH (p:Product)
+WHERE p.price >= $minPrice AND p.price <= $maxPrice
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating
+ORDER BY p.price
+"""
+
+# brand and minRating are null when not filtering; the seek still goes
+# through the product_price_id index and they are checked on each row
+PRICE_PAGE_QUERY = f"""
+MATCH (p:Product)
+WHERE p.price >= $fromPrice AND p.price <= $maxPrice
+  AND (p.price > $fromPrice OR p.id > $afterId)
+  AND ($brand IS NULL OR p.brand = $brand)
+  AND ($minRating IS NULL OR p.rating >= $minRating)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating
+ORDER BY p.price, p.id
+LIMIT $limit
+"""
+
+PRODUCTS_BY_SELLER_QUERY = f"""
+MATCH (u:User {{id: $sellerId}})-[:SELLS]->(p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating
+ORDER BY p.name
+"""
+
+PRODUCTS_BY_SELLER_CPF_QUERY = f"""
+MATCH (u:User {{cpf: $sellerCpf}})-[:SELLS]->(p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating
+ORDER BY p.name
+"""
+
+def new_product_props(name, description, brand, price, stock, rating):
+    """Build the properties of a new Product node"""
+    return {
+        'id': str(uuid.uuid4()),
         'name': name,
         'description': description,
         'brand': brand,
@@ -16,192 +86,220 @@ def insert_product(driver, name, description, brand, price, stock, rating, selle
         'stock': int(stock),
         'rating': float(rating)
     }
-    
-   
-    query = """
-    CREATE (p:Product $props)
-    RETURN p.id
-    """
-    
-    result = driver.run_query(query, {'props': product_props})
-    
+
+def report_seller_link(seller_cpf, seller_id):
+    """Print whether the new product was linked to its seller"""
+    if not seller_cpf:
+        return
+
+    if seller_id:
+        print(f"Product linked to seller with CPF {seller_cpf}")
+    else:
+        print(f"Warning: Seller with CPF {seller_cpf} not found. Product created without seller.")
+
+def insert_product(driver, name, description, brand, price, stock, rating, seller_cpf=None):
+    """Insert a product into Neo4j"""
+
+    product_props = new_product_props(name, description, brand, price, stock, rating)
+    product_id = product_props['id']
+
+    result = driver.write_query(INSERT_PRODUCT_QUERY, {'props': product_props, 'sellerCpf': seller_cpf or None},
+                                operation='insert_product')
+
     if not result:
         return None
-    
-   
-    if seller_cpf:
-        
-        find_seller_query = """
-        MATCH (u:User {cpf: $cpf})
-        RETURN u.id
-        """
-        
-        seller_result = driver.run_query(find_seller_query, {'cpf': seller_cpf})
-        
-        if seller_result and seller_result[0]:
-            seller_id = seller_result[0][0]
-            
-           
-            update_product_query = """
-            MATCH (p:Product {id: $productId})
-            SET p.sellerId = $sellerId
-            """
-            
-            driver.run_query(update_product_query, {'productId': product_id, 'sellerId': seller_id})
-            
-           
-            seller_query = """
-            MATCH (u:User {id: $sellerId}), (p:Product {id: $productId})
-            CREATE (u)-[:SELLS]->(p)
-            """
-            
-            driver.run_query(seller_query, {'sellerId': seller_id, 'productId': product_id})
-            print(f"Product linked to seller with CPF {seller_cpf}")
-        else:
-            print(f"Warning: Seller with CPF {seller_cpf} not found. Product created without seller.")
-    
+
+    report_seller_link(seller_cpf, result[0][1])
+
+    invalidate_catalog(driver)
+
     print(f"Product created with ID: {product_id}")
     return product_id
 
-def search_products_by_name(driver, name):
-    """Search products by name"""
-    query = """
-    MATCH (p:Product)
-    WHERE toLower(p.name) CONTAINS toLower($name)
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.stock, p.rating
-    ORDER BY p.name
+def _product_bulk_params(product):
+    """Convert an insert_product-style dictionary into bulk query parameters"""
+    product_props = new_product_props(product['name'], product['description'], product['brand'],
+                                      product['price'], product['stock'], product['rating'])
+
+    return {'props': product_props, 'sellerCpf': product.get('seller_cpf') or None}
+
+def insert_products_bulk(driver, products, batch_size=DEFAULT_BATCH_SIZE):
     """
-    
-    result = driver.run_query(query, {'name': name})
-    
-    if not result:
-        return []
-    
-    products = []
-    for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'stock': record[5],
-            'rating': record[6]
-        })
-    
-    return products
-
-def search_products_by_brand(driver, brand):
-    """Search products by brand"""
-    query = """
-    MATCH (p:Product)
-    WHERE toLower(p.brand) CONTAINS toLower($brand)
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.stock, p.rating
-    ORDER BY p.name
+    Insert many products with batched UNWIND writes
+
+    Sellers are resolved by CPF in the same statement that creates the
+    products, so a batch costs one round trip regardless of its size.
+
+    Args:
+        driver: Neo4j connection driver
+        products: Iterable of dictionaries with the insert_product arguments
+                  (name, description, brand, price, stock, rating, seller_cpf);
+                  it is consumed lazily
+        batch_size: Number of products written per transaction
+
+    Returns:
+        dict: Load report with 'written', 'failed', 'seconds', 'rows_per_sec'
+              and 'unknown_sellers' (CPFs that matched no user)
     """
-    
-    result = driver.run_query(query, {'brand': brand})
-    
-    if not result:
-        return []
-    
-    products = []
-    for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'stock': record[5],
-            'rating': record[6]
-        })
-    
-    return products
+    report = run_batches(driver, INSERT_PRODUCTS_BULK_QUERY, products, _product_bulk_params,
+                         batch_size, label='products', operation='insert_products_bulk')
+    report['unknown_sellers'] = sorted({record[0] for record in report.pop('records')})
+
+    if report['written']:
+        invalidate_catalog(driver)
+
+    for seller_cpf in report['unknown_sellers']:
+        print(f"Warning: Seller with CPF {seller_cpf} not found. Products created without seller.")
+
+    print(f"Products loaded: {report['written']} ({report['rows_per_sec']:.0f} rows/s), failed: {len(report['failed'])}")
+    return report
+
+def search_products_by_name(driver, name, limit=20, offset=0, infix=False):
+    """Search products by name, best match first (the first products by name for an empty one)"""
+    return search_products(driver, name=name, limit=limit, offset=offset, infix=infix)
+
+def search_products_by_brand(driver, brand, limit=20, offset=0, infix=False):
+    """Search products by brand, best match first (the first products by name for an empty one)"""
+    return search_products(driver, brand=brand, limit=limit, offset=offset, infix=infix)
+
+def iter_products_by_price_range(driver, min_price, max_price, fetch_size=None):
+    """Stream products in a price range, cheapest first"""
+    snapshot = current_snapshot(driver)
+    if snapshot is not None:
+        yield from snapshot.price_range(min_price, max_price)
+        return
+
+    params = {
+        'minPrice': float(min_price),
+        'maxPrice': float(max_price)
+    }
+
+    products = (product_from_record(record)
+                for record in driver.stream_query(PRODUCTS_BY_PRICE_RANGE_QUERY, params, fetch_size,
+                                                   operation='products_by_price_range'))
+
+    yield from cached_stream(driver, ('price_range', params['minPrice'], params['maxPrice']), products)
 
 def search_products_by_price_range(driver, min_price, max_price):
     """Search products by price range"""
-    query = """
-    MATCH (p:Product)
-    WHERE p.price >= $minPrice AND p.price <= $maxPrice
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.stock, p.rating
-    ORDER BY p.price
+    return list(iter_products_by_price_range(driver, min_price, max_price))
+
+def price_page_filters(min_price, max_price, brand=None, min_rating=None):
+    """The filters of a price page search, as carried in its cursors"""
+    return [float(min_price), float(max_price), brand or None,
+            float(min_rating) if min_rating is not None else None]
+
+def encode_price_cursor(price, product_id, filters=None):
+    """Encode the (price, id) of the last product of a page and the search's filters as an opaque cursor"""
+    raw = json.dumps([price, product_id, filters]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_price_cursor(cursor):
+    """
+    Decode a cursor created by encode_price_cursor into (price, id, filters)
+
+    Raises:
+        ValueError: If the cursor was not created by encode_price_cursor
     """
-    
+    try:
+        price, product_id, filters = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        price = float(price)
+    except (binascii.Error, UnicodeError, ValueError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid price page cursor: {cursor!r}") from e
+
+    if not isinstance(product_id, str) or not (filters is None or isinstance(filters, list)):
+        raise ValueError(f"Invalid price page cursor: {cursor!r}")
+
+    return price, product_id, filters
+
+def build_price_page_query(min_price, max_price, limit, cursor=None, brand=None, min_rating=None):
+    """
+    Build the keyset page query and its parameters (fetches one extra row to detect a next page)
+
+    Raises:
+        ValueError: If the cursor is invalid or was returned by a search
+            with other filters
+    """
+    if cursor:
+        from_price, after_id, filters = decode_price_cursor(cursor)
+        if filters != price_page_filters(min_price, max_price, brand, min_rating):
+            raise ValueError("The cursor belongs to a search with other filters")
+    else:
+        # No product has an empty id, so the first page keeps every price == min_price
+        from_price, after_id = float(min_price), ''
+
     params = {
-        'minPrice': float(min_price),
-        'maxPrice': float(max_price)
+        'fromPrice': from_price,
+        'afterId': after_id,
+        'maxPrice': float(max_price),
+        'brand': brand or None,
+        'minRating': float(min_rating) if min_rating is not None else None,
+        'limit': int(limit) + 1
     }
-    
-    result = driver.run_query(query, params)
-    
-    if not result:
-        return []
-    
-    products = []
-    for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'stock': record[5],
-            'rating': record[6]
-        })
-    
-    return products
+
+    return PRICE_PAGE_QUERY, params
+
+def price_page_from_rows(rows, limit, filters=None):
+    """Turn the product rows of a page query into (products, next cursor carrying price_page_filters)"""
+    if not rows:
+        return [], None
+
+    products = rows[:limit]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = products[-1]
+        next_cursor = encode_price_cursor(last['price'], last['id'], filters)
+
+    return products, next_cursor
+
+def search_products_by_price_range_page(driver, min_price, max_price, limit=20, cursor=None,
+                                        brand=None, min_rating=None):
+    """
+    Search products by price range one page at a time
+
+    Uses keyset pagination on (price, id): every page seeks directly into the
+    product_price_id index after the last row of the previous page, so page
+    100 costs the same as page 1.
+
+    Args:
+        driver: Neo4j connection driver
+        min_price: Minimum price (inclusive)
+        max_price: Maximum price (inclusive)
+        limit: Page size
+        cursor: Cursor returned with the previous page of the same search,
+            or None for the first page
+        brand: Only return products of this brand
+        min_rating: Only return products rated at least this
+
+    Raises:
+        ValueError: If the cursor is invalid or belongs to another search
+
+    Returns:
+        tuple: (list of product dictionaries, cursor for the next page or None)
+    """
+    query, params = build_price_page_query(min_price, max_price, limit, cursor, brand, min_rating)
+
+    key = ('price_page', float(min_price), float(max_price), limit, cursor, brand, min_rating)
+    rows = cached_list(driver, key,
+                       lambda: [product_from_record(record) for record in driver.read_query(query, params,
+                                                                                 operation='products_by_price_page')])
+
+    return price_page_from_rows(rows, limit, price_page_filters(min_price, max_price, brand, min_rating))
 
 def search_products_by_seller(driver, seller_id):
     """Search products by seller ID"""
-    query = """
-    MATCH (u:User {id: $sellerId})-[:SELLS]->(p:Product)
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.stock, p.rating
-    ORDER BY p.name
-    """
-    
-    result = driver.run_query(query, {'sellerId': seller_id})
-    
-    if not result:
-        return []
-    
-    products = []
-    for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'stock': record[5],
-            'rating': record[6]
-        })
-    
-    return products
+    def load():
+        result = driver.read_query(PRODUCTS_BY_SELLER_QUERY, {'sellerId': seller_id}, operation='products_by_seller')
+        return [product_from_record(record) for record in result]
+
+    return cached_list(driver, ('seller', seller_id), load)
 
 def search_products_by_seller_cpf(driver, seller_cpf):
     """Search products by seller CPF"""
-    query = """
-    MATCH (u:User {cpf: $sellerCpf})-[:SELLS]->(p:Product)
-    RETURN p.id, p.name, p.description, p.brand, p.price, p.stock, p.rating
-    ORDER BY p.name
-    """
-    
-    result = driver.run_query(query, {'sellerCpf': seller_cpf})
-    
-    if not result:
-        return []
-    
-    products = []
-    for record in result:
-        products.append({
-            'id': record[0],
-            'name': record[1],
-            'description': record[2],
-            'brand': record[3],
-            'price': record[4],
-            'stock': record[5],
-            'rating': record[6]
-        })
-    
-    return products
\ No newline at end of file
+    def load():
+        result = driver.read_query(PRODUCTS_BY_SELLER_CPF_QUERY, {'sellerCpf': seller_cpf},
+                                   operation='products_by_seller_cpf')
+        return [product_from_record(record) for record in result]
+
+    return cached_list(driver, ('seller_cpf', seller_cpf), load)
@@ -0,0 +1,161 @@
+import re
+import unicodedata
+
+from inventory_operations import PRODUCT_STOCK
+from models import search_result_from_record
+from product_cache import cached_list
+
+FULLTEXT_INDEX = 'product_search'
+
+SEARCH_FIELDS = ('name', 'description', 'brand')
+
+# skip/limit are applied inside the index, so only one page of hits
+# ever leaves Lucene regardless of how large the catalog is
+SEARCH_QUERY = f"""
+CALL db.index.fulltext.queryNodes($index, $search, {{skip: $skip, limit: $limit}})
+YIELD node AS p, score
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, score
+"""
+
+# Same search without a limit: every hit after $skip
+SEARCH_ALL_QUERY = f"""
+CALL db.index.fulltext.queryNodes($index, $search, {{skip: $skip}})
+YIELD node AS p, score
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, score
+"""
+
+# A search with nothing to search for lists every product by name, like
+# the CONTAINS '' scan it replaced (no score)
+LIST_PRODUCTS_QUERY = f"""
+MATCH (p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, null
+ORDER BY p.name, p.id
+SKIP $skip
+LIMIT $limit
+"""
+
+LIST_ALL_PRODUCTS_QUERY = f"""
+MATCH (p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, null
+ORDER BY p.name, p.id
+SKIP $skip
+"""
+
+# Characters with a meaning in the Lucene query syntax
+_LUCENE_SPECIAL = re.compile(r'([+\-!(){}\[\]^"~*?:\\/]|&&|\|\|)')
+
+
+def fold_text(text):
+    """Lowercase and strip accents, so 'Café' and 'cafe' match the same terms"""
+    normalized = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in normalized if not unicodedata.combining(c)).lower()
+
+
+# Shortest word matched anywhere inside a term when infix matching is on;
+# shorter ones would match most of the term dictionary
+MIN_INFIX_LENGTH = 3
+
+
+def build_term_query(text, infix=False):
+    """
+    Turn free user text into a Lucene query where every word must match a
+    term exactly or as a prefix, and with infix also anywhere inside it
+    ('phone' finds 'iPhone', like the old CONTAINS scan)
+
+    The alternatives add up, so exact matches rank above prefix matches and
+    those above infix ones. An infix match is a leading wildcard, which
+    makes Lucene scan the field's whole term dictionary, so it is opt-in
+    and only used for words of at least MIN_INFIX_LENGTH characters.
+    """
+    terms = []
+    for word in fold_text(text).split():
+        escaped = _LUCENE_SPECIAL.sub(r'\\\1', word)
+        if not escaped:
+            continue
+        if infix and len(word) >= MIN_INFIX_LENGTH:
+            terms.append(f"({escaped} OR {escaped}* OR *{escaped}*)")
+        else:
+            terms.append(f"({escaped} OR {escaped}*)")
+
+    return ' AND '.join(terms)
+
+
+def build_search_query(text=None, name=None, description=None, brand=None, infix=False):
+    """Build a Lucene query combining free text (all fields) with per-field filters"""
+    clauses = []
+
+    if text:
+        term_query = build_term_query(text, infix)
+        if term_query:
+            # Matches on the name are worth more than matches on the description
+            clauses.append(f"(name:({term_query})^3 OR brand:({term_query})^2 OR description:({term_query}))")
+
+    for field, value in (('name', name), ('description', description), ('brand', brand)):
+        if value:
+            term_query = build_term_query(value, infix)
+            if term_query:
+                clauses.append(f"{field}:({term_query})")
+
+    return ' AND '.join(clauses)
+
+
+def build_search_params(text=None, name=None, description=None, brand=None, limit=20, offset=0, infix=False):
+    """Build the SEARCH_QUERY parameters, or None when there is nothing to search for"""
+    search_query = build_search_query(text, name, description, brand, infix)
+
+    if not search_query:
+        return None
+
+    return {
+        'index': FULLTEXT_INDEX,
+        'search': search_query,
+        'skip': int(offset),
+        'limit': None if limit is None else int(limit)
+    }
+
+
+def search_statement(text=None, name=None, description=None, brand=None, limit=20, offset=0, infix=False):
+    """
+    Pick the statement of a search_products call
+
+    Returns:
+        tuple: (statement, parameters); without a limit every match is
+            returned, and without anything to search for every product
+    """
+    params = build_search_params(text, name, description, brand, limit, offset, infix)
+
+    if params is None:
+        params = {'skip': int(offset), 'limit': None if limit is None else int(limit)}
+        return (LIST_ALL_PRODUCTS_QUERY if limit is None else LIST_PRODUCTS_QUERY), params
+
+    return (SEARCH_ALL_QUERY if limit is None else SEARCH_QUERY), params
+
+
+def search_products(driver, text=None, name=None, description=None, brand=None, limit=20, offset=0,
+                    infix=False):
+    """
+    Relevance-ranked product search backed by the full-text index
+
+    Args:
+        driver: Neo4j connection driver
+        text: Free text matched against name, description and brand
+        name: Text that must match the product name
+        description: Text that must match the product description
+        brand: Text that must match the product brand
+        limit: Maximum number of products to return (None for all of them)
+        offset: Number of ranked products to skip (for paging)
+        infix: Also match words of MIN_INFIX_LENGTH or more characters inside
+            terms (a leading wildcard that scans the term dictionary, so
+            keep it for interactive searches)
+
+    Returns:
+        list: List of product dictionaries, best match first, with a 'score';
+            with no text or filter, every product by name (score None)
+    """
+    query, params = search_statement(text, name, description, brand, limit, offset, infix)
+
+    def load():
+        result = driver.read_query(query, params, operation='search_products')
+        return [search_result_from_record(record) for record in result]
+
+    return cached_list(driver, ('search', params.get('search'), params['skip'], params['limit']), load)
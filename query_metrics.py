@@ -0,0 +1,190 @@
+import json
+import threading
+from bisect import bisect_left
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is +Inf)
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# ResultSummary counters that are summed per operation
+COUNTERS = ('nodes_created', 'nodes_deleted', 'relationships_created', 'relationships_deleted',
+            'properties_set', 'labels_added')
+
+TIMINGS = ('client_ms', 'available_after_ms', 'consumed_after_ms')
+
+UNNAMED_OPERATION = 'unnamed'
+
+
+def result_summary(result):
+    """Summary of a fully consumed result, or None for backends without one"""
+    consume = getattr(result, 'consume', None)
+    return consume() if consume is not None else None
+
+
+def server_time_ms(summary):
+    """Time the server took to start and finish streaming a result, or None if the summary doesn't say"""
+    available = getattr(summary, 'result_available_after', None)
+    consumed = getattr(summary, 'result_consumed_after', None)
+    if available is None or consumed is None:
+        return None
+    return float(available + consumed)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus style)"""
+
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS_MS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q (None if empty or past the last bound)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs, ending with ('+Inf', count)"""
+        pairs = []
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            pairs.append((bound, seen))
+        pairs.append(('+Inf', self.count))
+        return pairs
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {str(bound): count for bound, count in self.cumulative()}
+        }
+
+
+class OperationStats:
+    __slots__ = ('calls', 'errors', 'records', 'counters', 'timings')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.records = 0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.timings = {name: Histogram() for name in TIMINGS}
+
+
+class QueryMetrics:
+    """
+    Per-operation query statistics
+
+    Every statement sent through the connection is recorded under the
+    logical operation name it was tagged with: client wall time, the
+    server's result_available_after/result_consumed_after, records returned
+    and the write counters of the result summary. Recording is a few
+    dictionary updates under a lock, cheap enough to leave on.
+    """
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, client_ms, records=0, summary=None, failed=False):
+        """Add one statement execution (summary is the neo4j ResultSummary, if any)"""
+        operation = operation or UNNAMED_OPERATION
+
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = OperationStats()
+
+            stats.calls += 1
+            stats.records += records
+            stats.timings['client_ms'].observe(client_ms)
+
+            if failed:
+                stats.errors += 1
+
+            if summary is not None:
+                if summary.result_available_after is not None:
+                    stats.timings['available_after_ms'].observe(summary.result_available_after)
+                if summary.result_consumed_after is not None:
+                    stats.timings['consumed_after_ms'].observe(summary.result_consumed_after)
+                counters = summary.counters
+                for name in COUNTERS:
+                    stats.counters[name] += getattr(counters, name, 0)
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def snapshot(self):
+        """Every operation's statistics as plain dictionaries"""
+        with self._lock:
+            return {
+                operation: {
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'records': stats.records,
+                    'counters': dict(stats.counters),
+                    **{name: histogram.to_dict() for name, histogram in stats.timings.items()}
+                }
+                for operation, stats in sorted(self._operations.items())
+            }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix='neo4j_query'):
+        """Prometheus text exposition format (latencies in seconds)"""
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, help_text in (('calls', 'Statements executed'),
+                                ('errors', 'Statements that raised an error'),
+                                ('records', 'Records returned')):
+            lines.append(f"# HELP {prefix}_{name}_total {help_text}")
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for operation, stats in snapshot.items():
+                lines.append(f'{prefix}_{name}_total{{operation="{operation}"}} {stats[name]}')
+
+        for counter in COUNTERS:
+            lines.append(f"# HELP {prefix}_{counter}_total Summed {counter} counter of the result summaries")
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            for operation, stats in snapshot.items():
+                lines.append(f'{prefix}_{counter}_total{{operation="{operation}"}} {stats["counters"][counter]}')
+
+        for timing in TIMINGS:
+            metric = f"{prefix}_{timing[:-3]}_seconds"
+            lines.append(f"# HELP {metric} {timing[:-3].replace('_', ' ')} time")
+            lines.append(f"# TYPE {metric} histogram")
+            for operation, stats in snapshot.items():
+                histogram = stats[timing]
+                for bound, count in histogram['buckets'].items():
+                    le = bound if bound == '+Inf' else repr(int(bound) / 1000)
+                    lines.append(f'{metric}_bucket{{operation="{operation}",le="{le}"}} {count}')
+                lines.append(f'{metric}_sum{{operation="{operation}"}} {histogram["sum"] / 1000}')
+                lines.append(f'{metric}_count{{operation="{operation}"}} {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Write the metrics to path: Prometheus text for a .prom file, JSON otherwise"""
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
@@ -0,0 +1,104 @@
+import time
+
+from inventory_operations import PRODUCT_STOCK
+from models import search_result_from_record
+from product_cache import cached_list
+
+# Co-purchases are kept as (:Product)-[:BOUGHT_WITH {weight}]->(:Product)
+# edges, one per direction, where weight is the number of orders that
+# contain both products. create_order (CREATE_ORDER_QUERY) maintains them
+# incrementally; rebuild_co_purchases recomputes them from the order history.
+
+RECOMMEND_FOR_PRODUCT_QUERY = f"""
+MATCH (:Product {{id: $productId}})-[r:BOUGHT_WITH]->(p:Product)
+RETURN p.id, p.name, p.description, p.brand, p.price, {PRODUCT_STOCK}, p.rating, r.weight
+ORDER BY r.weight DESC, p.id
+LIMIT $k
+"""
+
+# One batch of the rebuild: the outgoing edges of the next $batchSize
+# products by id. Every edge belongs to exactly one batch, so batches never
+# write the same relationship and an interrupted rebuild resumes from lastId.
+REBUILD_CO_PURCHASES_QUERY = """
+MATCH (a:Product)
+WHERE a.id > $after
+WITH a
+ORDER BY a.id
+LIMIT $batchSize
+CALL {
+    WITH a
+    MATCH (a)<-[:CONTAINS]-(:Order)-[:CONTAINS]->(b:Product)
+    WHERE b <> a
+    WITH a, b, count(*) AS weight
+    MERGE (a)-[r:BOUGHT_WITH]->(b)
+    SET r.weight = weight
+}
+RETURN count(a) AS products, max(a.id) AS lastId
+"""
+
+DEFAULT_REBUILD_BATCH_SIZE = 500
+
+
+def recommend_for_product(driver, product_id, k=5):
+    """
+    "Customers who bought this also bought" for one product
+
+    Reads the precomputed BOUGHT_WITH weights, so the cost is one index seek
+    and the product's own co-purchase edges, not a traversal of its orders.
+
+    Args:
+        driver: Neo4j connection driver
+        product_id: ID of the product
+        k: Maximum number of recommendations
+
+    Returns:
+        list: Products, most often bought together first, with the number
+            of shared orders as score
+    """
+    def load():
+        result = driver.read_query(RECOMMEND_FOR_PRODUCT_QUERY, {'productId': product_id, 'k': k},
+                                   operation='recommend_for_product')
+        return [search_result_from_record(record) for record in result]
+
+    return cached_list(driver, ('recommend_for_product', product_id, k), load)
+
+
+def rebuild_co_purchases(driver, batch_size=DEFAULT_REBUILD_BATCH_SIZE, after=''):
+    """
+    Recompute every BOUGHT_WITH weight from the existing orders
+
+    Needed once for orders placed before the weights were maintained (or
+    loaded without create_order); afterwards create_order keeps them
+    current. Each batch of products is its own write transaction, and
+    re-running is safe since weights are set, not incremented. Orders
+    created while a batch runs may be counted by both, so run it when
+    ordering is quiet.
+
+    Args:
+        driver: Neo4j connection driver
+        batch_size: Products per transaction
+        after: Resume after this product id (the last one a previous run reported)
+
+    Returns:
+        dict: 'products' processed, 'batches', 'last_id' and 'seconds'
+    """
+    start = time.perf_counter()
+    products = 0
+    batches = 0
+
+    while True:
+        result = driver.write_query(REBUILD_CO_PURCHASES_QUERY, {'after': after, 'batchSize': batch_size},
+                                    operation='rebuild_co_purchases')
+        count, last_id = result[0][0], result[0][1]
+        if not count:
+            break
+
+        products += count
+        batches += 1
+        after = last_id
+        print(f"Co-purchases rebuilt for {products} products (last id {last_id})")
+
+    seconds = time.perf_counter() - start
+    print(f"Co-purchase rebuild finished: {products} products in {seconds:.1f}s")
+
+    return {'products': products, 'batches': batches, 'last_id': after, 'seconds': seconds}
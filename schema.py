@@ -0,0 +1,214 @@
+from datetime import datetime
+
+import pytz
+
+SCHEMA_VERSION = 8
+
+# Orders used to store date as a naive ISO string of datetime.now(), the
+# application host's local time, so each one is read as a local time of
+# $tz (an IANA name or a UTC offset such as '-03:00') rather than as UTC.
+# Strings only, so re-running is a no-op
+MIGRATE_ORDER_DATES = """
+MATCH (o:Order)
+WHERE o.date IS :: STRING NOT NULL
+CALL {
+    WITH o
+    SET o.date = datetime({datetime: localdatetime(o.date), timezone: $tz})
+} IN TRANSACTIONS OF 10000 ROWS
+"""
+
+# Each entry is (version, statement). Statements must be idempotent so that
+# re-running a version that was only partially applied is always safe.
+SCHEMA_STATEMENTS = [
+    (1, "CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE"),
+    (1, "CREATE CONSTRAINT user_cpf_unique IF NOT EXISTS FOR (u:User) REQUIRE u.cpf IS UNIQUE"),
+    (1, "CREATE CONSTRAINT product_id_unique IF NOT EXISTS FOR (p:Product) REQUIRE p.id IS UNIQUE"),
+    (1, "CREATE CONSTRAINT order_id_unique IF NOT EXISTS FOR (o:Order) REQUIRE o.id IS UNIQUE"),
+    (1, "CREATE RANGE INDEX product_price IF NOT EXISTS FOR (p:Product) ON (p.price)"),
+    (1, "CREATE RANGE INDEX product_stock IF NOT EXISTS FOR (p:Product) ON (p.stock)"),
+    (1, "CREATE RANGE INDEX order_date IF NOT EXISTS FOR (o:Order) ON (o.date)"),
+    # standard-folding lowercases and strips accents (ASCII folding) at index
+    # and query time, so Portuguese product names match with or without accents
+    (2, """
+    CREATE FULLTEXT INDEX product_search IF NOT EXISTS
+    FOR (p:Product) ON EACH [p.name, p.description, p.brand]
+    OPTIONS {indexConfig: {`fulltext.analyzer`: 'standard-folding'}}
+    """),
+    # Composite index backing keyset pagination ordered by (price, id)
+    (3, "CREATE RANGE INDEX product_price_id IF NOT EXISTS FOR (p:Product) ON (p.price, p.id)"),
+    # Backs the incremental refresh of catalog_snapshot.CatalogSnapshot
+    (4, "CREATE RANGE INDEX product_updated_at IF NOT EXISTS FOR (p:Product) ON (p.updatedAt)"),
+    # Popularity counters served by popularity_operations, overall and per brand
+    (5, "CREATE RANGE INDEX product_favorite_count IF NOT EXISTS FOR (p:Product) ON (p.favoriteCount)"),
+    (5, "CREATE RANGE INDEX product_units_sold IF NOT EXISTS FOR (p:Product) ON (p.unitsSold)"),
+    (5, "CREATE RANGE INDEX product_order_count IF NOT EXISTS FOR (p:Product) ON (p.orderCount)"),
+    (5, "CREATE RANGE INDEX product_brand_favorite_count IF NOT EXISTS FOR (p:Product) ON (p.brand, p.favoriteCount)"),
+    (5, "CREATE RANGE INDEX product_brand_units_sold IF NOT EXISTS FOR (p:Product) ON (p.brand, p.unitsSold)"),
+    (5, "CREATE RANGE INDEX product_brand_order_count IF NOT EXISTS FOR (p:Product) ON (p.brand, p.orderCount)"),
+    # Native datetime order dates, and the index behind a buyer's order history
+    (6, MIGRATE_ORDER_DATES),
+    (6, "CREATE RANGE INDEX order_buyer_date IF NOT EXISTS FOR (o:Order) ON (o.buyerId, o.date)"),
+    # Stock shards stamped by create_order, read by the catalog snapshot refresh
+    (7, "CREATE RANGE INDEX stock_shard_updated_at IF NOT EXISTS FOR (s:StockShard) ON (s.updatedAt)"),
+    # The sharded products, which listings filtering on stock also read
+    (8, "CREATE RANGE INDEX product_stock_shards IF NOT EXISTS FOR (p:Product) ON (p.stockShards)"),
+]
+
+# Indexes (including the ones backing uniqueness constraints) that every
+# operation module relies on
+EXPECTED_INDEXES = [
+    'user_id_unique',
+    'user_cpf_unique',
+    'product_id_unique',
+    'order_id_unique',
+    'product_price',
+    'product_stock',
+    'order_date',
+    'product_search',
+    'product_price_id',
+    'product_updated_at',
+    'product_favorite_count',
+    'product_units_sold',
+    'product_order_count',
+    'product_brand_favorite_count',
+    'product_brand_units_sold',
+    'product_brand_order_count',
+    'order_buyer_date',
+    'stock_shard_updated_at',
+    'product_stock_shards',
+]
+
+SCHEMA_VERSION_QUERY = """
+MATCH (s:SchemaVersion {id: 'schema'})
+RETURN s.version
+"""
+
+SET_SCHEMA_VERSION_QUERY = """
+MERGE (s:SchemaVersion {id: 'schema'})
+SET s.version = $version
+"""
+
+SHOW_INDEXES_QUERY = """
+SHOW INDEXES
+YIELD name, state, populationPercent
+RETURN name, state, populationPercent
+"""
+
+
+def schema_version_from_result(result):
+    """The version read by SCHEMA_VERSION_QUERY (0 if never applied)"""
+    if not result or result[0][0] is None:
+        return 0
+
+    return result[0][0]
+
+
+def schema_statements_after(current_version):
+    """The statements upgrading a database at current_version to SCHEMA_VERSION, in order"""
+    return [statement for version, statement in SCHEMA_STATEMENTS if version > current_version]
+
+
+def get_schema_version(driver):
+    """Get the schema version recorded in the database (0 if never applied)"""
+    return schema_version_from_result(driver.run_query(SCHEMA_VERSION_QUERY, operation='schema.version'))
+
+
+def local_timezone():
+    """UTC offset of this host's local time, e.g. '-03:00'"""
+    offset = datetime.now().astimezone().strftime('%z')
+    return f"{offset[:3]}:{offset[3:5]}"
+
+
+def order_timezone(legacy_order_timezone=None):
+    """
+    tzinfo of the zone naive order dates are local times of (an IANA name or
+    a UTC offset such as '-03:00'; this host's by default), for the
+    migration and for loaders reading naive dates alike
+    """
+    zone = legacy_order_timezone or local_timezone()
+    if zone[:1] in ('+', '-'):
+        sign = -1 if zone[0] == '-' else 1
+        hours, _, minutes = zone[1:].partition(':')
+        return pytz.FixedOffset(sign * (int(hours) * 60 + int(minutes or 0)))
+    return pytz.timezone(zone)
+
+
+def schema_parameters(legacy_order_timezone=None):
+    """Parameters of the schema statements ($tz: zone of the naive order dates, this host's by default)"""
+    return {'tz': legacy_order_timezone or local_timezone()}
+
+
+def ensure_schema(driver, legacy_order_timezone=None):
+    """
+    Apply every schema statement newer than the recorded schema version
+
+    Args:
+        driver: Neo4j connection driver
+        legacy_order_timezone: Time zone the old naive order dates were
+            written in (this host's UTC offset if None)
+
+    Returns:
+        int: Schema version after the upgrade
+    """
+    current_version = get_schema_version(driver)
+
+    if current_version >= SCHEMA_VERSION:
+        return current_version
+
+    params = schema_parameters(legacy_order_timezone)
+    for statement in schema_statements_after(current_version):
+        driver.run_query(statement, params, operation='schema.apply')
+
+    driver.run_query(SET_SCHEMA_VERSION_QUERY, {'version': SCHEMA_VERSION}, operation='schema.version')
+
+    print(f"Schema upgraded from version {current_version} to {SCHEMA_VERSION}")
+    return SCHEMA_VERSION
+
+
+def check_indexes(driver):
+    """
+    Report expected indexes that are missing or not yet online
+
+    Args:
+        driver: Neo4j connection driver
+
+    Returns:
+        dict: 'missing' names and 'building' entries with their population percent
+    """
+    result = driver.run_query(SHOW_INDEXES_QUERY, operation='schema.show_indexes')
+
+    indexes = {record[0]: (record[1], record[2]) for record in result}
+
+    missing = []
+    building = []
+    for name in EXPECTED_INDEXES:
+        if name not in indexes:
+            missing.append(name)
+            continue
+
+        state, population_percent = indexes[name]
+        if state != 'ONLINE':
+            building.append({
+                'name': name,
+                'state': state,
+                'populationPercent': population_percent
+            })
+
+    return {'missing': missing, 'building': building}
+
+
+def print_index_report(driver):
+    """Print the index check in a readable way"""
+    report = check_indexes(driver)
+
+    if not report['missing'] and not report['building']:
+        print("All indexes are online")
+        return report
+
+    for name in report['missing']:
+        print(f"Missing index: {name}")
+
+    for index in report['building']:
+        print(f"Index {index['name']} is {index['state']} ({index['populationPercent']:.1f}%)")
+
+    return report
@@ -0,0 +1,170 @@
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+
+from neo4j import READ_ACCESS, WRITE_ACCESS
+
+# Plan operators that usually mean a missing index or a badly shaped pattern
+FLAGGED_OPERATORS = ('AllNodesScan', 'NodeByLabelScan', 'CartesianProduct')
+
+_COMMENT = re.compile(r'//[^\n]*')
+_STRING = re.compile(r"'(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"")
+_NUMBER = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?\b')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_query(query):
+    """Query text with comments, literals and layout removed, used to deduplicate entries"""
+    query = _STRING.sub('?', query)
+    query = _COMMENT.sub(' ', query)
+    query = _NUMBER.sub('?', query)
+    return _SPACE.sub(' ', query).strip()
+
+
+def describe_parameters(parameters):
+    """Parameter names and types only; values may hold CPFs or passwords"""
+    return ', '.join(f"{name}: {type(value).__name__}" for name, value in sorted(parameters.items())) or '-'
+
+
+def _operator(plan):
+    # Servers may suffix the runtime ('NodeByLabelScan@neo4j')
+    return plan.get('operatorType', '?').split('@')[0]
+
+
+def _arguments(plan):
+    return plan.get('args') or plan.get('arguments') or {}
+
+
+def plan_lines(plan, depth=0):
+    """Indented text of a plan tree, with rows and db hits when profiled"""
+    arguments = _arguments(plan)
+    parts = ['  ' * depth + _operator(plan)]
+
+    if 'rows' in plan:
+        parts.append(f"rows={plan['rows']}")
+    if 'dbHits' in plan:
+        parts.append(f"dbHits={plan['dbHits']}")
+    if arguments.get('EstimatedRows') is not None:
+        parts.append(f"estimatedRows={arguments['EstimatedRows']:.0f}")
+    if arguments.get('Details'):
+        parts.append(f"| {arguments['Details']}")
+
+    lines = [' '.join(parts)]
+    for child in plan.get('children', ()):
+        lines.extend(plan_lines(child, depth + 1))
+    return lines
+
+
+def flagged_operators(plan):
+    """Names of FLAGGED_OPERATORS found anywhere in the plan"""
+    found = []
+    operator = _operator(plan)
+    if operator in FLAGGED_OPERATORS:
+        found.append(operator)
+    for child in plan.get('children', ()):
+        found.extend(flagged_operators(child))
+    return found
+
+
+def total_db_hits(plan):
+    return plan.get('dbHits', 0) + sum(total_db_hits(child) for child in plan.get('children', ()))
+
+
+class SlowQueryLog:
+    """
+    Capture the plan of statements slower than threshold_ms
+
+    The plan comes from EXPLAIN, which only plans the statement. With
+    profile_reads a slow read is instead re-run with PROFILE (db hits and
+    rows per operator), which executes it again; writes always get EXPLAIN
+    so nothing is written twice. Each normalized query is captured at most
+    once per dedupe_seconds; later occurrences are only counted and
+    reported with the next capture. Captures run one at a time on a
+    background thread, never in the caller's, and entries go to a
+    size-rotated local file.
+    """
+
+    def __init__(self, threshold_ms, path, max_bytes=1048576, backups=5, profile_reads=False,
+                 dedupe_seconds=3600.0):
+        self.threshold_ms = threshold_ms
+        self.profile_reads = profile_reads
+        self.dedupe_seconds = dedupe_seconds
+        self._captured = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+        self._captures = ThreadPoolExecutor(1, thread_name_prefix='slow-query-plan')
+
+        # A private logger, so entries never reach the application's handlers
+        self.logger = logging.Logger('neo4j.slow_queries')
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                      encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.logger.addHandler(handler)
+
+    def observe(self, connection, operation, query, parameters, client_ms, read_only):
+        """Called for every statement; queues the capture of its plan if it was slow"""
+        if client_ms < self.threshold_ms:
+            return
+
+        key = normalize_query(query)
+        now = time.monotonic()
+
+        with self._lock:
+            last = self._captured.get(key)
+            if last is not None and now - last < self.dedupe_seconds:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return
+            self._captured[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+
+        try:
+            self._captures.submit(self._capture, connection, operation, key, query, parameters, client_ms,
+                                  read_only, suppressed)
+        except RuntimeError:
+            pass  # closed: the connection is going away
+
+    def close(self):
+        """Drop the captures still queued and wait for the one running, if any"""
+        self._captures.shutdown(wait=True, cancel_futures=True)
+
+    def _capture(self, connection, operation, key, query, parameters, client_ms, read_only, suppressed):
+        mode = 'PROFILE' if read_only and self.profile_reads else 'EXPLAIN'
+        try:
+            plan = self.capture_plan(connection, mode, query, parameters, read_only)
+            error = None
+        except Exception as e:
+            plan, error = None, e
+
+        self.logger.warning(self.format_entry(operation, key, parameters, client_ms, mode, plan, error,
+                                              suppressed))
+
+    @staticmethod
+    def capture_plan(connection, mode, query, parameters, read_only):
+        """Run the statement again under EXPLAIN or PROFILE and return its plan tree"""
+        with connection.session(READ_ACCESS if read_only else WRITE_ACCESS) as session:
+            summary = session.run(f"{mode} {query}", parameters).consume()
+        return summary.profile if mode == 'PROFILE' else summary.plan
+
+    @staticmethod
+    def format_entry(operation, normalized_query, parameters, client_ms, mode, plan, error, suppressed):
+        header = f"SLOW {client_ms:.1f} ms operation={operation or 'unnamed'} plan={mode}"
+        if suppressed:
+            header += f" (another {suppressed} slow runs since the last capture)"
+
+        lines = [header, f"  query: {normalized_query}", f"  parameters: {describe_parameters(parameters)}"]
+
+        if plan is None:
+            lines.append(f"  plan unavailable: {error}")
+            return '\n'.join(lines)
+
+        flagged = flagged_operators(plan)
+        if flagged:
+            lines.append(f"  flagged operators: {', '.join(sorted(set(flagged)))}")
+        if mode == 'PROFILE':
+            lines.append(f"  total db hits: {total_db_hits(plan)}")
+
+        lines.extend('    ' + line for line in plan_lines(plan))
+        return '\n'.join(lines)
@@ -1,11 +1,110 @@
-
 import uuid
 
-def insert_user(driver, name, last_name, email, cpf, password, addresses=None, is_seller=False, 
+from batching import DEFAULT_BATCH_SIZE, run_batches
+from identity_cache import NOT_FOUND
+from models import user_from_record
+
+# Cypher statements are module constants so the async counterparts in
+# async_user_operations.py run exactly the same queries
+
+INSERT_USER_QUERY = """
+CREATE (u:User $props)
+RETURN u.id
+"""
+
+ADD_ADDRESS_QUERY = """
+MATCH (u:User {id: $userId})
+CREATE (a:Address $addressProps)
+CREATE (u)-[:HAS_ADDRESS]->(a)
+RETURN a
+"""
+
+FIND_USER_BY_CPF_QUERY = """
+MATCH (u:User {cpf: $cpf})
+RETURN u.id, u.name, u.lastName
+"""
+
+INSERT_USERS_BULK_QUERY = """
+UNWIND $rows AS row
+CREATE (u:User)
+SET u = row.props
+FOREACH (address IN row.addresses |
+    CREATE (u)-[:HAS_ADDRESS]->(a:Address)
+    SET a = address
+)
+"""
+
+def new_user_props(name, last_name, email, cpf, password, is_seller=False, company_name=None, cnpj=None):
+    """Build the properties of a new User node"""
+    user_props = {
+        'id': str(uuid.uuid4()),
+        'name': name,
+        'lastName': last_name,
+        'email': email,
+        'cpf': cpf,
+        'password': password,
+        'isSeller': is_seller
+    }
+
+    if is_seller and company_name and cnpj:
+        user_props['companyName'] = company_name
+        user_props['cnpj'] = cnpj
+
+    return user_props
+
+def address_props(street, number, neighborhood, state, zip_code):
+    """Build the properties of a new Address node"""
+    return {
+        'street': street,
+        'number': number,
+        'neighborhood': neighborhood,
+        'state': state,
+        'zipCode': zip_code
+    }
+
+def forget_cpfs(driver, cpfs):
+    """Invalidate cached identities after users with these CPFs were created"""
+    cache = getattr(driver, 'identity_cache', None)
+    if cache is not None:
+        for cpf in cpfs:
+            cache.invalidate(cpf)
+
+def find_user_by_cpf(driver, cpf):
+    """
+    Resolve a CPF to the user's identity, through the identity cache
+
+    Args:
+        driver: Neo4j connection driver
+        cpf: User's CPF
+
+    Returns:
+        User: The user's id, name and last name, or None if not found
+    """
+    cache = getattr(driver, 'identity_cache', None)
+
+    if cache is not None:
+        identity = cache.get(cpf)
+        if identity is NOT_FOUND:
+            return None
+        if identity is not None:
+            return identity
+
+    result = driver.read_query(FIND_USER_BY_CPF_QUERY, {'cpf': cpf}, operation='find_user_by_cpf')
+
+    identity = None
+    if result and result[0]:
+        identity = user_from_record(result[0])
+
+    if cache is not None:
+        cache.put(cpf, identity if identity is not None else NOT_FOUND)
+
+    return identity
+
+def insert_user(driver, name, last_name, email, cpf, password, addresses=None, is_seller=False,
                 company_name=None, cnpj=None):
     """
     Insert a user into Neo4j
-    
+
     Args:
         driver: Neo4j connection driver
         name: User's first name
@@ -17,81 +116,83 @@ def insert_user(driver, name, last_name, email, cpf, password, addresses=None, i
         is_seller: Whether the user is a seller
         company_name: Company name (for sellers)
         cnpj: CNPJ (for sellers)
-        
+
     Returns:
         str: ID of the created user, or None if creation failed
     """
-   
-    user_id = str(uuid.uuid4())
-    
- 
-    user_props = {
-        'id': user_id,
-        'name': name,
-        'lastName': last_name,
-        'email': email,
-        'cpf': cpf,
-        'password': password,
-        'isSeller': is_seller
-    }
-    
-  
-    if is_seller and company_name and cnpj:
-        user_props['companyName'] = company_name
-        user_props['cnpj'] = cnpj
-    
-   
-    query = """
-    CREATE (u:User $props)
-    RETURN u.id
-    """
-    
-    result = driver.run_query(query, {'props': user_props})
-    
+    user_props = new_user_props(name, last_name, email, cpf, password, is_seller, company_name, cnpj)
+    user_id = user_props['id']
+
+    result = driver.write_query(INSERT_USER_QUERY, {'props': user_props}, operation='insert_user')
+
     if not result:
         return None
-    
-   
+
+    forget_cpfs(driver, [cpf])
+
+
     if addresses:
         for address in addresses:
-            add_user_address(driver, user_id, 
-                            address['street'], 
-                            address['number'], 
-                            address['neighborhood'], 
-                            address['state'], 
+            add_user_address(driver, user_id,
+                            address['street'],
+                            address['number'],
+                            address['neighborhood'],
+                            address['state'],
                             address['zipCode'])
-    
+
     print(f"User created with ID: {user_id}")
     return user_id
 
 def add_user_address(driver, user_id, street, number, neighborhood, state, zip_code):
     """Add an address to a user"""
-   
-    address_props = {
-        'street': street,
-        'number': number,
-        'neighborhood': neighborhood,
-        'state': state,
-        'zipCode': zip_code
-    }
-    
-   
-    query = """
-    MATCH (u:User {id: $userId})
-    CREATE (a:Address $addressProps)
-    CREATE (u)-[:HAS_ADDRESS]->(a)
-    RETURN a
-    """
-    
     params = {
         'userId': user_id,
-        'addressProps': address_props
+        'addressProps': address_props(street, number, neighborhood, state, zip_code)
     }
-    
-    result = driver.run_query(query, params)
-    
+
+    result = driver.write_query(ADD_ADDRESS_QUERY, params, operation='add_user_address')
+
     if not result:
         return False
-    
+
     print(f"Address added to user {user_id}")
-    return True
\ No newline at end of file
+    return True
+
+def _user_bulk_params(user):
+    """Convert an insert_user-style dictionary into bulk query parameters"""
+    user_props = new_user_props(user['name'], user['last_name'], user['email'], user['cpf'],
+                                user['password'], bool(user.get('is_seller', False)),
+                                user.get('company_name'), user.get('cnpj'))
+
+    addresses = []
+    for address in user.get('addresses') or []:
+        addresses.append(address_props(address['street'], address['number'], address['neighborhood'],
+                                       address['state'], address['zipCode']))
+
+    return {'props': user_props, 'addresses': addresses}
+
+def insert_users_bulk(driver, users, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert many users (and their addresses) with batched UNWIND writes
+
+    Args:
+        driver: Neo4j connection driver
+        users: Iterable of dictionaries with the insert_user arguments
+               (name, last_name, email, cpf, password, addresses, is_seller,
+               company_name, cnpj); it is consumed lazily
+        batch_size: Number of users written per transaction
+
+    Returns:
+        dict: Load report with 'written', 'failed', 'seconds' and 'rows_per_sec'
+    """
+    report = run_batches(driver, INSERT_USERS_BULK_QUERY, users, _user_bulk_params, batch_size, label='users',
+                         operation='insert_users_bulk')
+    report.pop('records')
+
+    # A CPF may have been cached as missing before this load
+    cache = getattr(driver, 'identity_cache', None)
+    if cache is not None and report['written']:
+        cache.clear()
+
+    print(f"Users loaded: {report['written']} ({report['rows_per_sec']:.0f} rows/s), failed: {len(report['failed'])}")
+    return report